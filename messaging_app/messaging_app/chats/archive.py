@@ -0,0 +1,45 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ArchivedMessage, Message
+
+ARCHIVE_FIELDS = ["message_id", "conversation_id", "sender_id_id", "recipient_id_id", "message_body", "sent_at", "read_at", "deleted_at"]
+
+
+def archive_cutoff(now=None):
+    """
+    Messages sent before this moment belong in the archive.
+    """
+    return (now or timezone.now()) - timedelta(days=getattr(settings, "MESSAGES_ARCHIVE_AFTER_DAYS", 180))
+
+
+def archive_batch(cutoff, batch_size=1000):
+    """
+    Move up to ``batch_size`` of the oldest messages sent before ``cutoff``
+    into the archive and return how many were moved.
+
+    Each batch copies and deletes in one transaction, so an interrupted run
+    leaves every message in exactly one table and simply resumes from the
+    oldest message still in the hot table. Deleting the originals fires the
+    usual signals: their search tokens go with them and unread ones come
+    off the unread counters, as they can no longer be marked read.
+    """
+    with transaction.atomic():
+        messages = list(Message.objects.with_deleted().filter(sent_at__lt=cutoff).order_by("sent_at", "message_id")[:batch_size])
+        if not messages:
+            return 0
+        ArchivedMessage.objects.bulk_create([ArchivedMessage(**{field: getattr(message, field) for field in ARCHIVE_FIELDS}) for message in messages], ignore_conflicts=True)
+        Message.objects.with_deleted().filter(pk__in=[message.pk for message in messages]).delete()
+    return len(messages)
+
+
+def merge_pages(*pages, reverse=False, limit=None):
+    """
+    Merge message lists from the hot table and the archive into one page in
+    (sent_at, message_id) order, newest first when ``reverse`` is set.
+    """
+    merged = sorted((message for page in pages for message in page), key=lambda message: (message.sent_at, message.message_id), reverse=reverse)
+    return merged[:limit] if limit is not None else merged
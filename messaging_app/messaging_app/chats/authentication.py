@@ -0,0 +1,170 @@
+"""
+Authentication of chats users: email and password over HTTP Basic, or a
+bearer token from UserToken.
+"""
+
+import copy
+import hashlib
+import hmac
+from urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.utils import timezone
+from rest_framework import authentication, exceptions
+
+from .cache import TTLCache
+from .models import User, UserToken
+
+credential_cache = TTLCache(maxsize=getattr(settings, "CREDENTIAL_CACHE_SIZE", 10000), ttl=getattr(settings, "CREDENTIAL_CACHE_TTL", 60), name="credentials")
+
+token_cache = TTLCache(maxsize=getattr(settings, "TOKEN_CACHE_SIZE", 10000), ttl=getattr(settings, "TOKEN_CACHE_TTL", 60), name="tokens")
+
+
+def credential_key(email, password):
+    # Keyed with SECRET_KEY: without it the cache keys are useless for testing password guesses
+    return hmac.new(settings.SECRET_KEY.encode(), f"{email}\0{password}".encode(), hashlib.sha256).hexdigest()
+
+
+def verify_credentials(email, password):
+    """
+    The user with ``email`` if ``password`` is theirs, otherwise None.
+
+    A successful check is remembered for CREDENTIAL_CACHE_TTL seconds along
+    with the hash it was made against, so repeated requests skip the KDF
+    while a password change still takes effect at once. Failures are never
+    cached: every guess pays the full hashing cost. A hash made by anything
+    but the preferred hasher is upgraded on success.
+    """
+    user = User.objects.filter(email=email).first()
+    if user is None:
+        # Hash anyway, so response times do not tell which emails exist
+        User().set_password(password)
+        return None
+
+    key = credential_key(email, password)
+    if credential_cache.get(key) == user.password:
+        return user
+    if not user.check_password(password) or not user.is_active:
+        return None
+    credential_cache.set(key, user.password)
+    return user
+
+
+class CachedBasicAuthentication(authentication.BasicAuthentication):
+    """
+    HTTP Basic authentication with the user's email and password, through ``verify_credentials``.
+    """
+
+    def authenticate_credentials(self, userid, password, request=None):
+        user = verify_credentials(userid, password)
+        if user is None:
+            raise exceptions.AuthenticationFailed("Invalid email/password.")
+        return (user, None)
+
+
+def token_key(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def get_token_user(token, now=None):
+    """
+    The user a valid bearer ``token`` belongs to, otherwise None.
+
+    A token is valid until ``token_expire_at`` unless it or its user is
+    deleted or it is marked used (revoked). Answers are cached per process, a valid one for at most
+    TOKEN_CACHE_TTL seconds and never past the token's expiry, an invalid
+    one for TOKEN_NEGATIVE_CACHE_TTL seconds. Each caller gets its own copy
+    of the cached user.
+    """
+    now = now or timezone.now()
+    key = token_key(token)
+    cached = token_cache.get(key)
+    if cached is None:
+        row = UserToken.objects.select_related("user_id").filter(token=token, is_used=False, token_expire_at__gt=now, user_id__deleted_at__isnull=True).first()
+        if row is None:
+            cached = False
+            token_cache.set(key, cached, getattr(settings, "TOKEN_NEGATIVE_CACHE_TTL", 30))
+        else:
+            cached = (row.user_id, row.token_expire_at)
+            token_cache.set(key, cached, min(getattr(settings, "TOKEN_CACHE_TTL", 60), (row.token_expire_at - now).total_seconds()))
+
+    if cached is False or cached[1] <= now:
+        return None
+    return copy.copy(cached[0])
+
+
+def forget_tokens(tokens):
+    for token in tokens:
+        token_cache.delete(token_key(token))
+
+
+def forget_user_tokens(user_ids):
+    """
+    Drop cached answers for every token of these users, so a changed or deleted user is reloaded.
+    """
+    forget_tokens(UserToken.objects.with_deleted().filter(user_id__in=list(user_ids)).values_list("token", flat=True))
+
+
+def revoke_tokens(tokens):
+    """
+    Mark a queryset of tokens used; they stop working in this process at
+    once and in the others within TOKEN_CACHE_TTL seconds.
+    """
+    revoked = list(tokens.filter(is_used=False).values_list("token", flat=True))
+    UserToken.objects.filter(token__in=revoked).update(is_used=True)
+    forget_tokens(revoked)
+    return len(revoked)
+
+
+class UserTokenAuthentication(authentication.BaseAuthentication):
+    """
+    ``Authorization: Bearer <token>`` against UserToken, through ``get_token_user``.
+    """
+
+    keyword = "Bearer"
+
+    def authenticate(self, request):
+        auth = authentication.get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise exceptions.AuthenticationFailed("Invalid token header.")
+        try:
+            token = auth[1].decode()
+        except UnicodeError:
+            raise exceptions.AuthenticationFailed("Invalid token header.")
+
+        user = get_token_user(token)
+        if user is None:
+            raise exceptions.AuthenticationFailed("Invalid or expired token.")
+        return (user, token)
+
+    def authenticate_header(self, request):
+        return f'{self.keyword} realm="api"'
+
+
+def websocket_token(scope):
+    """
+    The bearer token of a WebSocket handshake: the ``bearer, <token>`` pair
+    of subprotocols, which browsers can set, or a ``token`` query parameter.
+    """
+    subprotocols = scope.get("subprotocols") or []
+    if len(subprotocols) == 2 and subprotocols[0].lower() == "bearer":
+        return subprotocols[1]
+    values = parse_qs(scope.get("query_string", b"").decode("latin-1")).get("token")
+    return values[0] if values else None
+
+
+class TokenAuthMiddleware(BaseMiddleware):
+    """
+    Set ``scope["user"]`` of a WebSocket connection from its UserToken,
+    through ``get_token_user``; anonymous without a valid token.
+    """
+
+    async def __call__(self, scope, receive, send):
+        token = websocket_token(scope)
+        user = await database_sync_to_async(get_token_user)(token) if token else None
+        return await super().__call__(dict(scope, user=user or AnonymousUser()), receive, send)
@@ -0,0 +1,116 @@
+"""
+Shared authorization lookups for the chats viewsets.
+
+Participant membership is cached in a process-local LRU with a TTL and, when
+AUTHORIZATION_CACHE names an entry in CACHES, in that shared cache as well.
+Entries are dropped whenever Conversation.participants changes (see
+chats.signals); other worker processes fall back to the TTL, which bounds
+how long a removed participant can keep access.
+"""
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .cache import TTLCache
+from .models import Conversation
+
+local_cache = TTLCache(maxsize=getattr(settings, "AUTHORIZATION_CACHE_SIZE", 10000), ttl=getattr(settings, "AUTHORIZATION_CACHE_TTL", 30), name="authorization")
+
+
+def get_shared_cache():
+    alias = getattr(settings, "AUTHORIZATION_CACHE", None)
+    return caches[alias] if alias else None
+
+
+def participant_key(conversation_id, user_id):
+    return f"chats:participant:{conversation_id}:{user_id}"
+
+
+def conversation_key(conversation_id):
+    return f"chats:conversation:{conversation_id}"
+
+
+def cached_lookup(key, compute, cache_negative=True):
+    value = local_cache.get(key)
+    if value is not None:
+        return value
+
+    shared = get_shared_cache()
+    if shared is not None:
+        value = shared.get(key)
+
+    if value is None:
+        value = compute()
+        if shared is not None and (value or cache_negative):
+            shared.set(key, value, local_cache.ttl)
+
+    if value or cache_negative:
+        local_cache.set(key, value)
+    return value
+
+
+def get_role(user, default="guest"):
+    """
+    The user's role; it is loaded with the authenticated user, so no lookup is needed.
+    """
+    return getattr(user, "role", default)
+
+
+def conversation_exists(conversation_id):
+    # Only positive answers are cached: a conversation can appear but its ID is
+    # never reused. Deleting one drops the answer (forget_conversation).
+    return cached_lookup(conversation_key(conversation_id), lambda: Conversation.objects.filter(conversation_id=conversation_id).exists(), cache_negative=False)
+
+
+def is_participant(user, conversation_id):
+    def compute():
+        return Conversation.participants.through.objects.filter(conversation_id=conversation_id, user_id=user.pk).exists()
+
+    return cached_lookup(participant_key(conversation_id, user.pk), compute)
+
+
+def can_access_conversation(user, conversation_id):
+    """
+    Admins may open any existing conversation, everybody else only those they take part in.
+    """
+    if get_role(user) == "admin":
+        return conversation_exists(conversation_id)
+    return is_participant(user, conversation_id)
+
+
+def visible_messages(queryset, user, conversation_id):
+    """
+    The messages of the conversation ``user`` may read: all of them for
+    admins, otherwise only those they sent. Shared by the nested message
+    endpoint and the conversation export.
+    """
+    if not user.is_authenticated:
+        return queryset.none()
+    queryset = queryset.filter(conversation_id=conversation_id)
+    if get_role(user) == "admin":
+        return queryset
+    return queryset.filter(sender_id=user.user_id)
+
+
+def forget_keys(keys):
+    for key in keys:
+        local_cache.delete(key)
+
+    shared = get_shared_cache()
+    if shared is not None and keys:
+        shared.delete_many(keys)
+
+
+def forget_participants(pairs):
+    """
+    Drop cached membership answers for ``(conversation_id, user_id)`` pairs.
+    """
+    forget_keys([participant_key(conversation_id, user_id) for conversation_id, user_id in pairs])
+
+
+def forget_conversation(conversation_id, user_ids):
+    """
+    Drop the cached existence of a deleted conversation and its participants'
+    membership; the cascade removes participants without any m2m_changed.
+    """
+    forget_keys([conversation_key(conversation_id), *(participant_key(conversation_id, user_id) for user_id in user_ids)])
@@ -0,0 +1,56 @@
+from datetime import timedelta
+
+from django.db.models import Exists, OuterRef, Q
+
+from .models import Property, PropertyNight
+
+
+def nights_between(start_date, end_date):
+    """
+    Nights covered by a stay: every date from check-in up to, but not
+    including, check-out. A same-day stay still takes its first night.
+    """
+    nights = max((end_date - start_date).days, 1)
+    return [start_date + timedelta(days=offset) for offset in range(nights)]
+
+
+def sync_booking_nights(booking):
+    """
+    Bring the PropertyNight rows of ``booking`` in line with its dates, property and status.
+    """
+    held = PropertyNight.objects.filter(booking_id=booking.booking_id)
+    if booking.booking_status == "cancelled":
+        held.delete()
+        return
+
+    wanted = set(nights_between(booking.start_date, booking.end_date))
+    held.exclude(property_id=booking.property_id_id, night__in=wanted).delete()
+
+    existing = set(held.values_list("night", flat=True))
+    PropertyNight.objects.bulk_create(
+        [PropertyNight(property_id_id=booking.property_id_id, booking_id_id=booking.booking_id, night=night) for night in sorted(wanted - existing)],
+        ignore_conflicts=True,
+    )
+
+
+def available_properties(city, check_in, check_out, country=None, max_price=None):
+    """
+    Properties in ``city`` that are free for every night of [check_in, check_out),
+    cheapest first.
+    """
+    taken = PropertyNight.objects.filter(property_id=OuterRef("pk"), night__gte=check_in, night__lt=check_out)
+
+    queryset = Property.objects.select_related("location_id").filter(location_id__city=city, availability_status="available")
+    if country:
+        queryset = queryset.filter(location_id__country=country)
+    if max_price is not None:
+        queryset = queryset.filter(price_per_night__lte=max_price)
+
+    return queryset.filter(~Exists(taken)).order_by("price_per_night", "property_id")
+
+
+def after_cursor(queryset, price, property_id):
+    """
+    Keyset continuation of an ``available_properties`` queryset.
+    """
+    return queryset.filter(Q(price_per_night__gt=price) | Q(price_per_night=price, property_id__gt=property_id))
@@ -0,0 +1,159 @@
+"""
+Synthetic data and per-endpoint measurements for ``manage.py benchmark_api``.
+"""
+
+import math
+import random
+import time
+import uuid
+from datetime import timedelta
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .ingest import ingest_messages
+from .models import Conversation, User
+
+# Per-endpoint limits checked after a run. ``queries`` and ``bytes`` apply to
+# the worst request, ``p95_ms`` to the latency percentile. A --budgets file
+# overrides these key by key.
+DEFAULT_BUDGETS = {
+    "users-list": {"queries": 1, "p95_ms": 500},
+    "users-detail": {"queries": 1, "p95_ms": 50},
+    "conversations-list": {"queries": 2, "p95_ms": 500},
+    "conversations-detail": {"queries": 2, "p95_ms": 50},
+    "messages-list": {"queries": 3, "p95_ms": 100, "bytes": 256 * 1024},
+}
+
+
+class Dataset:
+    """
+    What ``generate_dataset`` created: an admin, the guest who takes part in
+    every conversation, and the conversations themselves.
+    """
+
+    def __init__(self, admin, member, conversation_ids, users, messages):
+        self.admin = admin
+        self.member = member
+        self.conversation_ids = conversation_ids
+        self.users = users
+        self.messages = messages
+
+
+def generate_dataset(users=100, conversations=50, participants=2, messages=100, seed=None, batch_size=1000):
+    """
+    Create ``users`` users, ``conversations`` conversations of ``participants``
+    members each and ``messages`` messages per conversation, spread over the
+    last 30 days.
+
+    Rows are bulk inserted; messages go through ``ingest_messages`` so the
+    search index and unread counters match what the API would have built.
+    """
+    rng = random.Random(seed)
+    run = uuid.UUID(int=rng.getrandbits(128)).hex[:8]
+    participants = max(participants, 2)
+    # The admin takes part in nothing, so everyone else must fill a conversation
+    users = max(users, participants + 1)
+
+    def make_user(index, role):
+        return User(email=f"bench-{run}-{index}@example.com", role=role, first_name="Bench", last_name=str(index), password="!", password_hash="!", phone_number="0700000000")
+
+    people = [make_user(0, "admin"), make_user(1, "guest")] + [make_user(i, rng.choice(["host", "guest"])) for i in range(2, users)]
+    User.objects.bulk_create(people, batch_size=batch_size)
+    admin, member = people[0], people[1]
+
+    rooms = Conversation.objects.bulk_create([Conversation() for _ in range(conversations)], batch_size=batch_size)
+    members = {}
+    memberships = []
+    for room in rooms:
+        # The benchmark guest is in every conversation, so its inbox is the largest
+        chosen = [member] + rng.sample(people[2:], participants - 1)
+        members[room.pk] = chosen
+        memberships.extend(Conversation.participants.through(conversation_id=room.pk, user_id=user.pk) for user in chosen)
+    Conversation.participants.through.objects.bulk_create(memberships, batch_size=batch_size)
+
+    now = timezone.now()
+    items, created = [], 0
+    for room in rooms:
+        for index in range(messages):
+            sender, recipient = rng.sample(members[room.pk], 2)
+            sent_at = now - timedelta(days=30) + timedelta(seconds=index * 30 * 86400 // max(messages, 1))
+            items.append({"conversation": room.pk, "sender": sender.pk, "recipient": recipient.pk, "message_body": f"benchmark message {index} in {run}", "sent_at": sent_at.isoformat()})
+            if len(items) >= batch_size:
+                created += ingest_messages(items, admin, allow_sender=True, batch_size=batch_size)[0]
+                items = []
+    if items:
+        created += ingest_messages(items, admin, allow_sender=True, batch_size=batch_size)[0]
+
+    return Dataset(admin, member, [room.pk for room in rooms], len(people), created)
+
+
+def endpoints(dataset):
+    """
+    ``(name, user, path)`` for each endpoint measured.
+    """
+    conversation_id = dataset.conversation_ids[0] if dataset.conversation_ids else uuid.uuid4()
+    return [
+        ("users-list", dataset.admin, "/api/users/"),
+        ("users-detail", dataset.member, f"/api/users/{dataset.member.pk}/"),
+        ("conversations-list", dataset.member, "/api/conversations/"),
+        ("conversations-detail", dataset.member, f"/api/conversations/{conversation_id}/"),
+        ("messages-list", dataset.member, f"/api/conversations/{conversation_id}/messages/"),
+    ]
+
+
+def percentile(values, fraction):
+    """
+    Nearest-rank percentile of ``values``.
+    """
+    ordered = sorted(values)
+    return ordered[max(math.ceil(fraction * len(ordered)) - 1, 0)]
+
+
+def measure(user, path, iterations=50, warmup=2, using=DEFAULT_DB_ALIAS):
+    """
+    GET ``path`` as ``user`` and summarise latency, queries and response size.
+
+    Warm-up requests fill the per-process caches and are not recorded.
+    """
+    client = APIClient()
+    client.force_authenticate(user=user)
+    for _ in range(warmup):
+        client.get(path)
+
+    timings, queries, sizes, statuses = [], [], [], set()
+    for _ in range(iterations):
+        with CaptureQueriesContext(connections[using]) as captured:
+            started = time.perf_counter()
+            response = client.get(path)
+            timings.append((time.perf_counter() - started) * 1000)
+        queries.append(len(captured))
+        sizes.append(len(response.content))
+        statuses.add(response.status_code)
+
+    return {
+        "path": path,
+        "iterations": iterations,
+        "status": sorted(statuses),
+        "p50_ms": round(percentile(timings, 0.5), 3),
+        "p95_ms": round(percentile(timings, 0.95), 3),
+        "queries": max(queries),
+        "queries_min": min(queries),
+        "bytes": max(sizes),
+    }
+
+
+def over_budget(results, budgets):
+    """
+    Human-readable descriptions of every budget ``results`` exceed.
+    """
+    failures = []
+    for name, result in results.items():
+        if result["status"] != [200]:
+            failures.append(f"{name}: HTTP {', '.join(map(str, result['status']))}")
+        for metric, limit in budgets.get(name, {}).items():
+            if limit is not None and result[metric] > limit:
+                failures.append(f"{name}: {metric} {result[metric]} > {limit}")
+    return failures
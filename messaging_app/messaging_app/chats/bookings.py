@@ -0,0 +1,82 @@
+import random
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import OperationalError, transaction
+from rest_framework import exceptions, status
+
+from .availability import nights_between
+from .coupons import apply_coupon, check_coupon, redeem_coupon
+from .metrics import booking_retries
+from .models import Booking, Property, PropertyNight
+
+CENTS = Decimal("0.01")
+
+
+class BookingConflict(exceptions.APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = "The property is already booked for some of these nights."
+    default_code = "booking_conflict"
+
+
+class BookingBusy(exceptions.APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "The property is being booked by others right now; try again."
+    default_code = "booking_busy"
+
+
+def place_booking(user, property_id, start_date, end_date, coupon_code=None):
+    nights = nights_between(start_date, end_date)
+
+    with transaction.atomic():
+        try:
+            prop = Property.objects.get(property_id=property_id)
+        except Property.DoesNotExist:
+            raise exceptions.ValidationError({"property_id": ["Property does not exist."]})
+        if prop.availability_status != "available":
+            raise BookingConflict("The property is not available for booking.")
+
+        total_price = (prop.price_per_night * len(nights)).quantize(CENTS)
+        if coupon_code:
+            # Cheap cached checks first; the use is only consumed once the nights are ours
+            total_price = apply_coupon(total_price, check_coupon(coupon_code, user, prop))
+
+        booking = Booking(property_id=prop, user_id=user, start_date=start_date, end_date=end_date, total_price=total_price)
+        booking.save()
+
+        # Saving the booking claims its nights (see chats.signals). The
+        # unique (property, night) constraint lets only one of several
+        # overlapping bookings claim a night; whoever comes short rolls back.
+        if PropertyNight.objects.filter(booking_id=booking).count() != len(nights):
+            raise BookingConflict()
+
+        if coupon_code:
+            redeem_coupon(coupon_code, user, prop=prop, booking=booking)
+
+    return booking
+
+
+def create_booking(user, property_id, start_date, end_date, coupon_code=None, retries=None):
+    """
+    Book ``property_id`` for ``user`` from ``start_date`` to ``end_date``,
+    pricing it from price_per_night and an optional coupon.
+
+    Raises BookingConflict if any night is already taken. Lock timeouts and
+    deadlocks between competing inserts are retried up to BOOKING_RETRIES
+    times with a jittered backoff (capped at half a second), then reported
+    as BookingBusy.
+    """
+    if end_date < start_date:
+        raise exceptions.ValidationError({"end_date": ["End date cannot be before start date."]})
+
+    retries = getattr(settings, "BOOKING_RETRIES", 3) if retries is None else retries
+    for attempt in range(retries + 1):
+        try:
+            return place_booking(user, property_id, start_date, end_date, coupon_code=coupon_code)
+        except OperationalError:
+            if attempt == retries:
+                raise BookingBusy()
+            booking_retries.inc()
+            # Jitter keeps the losers of one collision from colliding again
+            time.sleep(random.uniform(0, min(0.01 * 2**attempt, 0.5)))
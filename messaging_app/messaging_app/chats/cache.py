@@ -0,0 +1,61 @@
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+# Caches given a name, whose hit and miss counts chats.metrics reports
+named_caches = {}
+
+
+class TTLCache:
+    """
+    Thread-safe, process-local LRU cache whose entries expire ``ttl`` seconds
+    after they are set. Holds at most ``maxsize`` entries, evicting the least
+    recently used one first.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60, timer=time.monotonic, name=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if name:
+            named_caches[name] = self
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.data.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            value, expires_at = entry
+            if expires_at <= self.timer():
+                del self.data[key]
+                self.misses += 1
+                return default
+            self.data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = self.timer() + (self.ttl if ttl is None else ttl)
+        with self.lock:
+            self.data[key] = (value, expires_at)
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def __len__(self):
+        return len(self.data)
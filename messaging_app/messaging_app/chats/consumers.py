@@ -0,0 +1,36 @@
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+
+from .authorization import get_role, is_participant
+from .realtime import conversation_group_name
+
+
+class ConversationConsumer(AsyncJsonWebsocketConsumer):
+    """
+    Streams new messages of one conversation to its connected participants,
+    limited like the REST endpoint (visible_messages): admins get every
+    message, everybody else only those they sent.
+    """
+
+    async def connect(self):
+        user = self.scope.get("user")
+        conversation_id = self.scope["url_route"]["kwargs"]["conversation_id"]
+
+        if user is None or not user.is_authenticated or not await database_sync_to_async(is_participant)(user, conversation_id):
+            await self.close(code=4403)
+            return
+
+        self.user = user
+        self.group_name = conversation_group_name(conversation_id)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        # A client that sent its token as a subprotocol expects one to be chosen
+        subprotocols = self.scope.get("subprotocols") or []
+        await self.accept(subprotocol=subprotocols[0] if len(subprotocols) == 2 and subprotocols[0].lower() == "bearer" else None)
+
+    async def disconnect(self, code):
+        if hasattr(self, "group_name"):
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def chat_message(self, event):
+        if get_role(self.user) == "admin" or event["sender_id"] == str(self.user.pk):
+            await self.send_json(event["message"])
@@ -0,0 +1,94 @@
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from rest_framework import exceptions
+
+from .cache import TTLCache
+from .models import Coupon, CouponUsage
+
+CENTS = Decimal("0.01")
+
+# code -> Coupon (or False for an unknown code); "exhausted:<code>" -> True
+# once a redemption found no uses left. Saving or deleting a coupon clears
+# its entries in this process, other workers wait for the TTL.
+coupon_cache = TTLCache(maxsize=getattr(settings, "COUPON_CACHE_SIZE", 10000), ttl=getattr(settings, "COUPON_CACHE_TTL", 60), name="coupons")
+
+
+def coupon_error(message):
+    return exceptions.ValidationError({"coupon_code": [message]})
+
+
+def get_coupon(code):
+    """
+    The coupon with ``code``, served from the process-local cache when possible.
+    """
+    coupon = coupon_cache.get(code)
+    if coupon is None:
+        coupon = Coupon.objects.filter(code=code).first() or False
+        coupon_cache.set(code, coupon)
+    return coupon or None
+
+
+def forget_coupon(code):
+    coupon_cache.delete(code)
+    coupon_cache.delete(f"exhausted:{code}")
+
+
+def check_coupon(code, user, prop=None, now=None):
+    """
+    Return the coupon ``code`` if ``user`` may use it on ``prop`` right now,
+    without touching the database for codes that are cached.
+    """
+    coupon = get_coupon(code)
+    if coupon is None:
+        raise coupon_error("Coupon does not exist.")
+
+    now = now or timezone.now()
+    if not coupon.valid_from <= now <= coupon.valid_to:
+        raise coupon_error("Coupon is not valid at this time.")
+    if coupon.property_id_id and (prop is None or coupon.property_id_id != prop.property_id):
+        raise coupon_error("Coupon does not apply to this property.")
+    if coupon.user_id_id and coupon.user_id_id != user.pk:
+        raise coupon_error("Coupon does not apply to this user.")
+    if coupon_cache.get(f"exhausted:{code}"):
+        raise coupon_error("Coupon has been used up.")
+    return coupon
+
+
+def apply_coupon(total, coupon):
+    if coupon.discount_type == "percentage":
+        discounted = total * (Decimal(100) - coupon.discount_amount) / Decimal(100)
+    else:
+        discounted = total - coupon.discount_amount
+    return max(discounted, Decimal(0)).quantize(CENTS, rounding=ROUND_HALF_UP)
+
+
+def redeem_coupon(code, user, prop=None, booking=None):
+    """
+    Validate and consume one use of ``code`` for ``user``.
+
+    The remaining-uses check and the increment are a single conditional
+    UPDATE, so concurrent redemptions never oversell and each holds the
+    coupon row lock only for the rest of its short transaction. The
+    (coupon, user) unique constraint stops a user redeeming twice.
+    """
+    now = timezone.now()
+    coupon = check_coupon(code, user, prop, now)
+
+    with transaction.atomic():
+        claimed = Coupon.objects.filter(pk=coupon.pk, uses_count__lt=F("max_no_uses"), valid_from__lte=now, valid_to__gte=now).update(uses_count=F("uses_count") + 1)
+        if not claimed:
+            coupon_cache.set(f"exhausted:{code}", True, getattr(settings, "COUPON_EXHAUSTED_TTL", 5))
+            raise coupon_error("Coupon has been used up.")
+
+        try:
+            with transaction.atomic():
+                CouponUsage.objects.create(coupon_id=coupon, user_id=user, property_id=prop, booking_id=booking)
+        except IntegrityError:
+            # Raising out of the atomic block also undoes the increment
+            raise coupon_error("Coupon has already been used.")
+
+    return coupon
@@ -0,0 +1,44 @@
+"""
+The MySQL backend with connections drawn from a per-process ConnectionPool.
+
+Enabled with ``"ENGINE": "chats.db.mysql"`` and configured by a ``POOL``
+dict in the database settings (SIZE, MAX_CONNECTIONS, TIMEOUT, RECYCLE).
+Django "closes" a connection at the end of each request when CONN_MAX_AGE
+is 0; here that hands it back to the pool for the next request on any
+thread, rather than tearing down the socket.
+"""
+
+from functools import partial
+
+from django.db.backends.mysql import base
+
+from chats.db.pool import get_pool
+
+
+def ping(connection):
+    connection.ping()
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    connection_pool = None
+
+    def get_new_connection(self, conn_params):
+        options = self.settings_dict.get("POOL")
+        if not options:
+            self.connection_pool = None
+            return super().get_new_connection(conn_params)
+        self.connection_pool = get_pool(self.alias, options, partial(base.DatabaseWrapper.get_new_connection, self, conn_params), ping=ping)
+        return self.connection_pool.acquire()
+
+    def _close(self):
+        if self.connection_pool is None or self.connection is None:
+            return super()._close()
+        connection, pool = self.connection, self.connection_pool
+        self.connection_pool = None
+        try:
+            # Leave no transaction open for the next borrower
+            connection.rollback()
+            reusable = True
+        except base.Database.Error:
+            reusable = False
+        pool.release(connection, reusable=reusable)
@@ -0,0 +1,119 @@
+import threading
+import time
+from collections import deque
+
+from django.db import OperationalError
+
+
+class PoolExhausted(OperationalError):
+    pass
+
+
+class ConnectionPool:
+    """
+    Process-wide pool of open DB-API connections for one database.
+
+    Keeps up to ``size`` idle connections and lets at most
+    ``max_connections`` be checked out at once, which caps what one worker
+    process can hold open on the server. A checkout waits up to ``timeout``
+    seconds for a free slot. Idle connections are pinged before they are
+    handed out, and ones older than ``recycle`` seconds are closed instead,
+    staying clear of server-side timeouts such as MySQL's wait_timeout.
+    """
+
+    def __init__(self, connect, size=5, max_connections=10, timeout=10, recycle=3600, ping=None, timer=time.monotonic):
+        self.connect = connect
+        self.size = size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping = ping
+        self.timer = timer
+        self.slots = threading.BoundedSemaphore(max_connections)
+        self.idle = deque()
+        self.opened_at = {}
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if not self.slots.acquire(timeout=self.timeout):
+            raise PoolExhausted(f"No database connection became free within {self.timeout}s.")
+        try:
+            while True:
+                with self.lock:
+                    connection = self.idle.pop() if self.idle else None
+                if connection is None:
+                    connection = self.connect()
+                    self.opened_at[id(connection)] = self.timer()
+                    return connection
+                if self.is_usable(connection):
+                    return connection
+                self.discard(connection)
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def release(self, connection, reusable=True):
+        try:
+            with self.lock:
+                if reusable and len(self.idle) < self.size and not self.is_stale(connection):
+                    self.idle.append(connection)
+                    return
+            self.discard(connection)
+        finally:
+            self.slots.release()
+
+    def is_stale(self, connection):
+        return self.timer() - self.opened_at.get(id(connection), 0) >= self.recycle
+
+    def is_usable(self, connection):
+        if self.is_stale(connection):
+            return False
+        if self.ping is None:
+            return True
+        try:
+            self.ping(connection)
+            return True
+        except Exception:
+            return False
+
+    def discard(self, connection):
+        self.opened_at.pop(id(connection), None)
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = list(self.idle), deque()
+        for connection in idle:
+            self.discard(connection)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias, options, connect, ping=None):
+    """
+    The pool for database ``alias``, created from its ``POOL`` settings on first use.
+    """
+    with _pools_lock:
+        pool = _pools.get(alias)
+        if pool is None:
+            pool = _pools[alias] = ConnectionPool(
+                connect,
+                size=options.get("SIZE", 5),
+                max_connections=options.get("MAX_CONNECTIONS", 10),
+                timeout=options.get("TIMEOUT", 10),
+                recycle=options.get("RECYCLE", 3600),
+                ping=ping,
+            )
+        return pool
+
+
+def close_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
@@ -0,0 +1,60 @@
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+EXPORT_FIELDS = ["message_id", "sender_id", "sender_email", "recipient_id", "message_body", "sent_at", "read_at"]
+
+
+class Echo:
+    """
+    File-like object whose write() hands the line back instead of buffering it.
+    """
+
+    def write(self, value):
+        return value
+
+
+def iter_messages(querysets, chunk_size=2000):
+    """
+    Yield the messages of each queryset in turn as dicts, each queryset
+    oldest first; pass the archive's before the hot table's.
+
+    Rows are fetched in keyset chunks on (sent_at, message_id) rather than
+    with one long-lived cursor: mysqlclient buffers a whole result set
+    client-side, so chunking is what keeps memory flat on MySQL, and each
+    chunk is a short range scan on the (conversation, deleted_at, sent_at,
+    message_id) index of its table.
+    """
+    columns = {"sender_email": "sender_id__email"}
+    values = [columns.get(field, field) for field in EXPORT_FIELDS]
+
+    for queryset in querysets:
+        messages = queryset.order_by("sent_at", "message_id")
+        last = None
+        while True:
+            chunk = messages
+            if last is not None:
+                chunk = chunk.filter(Q(sent_at__gt=last["sent_at"]) | Q(sent_at=last["sent_at"], message_id__gt=last["message_id"]))
+            rows = list(chunk.values(*values)[:chunk_size])
+
+            for row in rows:
+                row["sender_email"] = row.pop("sender_id__email")
+                yield row
+
+            if len(rows) < chunk_size:
+                break
+            last = rows[-1]
+
+
+def stream_ndjson(rows):
+    for row in rows:
+        yield json.dumps({field: row[field] for field in EXPORT_FIELDS}, cls=DjangoJSONEncoder) + "\n"
+
+
+def stream_csv(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for row in rows:
+        yield writer.writerow([row[field] if row[field] is not None else "" for field in EXPORT_FIELDS])
@@ -0,0 +1,141 @@
+import math
+
+from django.db.models import ExpressionWrapper, FloatField, Q
+from django.db.models.functions import ASin, Cast, Cos, Power, Radians, Sin, Sqrt
+
+from .models import Property
+
+EARTH_RADIUS_KM = 6371.0088
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+GEOHASH_PRECISION = 12
+MAX_COVER_CELLS = 16
+
+
+def encode_geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    latitude, longitude = float(latitude), float(longitude)
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < precision:
+        interval, coordinate = (lon_range, longitude) if even else (lat_range, latitude)
+        middle = (interval[0] + interval[1]) / 2
+        if coordinate >= middle:
+            value = (value << 1) | 1
+            interval[0] = middle
+        else:
+            value <<= 1
+            interval[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(GEOHASH_ALPHABET[value])
+            bits, value = 0, 0
+    return "".join(chars)
+
+
+def cell_size(precision):
+    """
+    Height and width in degrees of a geohash cell of the given length.
+    """
+    lon_bits = math.ceil(precision * 5 / 2)
+    lat_bits = precision * 5 // 2
+    return 180.0 / 2**lat_bits, 360.0 / 2**lon_bits
+
+
+def wrap_longitude(longitude):
+    return (longitude + 180.0) % 360.0 - 180.0
+
+
+def bounding_box(latitude, longitude, radius_km):
+    """
+    ``(min_lat, max_lat, lon_ranges)`` around the point, where ``lon_ranges``
+    is one ``(min_lon, max_lon)`` pair, or two when the box crosses the
+    antimeridian.
+    """
+    lat_delta = math.degrees(radius_km / EARTH_RADIUS_KM)
+    min_lat, max_lat = max(latitude - lat_delta, -90.0), min(latitude + lat_delta, 90.0)
+    cos_lat = math.cos(math.radians(latitude))
+    # A box reaching a pole takes in every longitude
+    if cos_lat < 1e-6 or max_lat == 90.0 or min_lat == -90.0:
+        return min_lat, max_lat, [(-180.0, 180.0)]
+    lon_delta = math.degrees(radius_km / (EARTH_RADIUS_KM * cos_lat))
+    if lon_delta >= 180.0:
+        return min_lat, max_lat, [(-180.0, 180.0)]
+
+    min_lon, max_lon = wrap_longitude(longitude - lon_delta), wrap_longitude(longitude + lon_delta)
+    if min_lon <= max_lon:
+        return min_lat, max_lat, [(min_lon, max_lon)]
+    return min_lat, max_lat, [(min_lon, 180.0), (-180.0, max_lon)]
+
+
+def covering_cells(min_lat, max_lat, min_lon, max_lon):
+    """
+    The geohash prefixes, as long as possible, that together cover the box
+    using at most MAX_COVER_CELLS cells.
+    """
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        height, width = cell_size(precision)
+        rows = math.floor(max_lat / height) - math.floor(min_lat / height) + 1
+        columns = math.floor(max_lon / width) - math.floor(min_lon / width) + 1
+        if rows * columns <= MAX_COVER_CELLS:
+            break
+
+    cells = set()
+    for row in range(rows):
+        for column in range(columns):
+            lat = min(min_lat + row * height, max_lat)
+            lon = min(min_lon + column * width, max_lon)
+            cells.add(encode_geohash(lat, lon, precision))
+    # The far edges can fall into a cell the stepping above skipped over
+    cells.update(encode_geohash(lat, lon, precision) for lat in (min_lat, max_lat) for lon in (min_lon, max_lon))
+    return cells
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def distance_km(latitude, longitude):
+    """
+    The great-circle distance from the point to a property's location, as a
+    database expression.
+    """
+    lat1, lon1 = math.radians(latitude), math.radians(longitude)
+    lat2 = Radians(Cast("location_id__latitude", FloatField()))
+    lon2 = Radians(Cast("location_id__longitude", FloatField()))
+    a = Power(Sin((lat2 - lat1) / 2), 2) + math.cos(lat1) * Cos(lat2) * Power(Sin((lon2 - lon1) / 2), 2)
+    return ExpressionWrapper(2 * EARTH_RADIUS_KM * ASin(Sqrt(a)), output_field=FloatField())
+
+
+def properties_near(latitude, longitude, radius_km, after=None):
+    """
+    Properties within ``radius_km`` of the point, nearest first, annotated
+    with ``distance_km``.
+
+    Candidates come from geohash prefix range scans on idx_location_geohash,
+    narrowed by the bounding box (split in two where it crosses the
+    antimeridian); the great-circle distance is computed in the query for
+    those rows only. ``after`` is the ``(distance_km, property_id)`` of the
+    last row already seen, so each page is fetched with a keyset filter
+    instead of sorting every candidate in Python.
+    """
+    min_lat, max_lat, lon_ranges = bounding_box(latitude, longitude, radius_km)
+
+    boxes = Q()
+    for min_lon, max_lon in lon_ranges:
+        cells = Q()
+        for cell in covering_cells(min_lat, max_lat, min_lon, max_lon):
+            cells |= Q(location_id__geohash__startswith=cell)
+        boxes |= cells & Q(location_id__longitude__range=(min_lon, max_lon))
+
+    nearby = (
+        Property.objects.select_related("location_id")
+        .filter(boxes, location_id__latitude__range=(min_lat, max_lat))
+        .annotate(distance_km=distance_km(latitude, longitude))
+        .filter(distance_km__lte=radius_km)
+    )
+    if after is not None:
+        distance, property_id = after
+        nearby = nearby.filter(Q(distance_km__gt=distance) | Q(distance_km=distance, property_id__gt=property_id))
+    return nearby.order_by("distance_km", "property_id")
@@ -0,0 +1,126 @@
+import uuid
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .metrics import messages_created
+from .models import Conversation, Message
+from .search import index_messages
+from .unread import bulk_increment_unread
+from .versions import changed
+
+
+def parse_uuid(value):
+    if isinstance(value, uuid.UUID):
+        return value
+    try:
+        return uuid.UUID(str(value))
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+def parse_sent_at(value):
+    if not isinstance(value, str):
+        return None
+    try:
+        # None when malformed; ValueError when well-formed but out of range, e.g. month 13
+        return parse_datetime(value)
+    except ValueError:
+        return None
+
+
+def build_message(item, sender_id, participants, allow_sender):
+    """
+    Validate one raw item and return ``(message, errors)``.
+
+    Validation is done by hand instead of through MessageSerializer: it runs
+    once per item, and at tens of thousands of items per request serializer
+    field machinery dominates the cost of the import.
+    """
+    if not isinstance(item, dict):
+        return None, {"non_field_errors": ["Expected an object."]}
+
+    errors = {}
+
+    conversation_id = parse_uuid(item.get("conversation"))
+    if conversation_id is None:
+        errors["conversation"] = ["A valid conversation ID is required."]
+
+    body = item.get("message_body")
+    if not isinstance(body, str) or not body.strip():
+        errors["message_body"] = ["This field may not be blank."]
+
+    if allow_sender and item.get("sender") is not None:
+        sender_id = parse_uuid(item["sender"])
+        if sender_id is None:
+            errors["sender"] = ["Must be a valid UUID."]
+    elif item.get("sender") is not None:
+        errors["sender"] = ["Only admins may import messages on behalf of other users."]
+
+    recipient_id = None
+    if item.get("recipient") is not None:
+        recipient_id = parse_uuid(item["recipient"])
+        if recipient_id is None:
+            errors["recipient"] = ["Must be a valid UUID."]
+
+    sent_at = timezone.now()
+    if item.get("sent_at") is not None:
+        sent_at = parse_sent_at(item["sent_at"])
+        if sent_at is None:
+            errors["sent_at"] = ["Must be an ISO 8601 datetime."]
+        elif timezone.is_naive(sent_at):
+            sent_at = timezone.make_aware(sent_at)
+
+    if errors:
+        return None, errors
+
+    members = participants.get(conversation_id)
+    if members is None or sender_id not in members:
+        return None, {"conversation": ["Conversation does not exist or the sender is not a participant."]}
+    if recipient_id is not None and recipient_id not in members:
+        return None, {"recipient": ["Recipient is not a participant of the conversation."]}
+
+    message = Message(conversation_id=conversation_id, sender_id_id=sender_id, recipient_id_id=recipient_id, message_body=body, sent_at=sent_at)
+    return message, None
+
+
+def ingest_messages(items, sender, allow_sender=False, batch_size=1000):
+    """
+    Validate and insert raw message items for any number of conversations.
+
+    Participants of every referenced conversation are loaded in a single
+    query, valid rows are written with bulk_create in ``batch_size`` chunks
+    inside one transaction, and invalid items are skipped. Returns the number
+    of created messages and a list of ``{"index", "errors"}`` entries.
+    """
+    conversation_ids = {parse_uuid(item.get("conversation")) for item in items if isinstance(item, dict)}
+    conversation_ids.discard(None)
+
+    participants = defaultdict(set)
+    memberships = Conversation.participants.through.objects.filter(conversation_id__in=conversation_ids).values_list("conversation_id", "user_id")
+    for conversation_id, user_id in memberships.iterator():
+        participants[conversation_id].add(user_id)
+
+    messages, errors = [], []
+    for index, item in enumerate(items):
+        message, item_errors = build_message(item, sender.pk, participants, allow_sender)
+        if item_errors:
+            errors.append({"index": index, "errors": item_errors})
+        else:
+            messages.append(message)
+
+    # bulk_create skips post_save, so the search index is fed here and unread
+    # counters are bumped per (recipient, conversation) pair, not per message.
+    unread = Counter((m.recipient_id_id, m.conversation_id) for m in messages if m.recipient_id_id)
+
+    with transaction.atomic():
+        Message.objects.bulk_create(messages, batch_size=batch_size)
+        index_messages(messages, batch_size=batch_size)
+        if unread:
+            bulk_increment_unread(unread)
+        changed(conversation_ids={m.conversation_id for m in messages})
+
+    messages_created.inc(amount=len(messages))
+    return len(messages), errors
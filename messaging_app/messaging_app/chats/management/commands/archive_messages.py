@@ -0,0 +1,35 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from chats.archive import archive_batch, archive_cutoff
+
+
+class Command(BaseCommand):
+    help = "Move messages older than MESSAGES_ARCHIVE_AFTER_DAYS (or --days) into the archive table, in resumable batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, help="Archive messages older than this many days instead of the setting.")
+        parser.add_argument("--batch-size", type=int, default=1000, help="Messages moved per transaction.")
+        parser.add_argument("--max-batches", type=int, help="Stop after this many batches; the next run carries on from there.")
+        parser.add_argument("--sleep", type=float, default=0, help="Seconds to pause between batches.")
+
+    def handle(self, *args, **options):
+        if options["days"] is not None:
+            cutoff = timezone.now() - timedelta(days=options["days"])
+        else:
+            cutoff = archive_cutoff()
+
+        batches = total = 0
+        while options["max_batches"] is None or batches < options["max_batches"]:
+            moved = archive_batch(cutoff, batch_size=options["batch_size"])
+            if not moved:
+                break
+            batches += 1
+            total += moved
+            if options["sleep"]:
+                time.sleep(options["sleep"])
+
+        self.stdout.write(self.style.SUCCESS(f"Archived {total} messages sent before {cutoff.isoformat()} in {batches} batches."))
@@ -0,0 +1,69 @@
+import json
+import platform
+from datetime import timezone as dt_timezone
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from chats.benchmark import DEFAULT_BUDGETS, endpoints, generate_dataset, measure, over_budget
+
+
+class Command(BaseCommand):
+    help = "Latency (p50/p95), queries per request and response size of the user, conversation and message endpoints on synthetic data, checked against budgets."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=100, help="Users to generate.")
+        parser.add_argument("--conversations", type=int, default=50, help="Conversations to generate.")
+        parser.add_argument("--participants", type=int, default=2, help="Participants per conversation.")
+        parser.add_argument("--messages", type=int, default=100, help="Messages per conversation.")
+        parser.add_argument("--iterations", type=int, default=50, help="Measured requests per endpoint.")
+        parser.add_argument("--warmup", type=int, default=2, help="Unmeasured requests per endpoint first.")
+        parser.add_argument("--seed", type=int, default=0, help="Random seed for the generated data.")
+        parser.add_argument("--budgets", help="JSON file of per-endpoint budgets, merged over the defaults.")
+        parser.add_argument("--output", help="Write the JSON report here instead of stdout.")
+        parser.add_argument("--response-cache", action="store_true", help="Leave the response cache on; by default every request is rendered.")
+        parser.add_argument("--keep", action="store_true", help="Commit the generated data instead of rolling it back.")
+
+    def handle(self, *args, **options):
+        budgets = {name: dict(limits) for name, limits in DEFAULT_BUDGETS.items()}
+        if options["budgets"]:
+            try:
+                with open(options["budgets"]) as fh:
+                    overrides = json.load(fh)
+            except (OSError, ValueError) as exc:
+                raise CommandError(f"Cannot read budgets: {exc}")
+            for name, limits in overrides.items():
+                budgets.setdefault(name, {}).update(limits)
+
+        # Everything runs in one transaction, which also keeps every read on
+        # the primary: replicas would not see the uncommitted data.
+        settings_override = {} if options["response_cache"] else {"RESPONSE_CACHE_TTL": 0}
+        with transaction.atomic(), override_settings(ALLOWED_HOSTS=["testserver"], **settings_override):
+            dataset = generate_dataset(options["users"], options["conversations"], options["participants"], options["messages"], seed=options["seed"])
+            results = {name: measure(user, path, options["iterations"], options["warmup"]) for name, user, path in endpoints(dataset)}
+            if not options["keep"]:
+                transaction.set_rollback(True)
+
+        failures = over_budget(results, budgets)
+        report = {
+            "started_at": timezone.now().astimezone(dt_timezone.utc).isoformat(),
+            "database": connections[DEFAULT_DB_ALIAS].vendor,
+            "python": platform.python_version(),
+            "response_cache": options["response_cache"],
+            "dataset": {"users": dataset.users, "conversations": len(dataset.conversation_ids), "participants": options["participants"], "messages": dataset.messages},
+            "endpoints": results,
+            "budgets": budgets,
+            "failures": failures,
+        }
+
+        text = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as fh:
+                fh.write(text + "\n")
+        else:
+            self.stdout.write(text)
+
+        if failures:
+            raise CommandError("Over budget: " + "; ".join(failures))
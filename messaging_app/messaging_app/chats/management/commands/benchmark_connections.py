@@ -0,0 +1,72 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connections
+from django.test.utils import override_settings
+from rest_framework.test import APIClient
+
+from chats.models import User
+
+
+class Command(BaseCommand):
+    help = "Requests/second for GET /api/users/{id}/ on the configured database, reconnecting every request versus the configured CONN_MAX_AGE or pool."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=1000, help="Requests per mode.")
+        parser.add_argument("--concurrency", type=int, default=4, help="Client threads.")
+        parser.add_argument("--email", help="User to fetch and authenticate as. Defaults to the first user.")
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by("created_at")
+        user = users.filter(email=options["email"]).first() if options["email"] else users.first()
+        if user is None:
+            raise CommandError("Create a user first (or pass an existing --email).")
+
+        settings_dict = connections[DEFAULT_DB_ALIAS].settings_dict
+        configured = {key: settings_dict.get(key) for key in ("CONN_MAX_AGE", "POOL")}
+        modes = [("reconnect per request", {"CONN_MAX_AGE": 0, "POOL": None}), ("configured", configured)]
+
+        self.stdout.write(f"{settings_dict['ENGINE']} {settings_dict.get('HOST') or settings_dict['NAME']}, CONN_MAX_AGE={configured['CONN_MAX_AGE']}, POOL={configured['POOL']}")
+        try:
+            for name, overrides in modes:
+                settings_dict.update(overrides)
+                connections.close_all()
+                rate = self.run(user, options["requests"], options["concurrency"])
+                self.stdout.write(f"{name:>22}: {rate:8.1f} req/s")
+        finally:
+            settings_dict.update(configured)
+            connections.close_all()
+
+    def run(self, user, requests, concurrency):
+        path = f"/api/users/{user.user_id}/"
+        errors = []
+
+        def worker(count):
+            client = APIClient()
+            client.force_authenticate(user=user)
+            try:
+                for _ in range(count):
+                    # The test client skips the request_started/finished
+                    # connection cleanup a real server runs, so do it here.
+                    close_old_connections()
+                    response = client.get(path)
+                    close_old_connections()
+                    if response.status_code != 200:
+                        errors.append(response.status_code)
+            finally:
+                connections.close_all()
+
+        per_thread = max(requests // concurrency, 1)
+        threads = [threading.Thread(target=worker, args=(per_thread,)) for _ in range(concurrency)]
+        with override_settings(ALLOWED_HOSTS=["testserver"]):
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+
+        if errors:
+            raise CommandError(f"{len(errors)} requests failed, e.g. HTTP {errors[0]}.")
+        return per_thread * concurrency / elapsed
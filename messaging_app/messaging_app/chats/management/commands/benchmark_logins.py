@@ -0,0 +1,52 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, get_hasher, make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from chats.authentication import credential_cache, verify_credentials
+from chats.models import User
+
+
+class Command(BaseCommand):
+    help = "Logins/second on one core for each available password hasher, and for a repeat login served by the verified-credential cache."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seconds", type=float, default=2, help="Time spent measuring each case.")
+        parser.add_argument("--hasher", action="append", help="Algorithm to measure (e.g. argon2, bcrypt_sha256, pbkdf2_sha256); repeatable. Defaults to every configured hasher.")
+
+    def handle(self, *args, **options):
+        algorithms = options["hasher"] or [import_string(path).algorithm for path in settings.PASSWORD_HASHERS]
+        self.stdout.write(f"Preferred hasher: {get_hasher().algorithm}")
+
+        for algorithm in algorithms:
+            try:
+                encoded = make_password("benchmark-password", hasher=algorithm)
+            except ValueError as exc:
+                self.stdout.write(f"{algorithm:>16}: skipped ({exc})")
+                continue
+            rate = self.rate(lambda: check_password("benchmark-password", encoded, setter=lambda raw: None), options["seconds"])
+            self.stdout.write(f"{algorithm:>16}: {rate:10.1f} logins/s")
+
+        # A full login, then repeats from the cache; rolled back afterwards
+        with transaction.atomic():
+            user = User(email="benchmark-login@example.com", first_name="Bench", last_name="Login", phone_number="0700000000")
+            user.set_password("benchmark-password")
+            user.save()
+            credential_cache.clear()
+            if verify_credentials(user.email, "benchmark-password") is None:
+                raise CommandError("The benchmark user could not log in.")
+            rate = self.rate(lambda: verify_credentials(user.email, "benchmark-password"), options["seconds"])
+            self.stdout.write(f"{'cached':>16}: {rate:10.1f} logins/s (includes the user query)")
+            transaction.set_rollback(True)
+        credential_cache.clear()
+
+    def rate(self, login, seconds):
+        count = 0
+        started = time.perf_counter()
+        while time.perf_counter() - started < seconds:
+            login()
+            count += 1
+        return count / (time.perf_counter() - started)
@@ -0,0 +1,29 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from chats.models import UserToken
+
+
+class Command(BaseCommand):
+    help = "Hard-delete UserToken rows that expired more than --hours ago, in bounded batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--hours", type=int, default=0, help="Keep tokens that expired within this many hours.")
+        parser.add_argument("--batch-size", type=int, default=1000, help="Rows deleted per statement.")
+        parser.add_argument("--sleep", type=float, default=0, help="Seconds to pause between batches.")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(hours=options["hours"])
+        expired = UserToken.objects.with_deleted().filter(token_expire_at__lte=cutoff)
+        total = 0
+        while True:
+            batch = list(expired.order_by().values_list("pk", flat=True)[: options["batch_size"]])
+            if not batch:
+                break
+            total += expired.filter(pk__in=batch).delete()[1].get(UserToken._meta.label, 0)
+            if options["sleep"]:
+                time.sleep(options["sleep"])
+        self.stdout.write(self.style.SUCCESS(f"Purged {total} expired tokens."))
@@ -0,0 +1,70 @@
+import time
+from datetime import timedelta
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import models
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from chats.models import SoftDeleteModel
+
+# Purged when no --model is given: nothing else hangs off their rows
+DEFAULT_MODELS = ["Message", "ArchivedMessage", "Notification", "UserToken"]
+
+
+def live_dependents(model):
+    """
+    A condition on ``model`` rows that holds when deleting one would cascade
+    to a soft-deletable row that is not deleted, directly or through deleted
+    rows in between; None if it cannot.
+    """
+    condition = None
+    for rel in model._meta.related_objects:
+        if rel.on_delete is not models.CASCADE or not issubclass(rel.related_model, SoftDeleteModel):
+            continue
+        live = Q(deleted_at__isnull=True)
+        nested = live_dependents(rel.related_model)
+        if nested is not None:
+            live |= nested
+        children = rel.related_model.objects.with_deleted().filter(live, **{rel.field.name: OuterRef(rel.field.target_field.name)})
+        condition = Exists(children) if condition is None else condition | Exists(children)
+    return condition
+
+
+class Command(BaseCommand):
+    help = "Hard-delete rows soft-deleted more than --days ago, in bounded batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=30, help="Only purge rows deleted at least this many days ago.")
+        parser.add_argument("--batch-size", type=int, default=1000, help="Rows deleted per statement.")
+        parser.add_argument("--model", action="append", dest="models", help="Model to purge, e.g. Booking; repeatable. Defaults to " + ", ".join(DEFAULT_MODELS) + ".")
+        parser.add_argument("--sleep", type=float, default=0, help="Seconds to pause between batches.")
+
+    def handle(self, *args, **options):
+        by_name = {model.__name__.lower(): model for model in apps.get_app_config("chats").get_models() if issubclass(model, SoftDeleteModel)}
+        try:
+            purged = [by_name[name.lower()] for name in options["models"] or DEFAULT_MODELS]
+        except KeyError as exc:
+            raise CommandError(f"{exc.args[0]} is not a soft-deletable chats model.")
+
+        cutoff = timezone.now() - timedelta(days=options["days"])
+        for model in purged:
+            tombstones = model.objects.with_deleted().filter(deleted_at__lt=cutoff)
+            # The delete would cascade to rows that are not deleted: keep those parents
+            condition = live_dependents(model)
+            if condition is not None:
+                kept = tombstones.filter(condition).count()
+                tombstones = tombstones.exclude(condition)
+                if kept:
+                    self.stdout.write(self.style.WARNING(f"Kept {kept} {model._meta.verbose_name_plural} that still have live dependents."))
+            total = 0
+            while True:
+                batch = list(tombstones.order_by().values_list("pk", flat=True)[: options["batch_size"]])
+                if not batch:
+                    break
+                # Counts only the model's own rows, not cascaded ones
+                total += tombstones.filter(pk__in=batch).delete()[1].get(model._meta.label, 0)
+                if options["sleep"]:
+                    time.sleep(options["sleep"])
+            self.stdout.write(self.style.SUCCESS(f"Purged {total} {model._meta.verbose_name_plural}."))
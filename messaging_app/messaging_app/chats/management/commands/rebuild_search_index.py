@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from chats.models import Message, SearchToken
+from chats.search import index_messages
+
+
+class Command(BaseCommand):
+    help = "Rebuild the message search index in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="Messages indexed per transaction.")
+        parser.add_argument("--clear", action="store_true", help="Delete the existing index first.")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        if options["clear"]:
+            SearchToken.objects.all().delete()
+
+        messages = Message.objects.order_by("message_id").only("message_id", "conversation_id", "message_body", "sent_at")
+        last_id, total = None, 0
+        while True:
+            batch = messages.filter(message_id__gt=last_id) if last_id else messages
+            batch = list(batch[:batch_size])
+            if not batch:
+                break
+
+            with transaction.atomic():
+                # ignore_conflicts keeps rows that are already indexed
+                index_messages(batch, batch_size=batch_size)
+
+            total += len(batch)
+            last_id = batch[-1].message_id
+            self.stdout.write(f"Indexed {total} messages")
+
+        self.stdout.write(self.style.SUCCESS(f"Search index rebuilt for {total} messages."))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from chats.models import Property
+from chats.ratings import reconcile_ratings
+
+
+class Command(BaseCommand):
+    help = "Recompute the PropertyRating totals from the live reviews, in batches of properties."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500, help="Properties recomputed per transaction.")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        properties = Property.objects.order_by("property_id").values_list("property_id", flat=True)
+
+        last_id, total = None, 0
+        while True:
+            batch = properties.filter(property_id__gt=last_id) if last_id else properties
+            batch = list(batch[:batch_size])
+            if not batch:
+                break
+            reconcile_ratings(batch)
+            total += len(batch)
+            last_id = batch[-1]
+
+        self.stdout.write(self.style.SUCCESS(f"Reconciled ratings for {total} properties."))
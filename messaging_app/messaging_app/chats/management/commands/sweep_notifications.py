@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from chats.notifications import expired_notifications
+
+
+class Command(BaseCommand):
+    help = "Delete (or with --archive, soft-delete) expired notifications in bounded batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="Notifications removed per statement.")
+        parser.add_argument("--archive", action="store_true", help="Set deleted_at instead of deleting the rows.")
+        parser.add_argument("--sleep", type=float, default=0, help="Seconds to pause between batches.")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        now = timezone.now()
+        expired = expired_notifications(now)
+        if options["archive"]:
+            expired = expired.filter(deleted_at__isnull=True)
+
+        total = 0
+        while True:
+            # Each statement touches at most batch_size rows by primary key,
+            # keeping locks short while the table is in use.
+            batch = list(expired.order_by().values_list("pk", flat=True)[:batch_size])
+            if not batch:
+                break
+            rows = expired.filter(pk__in=batch)
+            if options["archive"]:
+                total += rows.update(deleted_at=now)
+            else:
+                total += rows.delete()[0]
+            if options["sleep"]:
+                time.sleep(options["sleep"])
+
+        action = "Archived" if options["archive"] else "Deleted"
+        self.stdout.write(self.style.SUCCESS(f"{action} {total} expired notifications."))
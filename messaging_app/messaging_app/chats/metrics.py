@@ -0,0 +1,279 @@
+"""
+Prometheus metrics for the chats API, served in the text format at /metrics.
+
+Counts are kept per thread, so recording one never takes a lock; a scrape
+adds the threads up, folding the counts of threads that have exited into
+one retired total so their shards do not pile up. Each process writes its
+totals to METRICS_DIR at most every METRICS_FLUSH_INTERVAL seconds (and at
+exit), and a scrape adds up the files of every other process too, so one
+gunicorn worker answers for all of them. Empty METRICS_DIR when the service
+starts, as a restarted worker writes a new file rather than continuing an
+old one.
+"""
+
+import atexit
+import json
+import os
+import threading
+import time
+import uuid
+import weakref
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import Http404, HttpResponse
+
+from .cache import named_caches
+
+HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+
+registry = {}
+
+_local = threading.local()
+# (weak reference to the thread, its shard)
+_shards = []
+# Totals of the threads that have exited
+_retired = {}
+_shards_lock = threading.Lock()
+
+# Names this process's file, unique even when a pid is reused
+_process_token = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+_last_flush = [0.0]
+
+
+def _shard():
+    try:
+        return _local.shard
+    except AttributeError:
+        shard = _local.shard = {}
+        with _shards_lock:
+            _shards.append((weakref.ref(threading.current_thread()), shard))
+        return shard
+
+
+class Metric:
+    """
+    A counter, or a histogram when given ``buckets``; values are kept per
+    tuple of label values, in ``labelnames`` order.
+    """
+
+    def __init__(self, name, documentation, labelnames=(), buckets=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) if buckets else None
+        registry[name] = self
+
+    @property
+    def kind(self):
+        return "histogram" if self.buckets else "counter"
+
+    def inc(self, *labels, amount=1):
+        shard = _shard()
+        key = (self.name, labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def observe(self, value, *labels):
+        shard = _shard()
+        key = (self.name, labels)
+        # One slot per bucket, then +Inf, then the sum
+        slots = shard.get(key)
+        if slots is None:
+            slots = shard[key] = [0] * (len(self.buckets) + 2)
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                slots[index] += 1
+                break
+        else:
+            slots[-2] += 1
+        slots[-1] += value
+
+
+def counter(name, documentation, labelnames=()):
+    return Metric(name, documentation, labelnames)
+
+
+def histogram(name, documentation, labelnames=(), buckets=HTTP_BUCKETS):
+    return Metric(name, documentation, labelnames, buckets=buckets)
+
+
+http_requests = counter("chats_http_requests_total", "HTTP requests by DRF route, method and status.", ["route", "method", "status"])
+http_duration = histogram("chats_http_request_duration_seconds", "HTTP request latency by DRF route and method.", ["route", "method"])
+db_queries = histogram("chats_db_query_duration_seconds", "SQL query latency by database alias, for queries run while serving requests.", ["alias"], buckets=DB_BUCKETS)
+cache_requests = counter("chats_cache_requests_total", "Cache lookups by cache and result (hit or miss).", ["cache", "result"])
+messages_created = counter("chats_messages_created_total", "Messages created, through the API or bulk import.")
+booking_retries = counter("chats_booking_retries_total", "Booking attempts retried after a lock timeout or deadlock.")
+
+
+def _merge(totals, key, value):
+    current = totals.get(key)
+    if current is None:
+        totals[key] = list(value) if isinstance(value, list) else value
+    elif isinstance(value, list):
+        totals[key] = [a + b for a, b in zip(current, value)]
+    else:
+        totals[key] = current + value
+
+
+def snapshot():
+    """
+    This process's totals as ``{(name, labels): value}``.
+    """
+    totals = {}
+    with _shards_lock:
+        live = []
+        for thread_ref, shard in _shards:
+            thread = thread_ref()
+            if thread is None or not thread.is_alive():
+                # A finished thread writes no more, so its shard can be merged as it is
+                for key, value in shard.items():
+                    _merge(_retired, key, value)
+            else:
+                live.append((thread_ref, shard))
+        _shards[:] = live
+        for key, value in _retired.items():
+            _merge(totals, key, value)
+    for _, shard in live:
+        # dict.copy() runs without releasing the GIL, so it never sees a half-made update
+        for key, value in shard.copy().items():
+            _merge(totals, key, list(value) if isinstance(value, list) else value)
+    for name, cache in named_caches.items():
+        _merge(totals, (cache_requests.name, (name, "hit")), cache.hits)
+        _merge(totals, (cache_requests.name, (name, "miss")), cache.misses)
+    return totals
+
+
+def get_directory():
+    return getattr(settings, "METRICS_DIR", None)
+
+
+def flush():
+    """
+    Write this process's totals to METRICS_DIR, replacing its previous file.
+    """
+    directory = get_directory()
+    if not directory:
+        return
+    _last_flush[0] = time.monotonic()
+    path = os.path.join(directory, f"{_process_token}.json")
+    rows = [[name, list(labels), value] for (name, labels), value in snapshot().items()]
+    with open(path + ".tmp", "w") as fh:
+        json.dump(rows, fh)
+    os.replace(path + ".tmp", path)
+
+
+def flush_if_due():
+    if time.monotonic() - _last_flush[0] >= getattr(settings, "METRICS_FLUSH_INTERVAL", 5):
+        flush()
+
+
+atexit.register(lambda: get_directory() and flush())
+
+
+def collect():
+    """
+    Totals of this process plus every other process that wrote to METRICS_DIR.
+    """
+    totals = snapshot()
+    directory = get_directory()
+    if directory:
+        for filename in os.listdir(directory):
+            if not filename.endswith(".json") or filename == f"{_process_token}.json":
+                continue
+            try:
+                with open(os.path.join(directory, filename)) as fh:
+                    rows = json.load(fh)
+            except (OSError, ValueError):
+                continue
+            for name, labels, value in rows:
+                _merge(totals, (name, tuple(labels)), value)
+    return totals
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def render(totals):
+    """
+    ``totals`` in the Prometheus text exposition format.
+    """
+    lines = []
+    for name, metric in sorted(registry.items()):
+        lines.append(f"# HELP {name} {metric.documentation}")
+        lines.append(f"# TYPE {name} {metric.kind}")
+        series = sorted((labels, value) for (metric_name, labels), value in totals.items() if metric_name == name)
+        for labels, value in series:
+            if not metric.buckets:
+                lines.append(f"{name}{_labels(metric.labelnames, labels)} {value}")
+                continue
+            cumulative = 0
+            for bound, count in zip([*metric.buckets, "+Inf"], value[:-1]):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(metric.labelnames, labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_sum{_labels(metric.labelnames, labels)} {value[-1]}")
+            lines.append(f"{name}_count{_labels(metric.labelnames, labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+def metrics_view(request):
+    """
+    The scrape endpoint. With METRICS_TOKEN set, requires ``Authorization: Bearer <token>``;
+    without it, only answers under DEBUG.
+    """
+    if not getattr(settings, "METRICS_ENABLED", True):
+        raise Http404
+    token = getattr(settings, "METRICS_TOKEN", None)
+    if not token:
+        if not settings.DEBUG:
+            return HttpResponse(status=403)
+    elif request.headers.get("Authorization") != f"Bearer {token}":
+        return HttpResponse(status=401)
+    return HttpResponse(render(collect()), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+def time_query(alias):
+    def wrapper(execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            db_queries.observe(time.perf_counter() - started, alias)
+
+    return wrapper
+
+
+class MetricsMiddleware:
+    """
+    Count and time every request by the name of the route it resolved to,
+    and time the queries it runs.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, "METRICS_ENABLED", True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(time_query(connection.alias)))
+            response = self.get_response(request)
+
+        match = request.resolver_match
+        route = (match.url_name or match.view_name) if match else "unmatched"
+        http_requests.inc(route, request.method, str(response.status_code))
+        http_duration.observe(time.perf_counter() - started, route, request.method)
+        flush_if_due()
+        return response
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.18 on 2026-10-18 18:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chats", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(fields=["conversation", "sent_at", "message_id"], name="idx_conversation_sent_at"),
+        ),
+    ]
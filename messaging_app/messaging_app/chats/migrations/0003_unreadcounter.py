@@ -0,0 +1,42 @@
+# Generated by Django 4.2.18 on 2026-10-18 18:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_unread_counters(apps, schema_editor):
+    Message = apps.get_model("chats", "Message")
+    UnreadCounter = apps.get_model("chats", "UnreadCounter")
+    unread = Message.objects.filter(recipient_id__isnull=False, read_at__isnull=True).order_by().values("recipient_id", "conversation").annotate(count=models.Count("pk"))
+    UnreadCounter.objects.bulk_create(
+        [UnreadCounter(user_id_id=row["recipient_id"], conversation_id=row["conversation"], unread_count=row["count"]) for row in unread.iterator()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chats", "0002_message_conversation_sent_at_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UnreadCounter",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("unread_count", models.PositiveIntegerField(default=0)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                ("conversation", models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name="unread_counters", to="chats.conversation")),
+                ("user_id", models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name="unread_counters", to="chats.user")),
+            ],
+            options={
+                "db_table": "UnreadCounter",
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="unreadcounter",
+            constraint=models.UniqueConstraint(fields=("user_id", "conversation"), name="unique_unread_counter"),
+        ),
+        migrations.RunPython(backfill_unread_counters, migrations.RunPython.noop),
+    ]
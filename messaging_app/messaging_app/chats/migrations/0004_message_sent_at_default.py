@@ -0,0 +1,19 @@
+# Generated by Django 4.2.18 on 2026-10-18 19:01
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chats", "0003_unreadcounter"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="message",
+            name="sent_at",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
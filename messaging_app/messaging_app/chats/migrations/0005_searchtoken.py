@@ -0,0 +1,33 @@
+# Generated by Django 4.2.18 on 2026-10-18 19:04
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chats", "0004_message_sent_at_default"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SearchToken",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("token", models.CharField(max_length=64)),
+                ("sent_at", models.DateTimeField()),
+                ("term_frequency", models.PositiveSmallIntegerField(default=1)),
+                ("conversation", models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name="+", to="chats.conversation")),
+                ("message", models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name="search_tokens", to="chats.message")),
+            ],
+            options={
+                "db_table": "SearchToken",
+                "indexes": [models.Index(fields=["token", "conversation", "sent_at"], name="idx_search_token_conversation")],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="searchtoken",
+            constraint=models.UniqueConstraint(fields=("token", "message"), name="unique_search_token_message"),
+        ),
+    ]
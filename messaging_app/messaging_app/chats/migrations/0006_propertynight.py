@@ -0,0 +1,44 @@
+# Generated by Django 4.2.18 on 2026-10-18 19:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+from datetime import timedelta
+
+
+def backfill_property_nights(apps, schema_editor):
+    Booking = apps.get_model("chats", "Booking")
+    PropertyNight = apps.get_model("chats", "PropertyNight")
+    for booking in Booking.objects.exclude(booking_status="cancelled").iterator():
+        nights = max((booking.end_date - booking.start_date).days, 1)
+        PropertyNight.objects.bulk_create(
+            [PropertyNight(property_id_id=booking.property_id_id, booking_id_id=booking.booking_id, night=booking.start_date + timedelta(days=offset)) for offset in range(nights)],
+            ignore_conflicts=True,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chats", "0005_searchtoken"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PropertyNight",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("night", models.DateField()),
+                ("booking_id", models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name="nights", to="chats.booking")),
+                ("property_id", models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name="booked_nights", to="chats.property")),
+            ],
+            options={
+                "db_table": "PropertyNight",
+                "indexes": [models.Index(fields=["booking_id"], name="idx_booking_nights")],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="propertynight",
+            constraint=models.UniqueConstraint(fields=("property_id", "night"), name="unique_property_night"),
+        ),
+        migrations.RunPython(backfill_property_nights, migrations.RunPython.noop),
+    ]
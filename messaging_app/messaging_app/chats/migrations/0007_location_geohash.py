@@ -0,0 +1,53 @@
+# Generated by Django 4.2.18 on 2026-10-18 19:06
+
+from django.db import migrations, models
+
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def encode_geohash(latitude, longitude, precision=12):
+    # A frozen copy of chats.geo.encode_geohash, which imports the current models
+    latitude, longitude = float(latitude), float(longitude)
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < precision:
+        interval, coordinate = (lon_range, longitude) if even else (lat_range, latitude)
+        middle = (interval[0] + interval[1]) / 2
+        if coordinate >= middle:
+            value = (value << 1) | 1
+            interval[0] = middle
+        else:
+            value <<= 1
+            interval[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(GEOHASH_ALPHABET[value])
+            bits, value = 0, 0
+    return "".join(chars)
+
+
+def backfill_geohash(apps, schema_editor):
+    Location = apps.get_model("chats", "Location")
+    for location in Location.objects.only("location_id", "latitude", "longitude").iterator():
+        Location.objects.filter(pk=location.pk).update(geohash=encode_geohash(location.latitude, location.longitude))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chats", "0006_propertynight"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="location",
+            name="geohash",
+            field=models.CharField(blank=True, default="", editable=False, max_length=12),
+        ),
+        migrations.AddIndex(
+            model_name="location",
+            index=models.Index(fields=["geohash"], name="idx_location_geohash"),
+        ),
+        migrations.RunPython(backfill_geohash, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 4.2.18 on 2026-10-18 19:08
+
+from decimal import Decimal
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_property_ratings(apps, schema_editor):
+    Review = apps.get_model("chats", "Review")
+    PropertyRating = apps.get_model("chats", "PropertyRating")
+    rows = (
+        Review.objects.filter(deleted_at__isnull=True)
+        .order_by()
+        .values("property_id", "reviewed_by")
+        .annotate(review_count=models.Count("pk"), rating_sum=models.Sum("rating"), **{f"stars_{star}": models.Count("pk", filter=models.Q(rating=star)) for star in range(1, 6)})
+    )
+    ratings = []
+    for row in rows.iterator():
+        average = (Decimal(row["rating_sum"]) / row["review_count"]).quantize(Decimal("0.01"))
+        ratings.append(PropertyRating(property_id_id=row.pop("property_id"), average_rating=average, **row))
+    PropertyRating.objects.bulk_create(ratings, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chats", "0007_location_geohash"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PropertyRating",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("reviewed_by", models.CharField(choices=[("guest", "Guest"), ("host", "Host")], max_length=10)),
+                ("review_count", models.PositiveIntegerField(default=0)),
+                ("rating_sum", models.PositiveIntegerField(default=0)),
+                ("average_rating", models.DecimalField(decimal_places=2, default=Decimal("0.00"), max_digits=3)),
+                ("stars_1", models.PositiveIntegerField(default=0)),
+                ("stars_2", models.PositiveIntegerField(default=0)),
+                ("stars_3", models.PositiveIntegerField(default=0)),
+                ("stars_4", models.PositiveIntegerField(default=0)),
+                ("stars_5", models.PositiveIntegerField(default=0)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                ("property_id", models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name="ratings", to="chats.property")),
+            ],
+            options={
+                "db_table": "PropertyRating",
+                "indexes": [models.Index(fields=["reviewed_by", "average_rating"], name="idx_rating_average")],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="propertyrating",
+            constraint=models.UniqueConstraint(fields=("property_id", "reviewed_by"), name="unique_property_rating"),
+        ),
+        migrations.RunPython(backfill_property_ratings, migrations.RunPython.noop),
+    ]
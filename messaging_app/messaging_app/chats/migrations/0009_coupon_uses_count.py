@@ -0,0 +1,27 @@
+# Generated by Django 4.2.18 on 2026-10-18 19:10
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def backfill_uses_count(apps, schema_editor):
+    Coupon = apps.get_model("chats", "Coupon")
+    CouponUsage = apps.get_model("chats", "CouponUsage")
+    used = CouponUsage.objects.filter(coupon_id=models.OuterRef("pk")).order_by().values("coupon_id").annotate(total=models.Count("pk")).values("total")
+    Coupon.objects.update(uses_count=Coalesce(models.Subquery(used), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chats", "0008_propertyrating"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="coupon",
+            name="uses_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_uses_count, migrations.RunPython.noop),
+    ]
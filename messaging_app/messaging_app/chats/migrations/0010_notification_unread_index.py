@@ -0,0 +1,25 @@
+# Generated by Django 4.2.18 on 2026-10-18 19:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chats", "0009_coupon_uses_count"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="notification",
+            name="idx_user_notifications",
+        ),
+        migrations.AddIndex(
+            model_name="notification",
+            index=models.Index(fields=["user_id", "is_read", "created_at"], name="idx_user_notifications_unread"),
+        ),
+        migrations.AddIndex(
+            model_name="notification",
+            index=models.Index(fields=["expiration_time"], name="idx_notification_expiration"),
+        ),
+    ]
@@ -0,0 +1,87 @@
+# Generated by Django 4.2.18 on 2026-10-18 19:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chats", "0010_notification_unread_index"),
+    ]
+
+    operations = [
+        # New indexes first: MySQL will not drop an index a foreign key relies on
+        # until another index leads with the same column.
+        migrations.AddIndex(
+            model_name="booking",
+            index=models.Index(fields=["property_id", "deleted_at"], name="idx_booking_property_live"),
+        ),
+        migrations.AddIndex(
+            model_name="booking",
+            index=models.Index(fields=["user_id", "deleted_at"], name="idx_booking_user_live"),
+        ),
+        migrations.AddIndex(
+            model_name="bookingcancellation",
+            index=models.Index(fields=["booking_id", "deleted_at"], name="idx_cancellation_booking_live"),
+        ),
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(fields=["conversation", "deleted_at", "sent_at", "message_id"], name="idx_message_conversation_live"),
+        ),
+        migrations.AddIndex(
+            model_name="notification",
+            index=models.Index(fields=["user_id", "is_read", "deleted_at", "created_at"], name="idx_notification_user_live"),
+        ),
+        migrations.AddIndex(
+            model_name="payment",
+            index=models.Index(fields=["booking_id", "deleted_at"], name="idx_payment_booking_live"),
+        ),
+        migrations.AddIndex(
+            model_name="property",
+            index=models.Index(fields=["location_id", "deleted_at"], name="idx_property_location_live"),
+        ),
+        migrations.AddIndex(
+            model_name="property",
+            index=models.Index(fields=["host_id", "deleted_at"], name="idx_property_host_live"),
+        ),
+        migrations.AddIndex(
+            model_name="review",
+            index=models.Index(fields=["property_id", "deleted_at"], name="idx_review_property_live"),
+        ),
+        migrations.AddIndex(
+            model_name="user",
+            index=models.Index(fields=["role", "deleted_at"], name="idx_user_role_live"),
+        ),
+        migrations.RemoveIndex(
+            model_name="booking",
+            name="idx_property_bookings",
+        ),
+        migrations.RemoveIndex(
+            model_name="booking",
+            name="idx_user_bookings",
+        ),
+        migrations.RemoveIndex(
+            model_name="bookingcancellation",
+            name="idx_booking_cancellations",
+        ),
+        migrations.RemoveIndex(
+            model_name="message",
+            name="idx_conversation_sent_at",
+        ),
+        migrations.RemoveIndex(
+            model_name="notification",
+            name="idx_user_notifications_unread",
+        ),
+        migrations.RemoveIndex(
+            model_name="payment",
+            name="idx_booking_payments",
+        ),
+        migrations.RemoveIndex(
+            model_name="property",
+            name="idx_property_location",
+        ),
+        migrations.RemoveIndex(
+            model_name="review",
+            name="idx_property_reviews",
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 4.2.18 on 2026-10-18 19:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chats", "0011_soft_delete_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ArchivedMessage",
+            fields=[
+                ("deleted_at", models.DateTimeField(blank=True, null=True)),
+                ("message_id", models.UUIDField(editable=False, primary_key=True, serialize=False)),
+                ("message_body", models.TextField()),
+                ("sent_at", models.DateTimeField()),
+                ("read_at", models.DateTimeField(blank=True, null=True)),
+                ("archived_at", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "db_table": "MessageArchive",
+            },
+        ),
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(fields=["sent_at", "message_id"], name="idx_message_sent_at"),
+        ),
+        migrations.AddField(
+            model_name="archivedmessage",
+            name="conversation",
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name="archived_messages", to="chats.conversation"),
+        ),
+        migrations.AddField(
+            model_name="archivedmessage",
+            name="recipient_id",
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name="+", to="chats.user"),
+        ),
+        migrations.AddField(
+            model_name="archivedmessage",
+            name="sender_id",
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name="+", to="chats.user"),
+        ),
+        migrations.AddIndex(
+            model_name="archivedmessage",
+            index=models.Index(fields=["conversation", "deleted_at", "sent_at", "message_id"], name="idx_archive_conversation_live"),
+        ),
+    ]
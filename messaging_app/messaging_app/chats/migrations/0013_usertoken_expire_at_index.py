@@ -0,0 +1,17 @@
+# Generated by Django 4.2.18 on 2026-10-18 19:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chats", "0012_archivedmessage"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="usertoken",
+            index=models.Index(fields=["token_expire_at"], name="idx_token_expire_at"),
+        ),
+    ]
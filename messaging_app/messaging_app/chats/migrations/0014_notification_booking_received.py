@@ -0,0 +1,21 @@
+# Generated by Django 4.2.18 on 2026-10-18 19:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chats", "0013_usertoken_expire_at_index"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="notification",
+            name="event_type",
+            field=models.CharField(
+                choices=[("booking_received", "Booking Received"), ("booking_confirmation", "Booking Confirmation"), ("payment_update", "Payment Update"), ("general_alert", "General Alert")],
+                max_length=20,
+            ),
+        ),
+    ]
@@ -1,15 +1,64 @@
 from django.contrib.auth.models import AbstractBaseUser
 from decimal import Decimal
-from django.db import models
+from django.db import models, transaction
+from django.dispatch import Signal
+from django.utils import timezone
 import uuid
 
 from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator, MaxValueValidator
 
-class TimeStampedModel(models.Model):
+# Sent with the model as sender and the primary keys it just soft-deleted.
+# Bulk soft deletes are UPDATEs, so the usual save/delete signals do not fire.
+soft_deleted = Signal()
+
+
+class SoftDeleteQuerySet(models.QuerySet):
+    def soft_delete(self, now=None):
+        """
+        Mark every live row in the queryset deleted with one UPDATE and return how many were.
+        """
+        now = now or timezone.now()
+        live = self.filter(deleted_at__isnull=True)
+        if not soft_deleted.has_listeners(self.model):
+            return live.update(deleted_at=now)
+
+        with transaction.atomic():
+            pks = list(live.values_list("pk", flat=True))
+            count = self.model.objects.with_deleted().filter(pk__in=pks).update(deleted_at=now)
+            soft_deleted.send(sender=self.model, pks=pks)
+        return count
+
+
+class SoftDeleteManager(models.Manager.from_queryset(SoftDeleteQuerySet)):
+    """
+    Hides soft-deleted rows; ``with_deleted()`` opts back in to them.
+    """
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+    def with_deleted(self):
+        return super().get_queryset()
+
+
+class SoftDeleteModel(models.Model):
+    deleted_at = models.DateTimeField(null=True, blank=True)
+
+    objects = SoftDeleteManager()
+
+    class Meta:
+        abstract = True
+
+    def soft_delete(self):
+        now = timezone.now()
+        if type(self).objects.filter(pk=self.pk).soft_delete(now):
+            self.deleted_at = now
+
+
+class TimeStampedModel(SoftDeleteModel):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
-    deleted_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         abstract = True
@@ -35,6 +84,7 @@ class User(AbstractBaseUser, TimeStampedModel):
         db_table = "users"
         indexes = [
             models.Index(fields=["email"], name="idx_user_email"),
+            models.Index(fields=["role", "deleted_at"], name="idx_user_role_live"),
         ]
 
         constraints = [models.UniqueConstraint(fields=["email"], name="unique_email"), models.CheckConstraint(check=models.Q(role__in=["admin", "host", "guest"]), name="role_in_choices")]
@@ -56,24 +106,95 @@ class Conversation(models.Model):
         db_table = "conversations"
 
 
-class Message(models.Model):
+class Message(SoftDeleteModel):
     message_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False, db_index=True)
     conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name="messages")
     sender_id = models.ForeignKey(User, to_field="user_id", on_delete=models.SET_NULL, null=True)
     recipient_id = models.ForeignKey(User, related_name="received_messages", on_delete=models.SET_NULL, null=True)
     message_body = models.TextField(null=False)
-    sent_at = models.DateTimeField(auto_now_add=True)
+    # Not auto_now_add, so imported history can keep its original timestamps
+    sent_at = models.DateTimeField(default=timezone.now)
     read_at = models.DateTimeField(null=True, blank=True)
-    deleted_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         ordering = ["-sent_at"]
-        indexes = [models.Index(fields=["sender_id"], name="idx_sender_id"), models.Index(fields=["recipient_id"], name="idx_recipient_id")]
+        indexes = [
+            models.Index(fields=["sender_id"], name="idx_sender_id"),
+            models.Index(fields=["recipient_id"], name="idx_recipient_id"),
+            # Live messages of a conversation in (sent_at, message_id) order
+            models.Index(fields=["conversation", "deleted_at", "sent_at", "message_id"], name="idx_message_conversation_live"),
+            # Oldest-first scans by the archiver
+            models.Index(fields=["sent_at", "message_id"], name="idx_message_sent_at"),
+        ]
+
+    def __str__(self):
+        return f"{self.sender_id} {self.message_body} {self.sent_at}"
+
+
+class ArchivedMessage(SoftDeleteModel):
+    """
+    Messages older than MESSAGES_ARCHIVE_AFTER_DAYS, moved out of the Message
+    table by chats.archive so the hot table and its indexes stay small.
+    """
+
+    message_id = models.UUIDField(primary_key=True, editable=False)
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name="archived_messages")
+    sender_id = models.ForeignKey(User, to_field="user_id", on_delete=models.SET_NULL, null=True, related_name="+")
+    recipient_id = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name="+")
+    message_body = models.TextField(null=False)
+    sent_at = models.DateTimeField(null=False)
+    read_at = models.DateTimeField(null=True, blank=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = "MessageArchive"
+        indexes = [models.Index(fields=["conversation", "deleted_at", "sent_at", "message_id"], name="idx_archive_conversation_live")]
 
     def __str__(self):
         return f"{self.sender_id} {self.message_body} {self.sent_at}"
 
 
+class SearchToken(models.Model):
+    """
+    Inverted index over Message.message_body: one row per (token, message).
+    The conversation and sent_at are copied from the message so a lookup is
+    a range scan on (token, conversation, sent_at) without touching messages.
+    """
+
+    token = models.CharField(max_length=64, null=False)
+    message = models.ForeignKey(Message, on_delete=models.CASCADE, related_name="search_tokens")
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name="+")
+    sent_at = models.DateTimeField(null=False)
+    term_frequency = models.PositiveSmallIntegerField(default=1, null=False)
+
+    class Meta:
+        db_table = "SearchToken"
+        indexes = [models.Index(fields=["token", "conversation", "sent_at"], name="idx_search_token_conversation")]
+        constraints = [models.UniqueConstraint(fields=["token", "message"], name="unique_search_token_message")]
+
+    def __str__(self):
+        return f"{self.token} {self.message_id} {self.term_frequency}"
+
+
+class UnreadCounter(models.Model):
+    """
+    Number of unread messages a user has in a conversation, kept in step
+    with Message.read_at so unread badges never need a COUNT over messages.
+    """
+
+    user_id = models.ForeignKey(User, to_field="user_id", on_delete=models.CASCADE, related_name="unread_counters")
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name="unread_counters")
+    unread_count = models.PositiveIntegerField(default=0, null=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = "UnreadCounter"
+        constraints = [models.UniqueConstraint(fields=["user_id", "conversation"], name="unique_unread_counter")]
+
+    def __str__(self):
+        return f"{self.user_id} {self.conversation} {self.unread_count}"
+
+
 class PaymentMethod(TimeStampedModel):
     pay_method_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     transaction_fee = models.DecimalField(max_digits=5, decimal_places=2, null=True, default=0.00)
@@ -97,11 +218,14 @@ class Location(TimeStampedModel):
     city = models.CharField(max_length=36, null=False)
     state = models.CharField(max_length=36, null=True, blank=True)
     country = models.CharField(max_length=36, null=False)
+    # Filled from latitude/longitude on save; prefix range scans find nearby rows
+    geohash = models.CharField(max_length=12, null=False, blank=True, default="", editable=False)
 
     class Meta:
         db_table = "Location"
         indexes = [
             models.Index(fields=["city", "country"], name="idx_location_city_country"),
+            models.Index(fields=["geohash"], name="idx_location_geohash"),
         ]
 
     def __str__(self):
@@ -121,7 +245,8 @@ class Property(TimeStampedModel):
         db_table = "Property"
         indexes = [
             models.Index(fields=["price_per_night"], name="idx_property_price"),
-            models.Index(fields=["location_id"], name="idx_property_location"),
+            models.Index(fields=["location_id", "deleted_at"], name="idx_property_location_live"),
+            models.Index(fields=["host_id", "deleted_at"], name="idx_property_host_live"),
             models.Index(fields=["property_id"], name="idx_property_id"),
         ]
 
@@ -141,6 +266,7 @@ class UserToken(TimeStampedModel):
         indexes = [
             models.Index(fields=["token", "token_expire_at", "is_used"], name="idx_token_validation"),
             models.Index(fields=["user_id"], name="idx_user_tokens"),
+            models.Index(fields=["token_expire_at"], name="idx_token_expire_at"),
         ]
 
     def __str__(self):
@@ -158,13 +284,40 @@ class Review(TimeStampedModel):
     class Meta:
         db_table = "Review"
         indexes = [
-            models.Index(fields=["property_id"], name="idx_property_reviews"),
+            models.Index(fields=["property_id", "deleted_at"], name="idx_review_property_live"),
         ]
 
     def __str__(self):
         return f"{self.user} {self.property} {self.rating} {self.comment} {self.reviewed_by} {self.created_at}"
 
 
+class PropertyRating(models.Model):
+    """
+    Running totals of the live (not soft-deleted) reviews of a property, one
+    row per reviewer type, kept in step with Review by chats.ratings.
+    """
+
+    property_id = models.ForeignKey(Property, to_field="property_id", on_delete=models.CASCADE, related_name="ratings")
+    reviewed_by = models.CharField(max_length=10, choices=[("guest", "Guest"), ("host", "Host")], null=False)
+    review_count = models.PositiveIntegerField(default=0, null=False)
+    rating_sum = models.PositiveIntegerField(default=0, null=False)
+    average_rating = models.DecimalField(max_digits=3, decimal_places=2, default=Decimal("0.00"), null=False)
+    stars_1 = models.PositiveIntegerField(default=0, null=False)
+    stars_2 = models.PositiveIntegerField(default=0, null=False)
+    stars_3 = models.PositiveIntegerField(default=0, null=False)
+    stars_4 = models.PositiveIntegerField(default=0, null=False)
+    stars_5 = models.PositiveIntegerField(default=0, null=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = "PropertyRating"
+        indexes = [models.Index(fields=["reviewed_by", "average_rating"], name="idx_rating_average")]
+        constraints = [models.UniqueConstraint(fields=["property_id", "reviewed_by"], name="unique_property_rating")]
+
+    def __str__(self):
+        return f"{self.property_id_id} {self.reviewed_by} {self.average_rating} ({self.review_count})"
+
+
 class Booking(TimeStampedModel):
     booking_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     property_id = models.ForeignKey(Property, to_field="property_id", on_delete=models.CASCADE, related_name="bookings")
@@ -182,24 +335,43 @@ class Booking(TimeStampedModel):
     class Meta:
         db_table = "Booking"
 
-        indexes = [models.Index(fields=["property_id"], name="idx_property_bookings"), models.Index(fields=["user_id"], name="idx_user_bookings")]
+        indexes = [models.Index(fields=["property_id", "deleted_at"], name="idx_booking_property_live"), models.Index(fields=["user_id", "deleted_at"], name="idx_booking_user_live")]
 
     def __str__(self):
         return f"{self.user} {self.property} {self.start_date} {self.end_date} {self.total_price} {self.booking_status} {self.payment_status} {self.created_at}"
 
 
-class BookingCancellation(models.Model):
+class PropertyNight(models.Model):
+    """
+    One row per night a property is held by a non-cancelled booking, so an
+    availability check is an index probe on (property, night) instead of a
+    scan over every booking of the property.
+    """
+
+    property_id = models.ForeignKey(Property, to_field="property_id", on_delete=models.CASCADE, related_name="booked_nights")
+    booking_id = models.ForeignKey(Booking, to_field="booking_id", on_delete=models.CASCADE, related_name="nights")
+    night = models.DateField(null=False)
+
+    class Meta:
+        db_table = "PropertyNight"
+        indexes = [models.Index(fields=["booking_id"], name="idx_booking_nights")]
+        constraints = [models.UniqueConstraint(fields=["property_id", "night"], name="unique_property_night")]
+
+    def __str__(self):
+        return f"{self.property_id_id} {self.night} {self.booking_id_id}"
+
+
+class BookingCancellation(SoftDeleteModel):
     cancellation_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     booking_id = models.ForeignKey(Booking, to_field="booking_id", on_delete=models.CASCADE, related_name="cancellations")
     cancelled_by = models.CharField(max_length=10, choices=[("guest", "Guest"), ("host", "Host")], null=False)
     cancel_fee = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
     cancel_reason = models.TextField(null=True, blank=True)
     cancel_at = models.DateTimeField(auto_now_add=True)
-    deleted_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         db_table = "BookingCancellation"
-        indexes = [models.Index(fields=["booking_id"], name="idx_booking_cancellations")]
+        indexes = [models.Index(fields=["booking_id", "deleted_at"], name="idx_cancellation_booking_live")]
 
     def __str__(self):
         return f"{self.booking} {self.cancelled_by} {self.cancel_reason} {self.cancel_fee} {self.cancel_at}"
@@ -216,26 +388,31 @@ class Payment(TimeStampedModel):
 
     class Meta:
         db_table = "Payment"
-        indexes = [models.Index(fields=["booking_id"], name="idx_booking_payments"), models.Index(fields=["status"], name="idx_payment_status")]
+        indexes = [models.Index(fields=["booking_id", "deleted_at"], name="idx_payment_booking_live"), models.Index(fields=["status"], name="idx_payment_status")]
 
     def __str__(self):
         return f"{self.booking} {self.amount} {self.status} {self.transaction_id} {self.payment_date}"
 
 
-class Notification(models.Model):
+class Notification(SoftDeleteModel):
     notification_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user_id = models.ForeignKey(User, to_field="user_id", on_delete=models.CASCADE, related_name="notifications")
-    event_type = models.CharField(max_length=20, choices=[("booking_confirmation", "Booking Confirmation"), ("payment_update", "Payment Update"), ("general_alert", "General Alert")], null=False)
+    event_type = models.CharField(
+        max_length=20,
+        choices=[("booking_received", "Booking Received"), ("booking_confirmation", "Booking Confirmation"), ("payment_update", "Payment Update"), ("general_alert", "General Alert")],
+        null=False,
+    )
     is_read = models.BooleanField(default=False)
     message = models.TextField(null=False)
     created_at = models.DateTimeField(auto_now_add=True)
     expiration_time = models.DateTimeField(null=True, blank=True)
-    deleted_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         db_table = "Notification"
         indexes = [
-            models.Index(fields=["user_id"], name="idx_user_notifications"),
+            # Unread listing: WHERE user_id = ? AND is_read = ? AND deleted_at IS NULL ORDER BY created_at DESC
+            models.Index(fields=["user_id", "is_read", "deleted_at", "created_at"], name="idx_notification_user_live"),
+            models.Index(fields=["expiration_time"], name="idx_notification_expiration"),
         ]
 
 
@@ -248,6 +425,8 @@ class Coupon(TimeStampedModel):
     code = models.CharField(max_length=36, unique=True, null=False)
     description = models.TextField(null=True, blank=True)
     max_no_uses = models.PositiveIntegerField(null=False)
+    # Redemptions so far, bumped by a conditional UPDATE in chats.coupons
+    uses_count = models.PositiveIntegerField(default=0, null=False)
     valid_from = models.DateTimeField(null=False)
     valid_to = models.DateTimeField(null=False)
 
@@ -0,0 +1,119 @@
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Notification, User
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    The process-wide pool that writes notifications off the request thread.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=getattr(settings, "NOTIFICATION_FANOUT_WORKERS", 4), thread_name_prefix="notify")
+        return _executor
+
+
+def shutdown_executor(wait=True):
+    """
+    Stop the pool once its queued fan-outs are done; the next fan-out starts a new one.
+    """
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=wait)
+
+
+def audience(user_ids=None, role=None):
+    """
+    Queryset of the user ids to notify: explicit ``user_ids``, everyone with ``role``, or all users.
+    """
+    users = User.objects.all()
+    if user_ids is not None:
+        users = users.filter(user_id__in=user_ids)
+    if role is not None:
+        users = users.filter(role=role)
+    return users.order_by("user_id").values_list("user_id", flat=True)
+
+
+def fan_out(event_type, message, recipients, expires_in=None, chunk_size=None):
+    """
+    Write one notification per id in ``recipients`` and return how many were written.
+
+    Recipients are read in keyset-ordered chunks and each chunk is a single
+    multi-row INSERT in its own transaction, so a large audience never holds
+    a long transaction or loads every user into memory.
+    """
+    chunk_size = chunk_size or getattr(settings, "NOTIFICATION_FANOUT_CHUNK_SIZE", 1000)
+    expiration_time = timezone.now() + timedelta(seconds=expires_in) if expires_in else None
+    if not hasattr(recipients, "filter"):
+        recipients = audience(user_ids=recipients)
+
+    last_id, written = None, 0
+    while True:
+        chunk = recipients.filter(user_id__gt=last_id) if last_id else recipients
+        chunk = list(chunk[:chunk_size])
+        if not chunk:
+            break
+        with transaction.atomic():
+            Notification.objects.bulk_create(
+                [Notification(user_id_id=user_id, event_type=event_type, message=message, expiration_time=expiration_time) for user_id in chunk],
+                batch_size=chunk_size,
+            )
+        written += len(chunk)
+        last_id = chunk[-1]
+    return written
+
+
+def _run_fan_out(*args, **kwargs):
+    close_old_connections()
+    try:
+        return fan_out(*args, **kwargs)
+    except Exception:
+        logger.exception("Notification fan-out failed")
+        raise
+    finally:
+        connection.close()
+
+
+def submit_fan_out(event_type, message, recipients, expires_in=None):
+    """
+    Run ``fan_out`` on the worker pool and return its Future.
+    """
+    return get_executor().submit(_run_fan_out, event_type, message, recipients, expires_in=expires_in)
+
+
+def notify(event_type, message, recipients, expires_in=None):
+    """
+    Queue a fan-out for once the surrounding transaction commits, so the
+    workers only ever see committed rows and rolled-back events send nothing.
+    """
+    transaction.on_commit(functools.partial(submit_fan_out, event_type, message, recipients, expires_in=expires_in))
+
+
+def live_notifications(user, now=None):
+    """
+    Notifications ``user`` can still see, newest first.
+    """
+    now = now or timezone.now()
+    return Notification.objects.filter(Q(expiration_time__isnull=True) | Q(expiration_time__gt=now), user_id=user).order_by("-created_at")
+
+
+def expired_notifications(now=None):
+    now = now or timezone.now()
+    return Notification.objects.with_deleted().filter(expiration_time__lte=now)
@@ -0,0 +1,165 @@
+import base64
+import binascii
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework import exceptions, pagination, response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .archive import merge_pages
+
+
+def encode_cursor(*parts):
+    """
+    Opaque, URL-safe cursor built from the string form of the sort key values.
+    """
+    raw = "|".join(str(part) for part in parts)
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(encoded, count):
+    """
+    Split a cursor from ``encode_cursor`` back into ``count`` strings, raising ValueError if it is malformed.
+    """
+    try:
+        parts = base64.urlsafe_b64decode(encoded.encode("ascii")).decode("utf-8").split("|")
+    except (binascii.Error, UnicodeError) as exc:
+        raise ValueError(str(exc))
+    if len(parts) != count:
+        raise ValueError("Wrong number of cursor fields")
+    return parts
+
+
+class MessageCursorPagination(pagination.BasePagination):
+    """
+    Keyset pagination over (sent_at, message_id) for conversation messages.
+
+    Pages are always returned newest first. ``before`` walks back into older
+    history and ``after`` walks forward towards the newest message, so each
+    page is a single range scan on the (conversation, deleted_at, sent_at,
+    message_id) index no matter how deep into the history the client is.
+    Views with a ``get_archive_queryset()`` page on into archived messages.
+    """
+
+    before_query_param = "before"
+    after_query_param = "after"
+    page_size_query_param = "page_size"
+    invalid_cursor_message = "Invalid cursor"
+
+    def __init__(self):
+        self.page_size = getattr(settings, "MESSAGES_PAGE_SIZE", 50)
+        self.max_page_size = getattr(settings, "MESSAGES_MAX_PAGE_SIZE", 200)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+
+        before = request.query_params.get(self.before_query_param)
+        after = request.query_params.get(self.after_query_param)
+        if before and after:
+            raise exceptions.ValidationError("Only one of 'before' or 'after' may be given.")
+        before = self.decode_cursor(before) if before else None
+        after = self.decode_cursor(after) if after else None
+
+        # Fetch one extra row to find out whether another page exists.
+        limit = self.page_size + 1
+        results = self.fetch(queryset, before, after, limit)
+
+        # Messages past the hot window live in the archive (see chats.archive).
+        # Walking back only needs it once the hot table runs dry; walking
+        # forward from an archived cursor has to look there first.
+        archive = view.get_archive_queryset() if hasattr(view, "get_archive_queryset") else None
+        if archive is not None and (after or len(results) < limit):
+            results = merge_pages(results, self.fetch(archive, before, after, limit), reverse=not after, limit=limit)
+
+        has_more = len(results) > self.page_size
+        results = results[: self.page_size]
+
+        if after:
+            results.reverse()
+            self.has_older = True
+            self.has_newer = has_more
+        else:
+            self.has_older = has_more
+            self.has_newer = bool(before)
+
+        self.page = results
+        return results
+
+    def fetch(self, queryset, before, after, limit):
+        if after:
+            sent_at, message_id = after
+            queryset = queryset.filter(Q(sent_at__gt=sent_at) | Q(sent_at=sent_at, message_id__gt=message_id)).order_by("sent_at", "message_id")
+        else:
+            if before:
+                sent_at, message_id = before
+                queryset = queryset.filter(Q(sent_at__lt=sent_at) | Q(sent_at=sent_at, message_id__lt=message_id))
+            queryset = queryset.order_by("-sent_at", "-message_id")
+        return list(queryset[:limit])
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if size <= 0:
+            return self.page_size
+        return min(size, self.max_page_size)
+
+    def get_next_link(self):
+        if not self.page or not self.has_older:
+            return None
+        url = remove_query_param(self.base_url, self.after_query_param)
+        return replace_query_param(url, self.before_query_param, self.encode_cursor(self.page[-1]))
+
+    def get_previous_link(self):
+        if not self.page or not self.has_newer:
+            return None
+        url = remove_query_param(self.base_url, self.before_query_param)
+        return replace_query_param(url, self.after_query_param, self.encode_cursor(self.page[0]))
+
+    def get_paginated_response(self, data):
+        return response.Response(OrderedDict([("next", self.get_next_link()), ("previous", self.get_previous_link()), ("results", data)]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "previous": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
+
+    def encode_cursor(self, message):
+        return encode_cursor(message.sent_at.isoformat(), message.message_id.hex)
+
+    def decode_cursor(self, encoded):
+        try:
+            sent_at, message_id = decode_cursor(encoded, 2)
+            sent_at = parse_datetime(sent_at)
+            message_id = uuid.UUID(message_id)
+        except ValueError:
+            raise exceptions.NotFound(self.invalid_cursor_message)
+        if sent_at is None:
+            raise exceptions.NotFound(self.invalid_cursor_message)
+        return sent_at, message_id
+
+
+class PropertyPagination(pagination.PageNumberPagination):
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = 100
+
+
+class NotificationPagination(pagination.CursorPagination):
+    # Walks the (user_id, is_read, deleted_at, created_at) index newest first
+    ordering = "-created_at"
+    page_size = 50
+    page_size_query_param = "page_size"
+    max_page_size = 200
@@ -0,0 +1,227 @@
+"""
+Opt-in per-request profiling.
+
+ProfilingMiddleware records, for the requests it profiles, the number of
+SQL queries and the time spent in them, repeated queries, time spent
+serializing and peak Python memory. A request is profiled when:
+
+- PROFILE_REQUESTS is on (every request), or
+- PROFILE_HEADER names a request header and the client sends it, or
+- it falls in the PROFILE_SAMPLE_RATE fraction of requests.
+
+The first two get a ``Server-Timing`` response header; through the header
+only under DEBUG or for admins and bearer-token clients, so anonymous
+callers cannot time the server's internals. Sampled requests are
+written to the ``chats.profiling`` logger instead, so sampling can run in
+production without showing timings to clients. With none of the three
+configured the middleware removes itself from the stack at startup.
+"""
+
+import contextvars
+import functools
+import json
+import logging
+import random
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from rest_framework import serializers
+
+from .authorization import get_role
+
+logger = logging.getLogger(__name__)
+
+_current = contextvars.ContextVar("chats_profile", default=None)
+
+# tracemalloc is process-wide: one request at a time owns it
+_memory_lock = threading.Lock()
+
+
+class Profile:
+    """
+    Measurements for one request. Also the ``execute_wrapper`` that times
+    each query.
+    """
+
+    def __init__(self):
+        self.queries = []
+        self.serialize_seconds = 0.0
+        self.serializing = False
+        self.total_seconds = 0.0
+        self.peak_memory = None
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, repr(params), time.perf_counter() - started))
+
+    @property
+    def sql_seconds(self):
+        return sum(seconds for _, _, seconds in self.queries)
+
+    def duplicates(self):
+        """
+        ``{sql: count}`` for statements run more than once with the same parameters.
+        """
+        counts = Counter((sql, params) for sql, params, _ in self.queries)
+        return {sql: count for (sql, _), count in counts.most_common() if count > 1}
+
+    def similar(self):
+        """
+        ``{sql: count}`` for statements run more than once with any parameters, the shape of an N+1.
+        """
+        counts = Counter(sql for sql, _, _ in self.queries)
+        return {sql: count for sql, count in counts.most_common() if count > 1}
+
+    def server_timing(self):
+        repeated = sum(count - 1 for count in self.duplicates().values())
+        metrics = [
+            f'db;dur={self.sql_seconds * 1000:.3f};desc="{len(self.queries)} queries, {repeated} duplicate"',
+            f"serialize;dur={self.serialize_seconds * 1000:.3f}",
+            f"total;dur={self.total_seconds * 1000:.3f}",
+        ]
+        if self.peak_memory is not None:
+            metrics.append(f'mem;desc="peak {self.peak_memory / 1024:.1f} KiB"')
+        return ", ".join(metrics)
+
+    def as_record(self, request, response):
+        return {
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            "total_ms": round(self.total_seconds * 1000, 3),
+            "queries": len(self.queries),
+            "sql_ms": round(self.sql_seconds * 1000, 3),
+            "duplicates": dict(list(self.duplicates().items())[:5]),
+            "similar": dict(list(self.similar().items())[:5]),
+            "serialize_ms": round(self.serialize_seconds * 1000, 3),
+            "peak_memory": self.peak_memory,
+        }
+
+
+def timed_representation(to_representation):
+    """
+    Add the time spent in the outermost serializer call to the current profile.
+
+    Queries run by serializer fields (lazy relations, method fields) count
+    towards both serialize and db.
+    """
+
+    @functools.wraps(to_representation)
+    def wrapper(self, instance):
+        profile = _current.get()
+        if profile is None or profile.serializing:
+            return to_representation(self, instance)
+        profile.serializing = True
+        started = time.perf_counter()
+        try:
+            return to_representation(self, instance)
+        finally:
+            profile.serializing = False
+            profile.serialize_seconds += time.perf_counter() - started
+
+    wrapper.profiled = True
+    return wrapper
+
+
+def start_tracing_memory():
+    """
+    Start tracemalloc for the current request. False when another request,
+    or anything else, is already tracing; that request goes without a
+    memory figure.
+    """
+    if not _memory_lock.acquire(blocking=False):
+        return False
+    if tracemalloc.is_tracing():
+        _memory_lock.release()
+        return False
+    tracemalloc.start()
+    return True
+
+
+def stop_tracing_memory():
+    """
+    Stop the trace started by ``start_tracing_memory`` and return its peak in bytes.
+    """
+    try:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    finally:
+        _memory_lock.release()
+    return peak
+
+
+def may_see_timings(request):
+    """
+    Whether a client that asked through PROFILE_HEADER gets Server-Timing back.
+    """
+    if settings.DEBUG:
+        return True
+    user = getattr(request, "user", None)
+    if user is None or not user.is_authenticated:
+        return False
+    # DRF sets request.auth to the token a bearer client authenticated with
+    return get_role(user) == "admin" or getattr(request, "auth", None) is not None
+
+
+def instrument_serializers():
+    """
+    Time ``to_representation`` on DRF's base serializers. Done once, and only
+    when profiling is configured, so an unprofiled process runs DRF untouched.
+    """
+    for cls in (serializers.Serializer, serializers.ListSerializer):
+        if not getattr(cls.to_representation, "profiled", False):
+            cls.to_representation = timed_representation(cls.to_representation)
+
+
+class ProfilingMiddleware:
+    """
+    Profile the requests selected by PROFILE_REQUESTS, PROFILE_HEADER and
+    PROFILE_SAMPLE_RATE. Should be first in MIDDLEWARE to cover the rest.
+    """
+
+    def __init__(self, get_response):
+        self.always = getattr(settings, "PROFILE_REQUESTS", False)
+        self.header = getattr(settings, "PROFILE_HEADER", None)
+        self.sample_rate = getattr(settings, "PROFILE_SAMPLE_RATE", 0.0)
+        if not (self.always or self.header or self.sample_rate):
+            raise MiddlewareNotUsed
+        self.memory = getattr(settings, "PROFILE_MEMORY", True)
+        self.get_response = get_response
+        instrument_serializers()
+
+    def __call__(self, request):
+        # Who sent the header is only known once the view has authenticated them
+        requested = bool(self.header and request.headers.get(self.header))
+        sampled = bool(self.sample_rate) and random.random() < self.sample_rate
+        if not (self.always or requested or sampled):
+            return self.get_response(request)
+
+        profile = Profile()
+        token = _current.set(profile)
+        trace_memory = self.memory and start_tracing_memory()
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(profile))
+                response = self.get_response(request)
+        finally:
+            profile.total_seconds = time.perf_counter() - started
+            if trace_memory:
+                profile.peak_memory = stop_tracing_memory()
+            _current.reset(token)
+
+        if self.always or (requested and may_see_timings(request)):
+            response["Server-Timing"] = profile.server_timing()
+        if sampled:
+            logger.info("profile %s", json.dumps(profile.as_record(request, response)))
+        return response
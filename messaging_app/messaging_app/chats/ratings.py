@@ -0,0 +1,73 @@
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, Count, DecimalField, ExpressionWrapper, F, FloatField, Q, Sum, Value, When
+from django.db.models.functions import Cast
+
+from .models import PropertyRating, Review
+
+STARS = range(1, 6)
+
+
+def review_contribution(review):
+    """
+    What a review adds to its property's totals: ``(property_id, reviewed_by, rating)``,
+    or None for a soft-deleted review.
+    """
+    if review is None or review.deleted_at is not None:
+        return None
+    return (review.property_id_id, review.reviewed_by, review.rating)
+
+
+def apply_contribution(contribution, sign):
+    property_id, reviewed_by, rating = contribution
+    totals = PropertyRating.objects.filter(property_id=property_id, reviewed_by=reviewed_by)
+
+    if sign > 0:
+        PropertyRating.objects.bulk_create([PropertyRating(property_id_id=property_id, reviewed_by=reviewed_by)], ignore_conflicts=True)
+    totals.update(
+        review_count=F("review_count") + sign,
+        rating_sum=F("rating_sum") + sign * rating,
+        **{f"stars_{rating}": F(f"stars_{rating}") + sign},
+    )
+    # A separate statement: MySQL would otherwise read the already-updated
+    # columns in the same SET clause while other backends read the old ones.
+    totals.update(average_rating=average_expression())
+
+
+def average_expression():
+    average = ExpressionWrapper(Cast("rating_sum", FloatField()) / F("review_count"), output_field=DecimalField(max_digits=3, decimal_places=2))
+    return Case(When(review_count=0, then=Value(Decimal("0.00"))), default=average, output_field=DecimalField(max_digits=3, decimal_places=2))
+
+
+def update_rating(before, after):
+    """
+    Move a review's contribution from ``before`` to ``after`` (either may be None).
+    """
+    if before == after:
+        return
+    with transaction.atomic():
+        if before is not None:
+            apply_contribution(before, -1)
+        if after is not None:
+            apply_contribution(after, +1)
+
+
+def reconcile_ratings(property_ids):
+    """
+    Recompute the totals of the given properties from their live reviews.
+    """
+    rows = (
+        Review.objects.filter(property_id__in=property_ids, deleted_at__isnull=True)
+        .order_by()
+        .values("property_id", "reviewed_by")
+        .annotate(review_count=Count("pk"), rating_sum=Sum("rating"), **{f"stars_{star}": Count("pk", filter=Q(rating=star)) for star in STARS})
+    )
+    ratings = [PropertyRating(property_id_id=row.pop("property_id"), **row) for row in rows]
+    for rating in ratings:
+        rating.average_rating = (Decimal(rating.rating_sum) / rating.review_count).quantize(Decimal("0.01"))
+
+    with transaction.atomic():
+        PropertyRating.objects.filter(property_id__in=property_ids).delete()
+        PropertyRating.objects.bulk_create(ratings)
+    return len(ratings)
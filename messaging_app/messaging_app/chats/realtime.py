@@ -0,0 +1,29 @@
+import json
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+
+def conversation_group_name(conversation_id):
+    return f"conversation_{conversation_id}"
+
+
+def broadcast_message(conversation_id, sender_id, data):
+    """
+    Push a serialized message to the sockets subscribed to the conversation
+    once the surrounding transaction commits. Each socket only passes it on
+    to a user allowed to read it, as in visible_messages.
+
+    Fan-out goes through the configured channel layer (CHANNEL_LAYERS): the
+    in-memory layer for a single process and tests, Redis across workers.
+    """
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+
+    # Channel layers only carry plain JSON types, not UUIDs or datetimes
+    payload = json.loads(JSONRenderer().render(data))
+    event = {"type": "chat.message", "sender_id": str(sender_id), "message": payload}
+    transaction.on_commit(lambda: async_to_sync(channel_layer.group_send)(conversation_group_name(conversation_id), event))
@@ -0,0 +1,198 @@
+"""
+Read-replica routing for the chats API.
+
+Viewsets that include ReplicaReadMixin send the queries of their safe
+(GET/HEAD/OPTIONS) requests to one of DATABASE_REPLICAS, picked round-robin
+among the replicas that pass a periodic health check. Everything else,
+including every write and anything inside a transaction, uses ``default``.
+
+After any request that writes, through whatever view, ReplicaPinMiddleware
+pins its user to the primary for REPLICA_PIN_SECONDS, so they read their
+own writes while the replicas catch up. Writes are noticed by the router,
+which Django asks for the database of every save, update, delete and bulk
+insert. Pins live in a process-local cache and, when REPLICA_PIN_CACHE
+names an entry in CACHES, in that shared cache as well.
+"""
+
+import contextlib
+import contextvars
+import itertools
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from rest_framework.permissions import SAFE_METHODS
+
+from .cache import TTLCache
+
+_read_alias = contextvars.ContextVar("chats_read_alias", default=None)
+# Set per request by ReplicaPinMiddleware; its one item turns True on the first write
+_writes = contextvars.ContextVar("chats_writes", default=None)
+
+pin_cache = TTLCache(maxsize=getattr(settings, "REPLICA_PIN_CACHE_SIZE", 10000), ttl=getattr(settings, "REPLICA_PIN_SECONDS", 5), name="replica_pins")
+
+
+def replica_aliases():
+    return list(getattr(settings, "DATABASE_REPLICAS", []))
+
+
+class ReplicaPool:
+    """
+    Round-robin over replica aliases, skipping any that failed their last
+    health check. Each replica is checked at most once per ``check_interval``
+    seconds per process.
+    """
+
+    def __init__(self, check_interval=5):
+        self.health = TTLCache(maxsize=64, ttl=check_interval)
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+
+    def choose(self, aliases):
+        if not aliases:
+            return None
+        with self.lock:
+            start = next(self.counter)
+        for offset in range(len(aliases)):
+            alias = aliases[(start + offset) % len(aliases)]
+            if self.is_healthy(alias):
+                return alias
+        return None
+
+    def is_healthy(self, alias):
+        healthy = self.health.get(alias)
+        if healthy is None:
+            healthy = self.check(alias)
+            self.health.set(alias, healthy)
+        return healthy
+
+    def check(self, alias):
+        connection = connections[alias]
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            return True
+        except DatabaseError:
+            connection.close()
+            return False
+
+
+pool = ReplicaPool(check_interval=getattr(settings, "REPLICA_HEALTH_CHECK_INTERVAL", 5))
+
+
+def get_shared_cache():
+    alias = getattr(settings, "REPLICA_PIN_CACHE", None)
+    return caches[alias] if alias else None
+
+
+def pin_key(user):
+    return f"chats:replica-pin:{user.pk}"
+
+
+def pin_to_primary(user):
+    seconds = getattr(settings, "REPLICA_PIN_SECONDS", 5)
+    pin_cache.set(pin_key(user), True, seconds)
+    shared = get_shared_cache()
+    if shared is not None:
+        shared.set(pin_key(user), True, seconds)
+
+
+def is_pinned(user):
+    if pin_cache.get(pin_key(user)):
+        return True
+    shared = get_shared_cache()
+    return bool(shared is not None and shared.get(pin_key(user)))
+
+
+def record_write():
+    writes = _writes.get()
+    if writes is not None:
+        writes[0] = True
+
+
+def current_read_alias():
+    return _read_alias.get()
+
+
+@contextlib.contextmanager
+def read_from_primary():
+    """
+    Send reads to ``default`` for the duration, whatever replica the request was given.
+    """
+    token = _read_alias.set(None)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+class ReplicaRouter:
+    """
+    Route reads to the replica chosen for the current request, if any.
+    """
+
+    def db_for_read(self, model, **hints):
+        alias = current_read_alias()
+        if alias is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return alias
+
+    def db_for_write(self, model, **hints):
+        record_write()
+        # Explicit, or Django would write an instance back to the replica it was read from
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = {DEFAULT_DB_ALIAS, *replica_aliases()}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema through replication
+        if db in replica_aliases():
+            return False
+        return None
+
+
+class ReplicaReadMixin:
+    """
+    Serve safe requests from a healthy replica unless the user recently wrote.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method in SAFE_METHODS and not (request.user.is_authenticated and is_pinned(request.user)):
+            alias = pool.choose(replica_aliases())
+            if alias is not None:
+                self._read_alias_token = _read_alias.set(alias)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, "_read_alias_token", None)
+        if token is not None:
+            _read_alias.reset(token)
+            self._read_alias_token = None
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+class ReplicaPinMiddleware:
+    """
+    Pin the user to the primary after any request that wrote to the database.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        writes = [False]
+        token = _writes.set(writes)
+        try:
+            response = self.get_response(request)
+        finally:
+            _writes.reset(token)
+        # DRF sets request.user to whoever its authentication found
+        user = getattr(request, "user", None)
+        if writes[0] and user is not None and user.is_authenticated:
+            pin_to_primary(user)
+        return response
@@ -0,0 +1,16 @@
+from channels.routing import URLRouter
+from django.urls import path
+
+from chats.authentication import TokenAuthMiddleware
+from chats.consumers import ConversationConsumer
+
+websocket_urlpatterns = [
+    path("ws/conversations/<uuid:conversation_id>/", ConversationConsumer.as_asgi()),
+]
+
+
+def websocket_application():
+    """
+    The WebSocket stack below the origin check: token authentication, then routing.
+    """
+    return TokenAuthMiddleware(URLRouter(websocket_urlpatterns))
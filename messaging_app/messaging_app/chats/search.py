@@ -0,0 +1,83 @@
+import math
+import re
+from collections import Counter
+
+from django.conf import settings
+from django.db.models import Count, Max, Sum
+from django.utils import timezone
+
+from .authorization import get_role
+from .models import Conversation, Message, SearchToken
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+MIN_TOKEN_LENGTH = 2
+MAX_TOKEN_LENGTH = 64
+
+
+def tokenize(text):
+    """
+    Lower-cased word tokens of ``text`` with their term frequencies.
+    """
+    tokens = (token for token in TOKEN_RE.findall(text.lower()) if len(token) >= MIN_TOKEN_LENGTH)
+    return Counter(token[:MAX_TOKEN_LENGTH] for token in tokens)
+
+
+def build_tokens(message):
+    return [
+        SearchToken(token=token, message_id=message.message_id, conversation_id=message.conversation_id, sent_at=message.sent_at, term_frequency=min(count, 32767))
+        for token, count in tokenize(message.message_body).items()
+    ]
+
+
+def index_messages(messages, batch_size=1000):
+    """
+    Add index rows for newly created messages.
+    """
+    tokens = [token for message in messages for token in build_tokens(message)]
+    SearchToken.objects.bulk_create(tokens, batch_size=batch_size, ignore_conflicts=True)
+
+
+def reindex_message(message):
+    SearchToken.objects.filter(message_id=message.message_id).delete()
+    index_messages([message])
+
+
+def unindex_messages(message_ids):
+    SearchToken.objects.filter(message_id__in=message_ids).delete()
+
+
+def search_messages(user, query, limit=20):
+    """
+    Messages in the user's conversations containing every token of ``query``,
+    limited to those ``authorization.visible_messages`` shows them.
+
+    The newest ``SEARCH_CANDIDATES`` matches are taken from the index in one
+    grouped query, then ranked by term frequency with a recency decay of
+    ``SEARCH_HALF_LIFE_DAYS``.
+    """
+    tokens = list(tokenize(query))
+    if not tokens:
+        return []
+
+    conversations = Conversation.participants.through.objects.filter(user_id=user.pk).values("conversation_id")
+    matches = SearchToken.objects.filter(token__in=tokens, conversation_id__in=conversations)
+    if get_role(user) != "admin":
+        # Non-admins only read the messages they sent, as everywhere else
+        matches = matches.filter(message__sender_id=user.pk)
+    candidates = (
+        matches.values("message_id")
+        .annotate(matched=Count("token"), frequency=Sum("term_frequency"), sent_at=Max("sent_at"))
+        .filter(matched=len(tokens))
+        .order_by("-sent_at")[: getattr(settings, "SEARCH_CANDIDATES", 500)]
+    )
+
+    now = timezone.now()
+    half_life = getattr(settings, "SEARCH_HALF_LIFE_DAYS", 30) * 86400
+
+    def score(row):
+        age = max((now - row["sent_at"]).total_seconds(), 0)
+        return (1 + math.log(row["frequency"])) * 0.5 ** (age / half_life)
+
+    ranked = sorted(candidates, key=score, reverse=True)[:limit]
+    messages = Message.objects.select_related("sender_id", "recipient_id").in_bulk([row["message_id"] for row in ranked])
+    return [messages[row["message_id"]] for row in ranked if row["message_id"] in messages]
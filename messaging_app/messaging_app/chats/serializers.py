@@ -1,5 +1,6 @@
 from rest_framework import serializers
-from .models import User, Message, Conversation
+from rest_framework.validators import UniqueValidator
+from .models import User, Message, Conversation, Location, Notification, Property, Booking
 
 
 class TimeStampedModelSerializer(serializers.ModelSerializer):
@@ -22,6 +23,8 @@ class UserSerializer(TimeStampedModelSerializer):
         model = User
         fields = ["user_id", "role", "first_name", "last_name", "full_name", "email", "password_hash", "phone_number", "created_at", "updated_at", "deleted_at"]
         read_only_fields = ["user_id", "created_at", "updated_at", "deleted_at"]
+        # The unique index covers soft-deleted users too, so the check must see them
+        extra_kwargs = {"email": {"validators": [UniqueValidator(queryset=User.objects.with_deleted())]}}
 
     def get_full_name(self, obj):
         return f"{obj.first_name} {obj.last_name}"
@@ -37,45 +40,143 @@ class UserSerializer(TimeStampedModelSerializer):
         password_hash = validated_data.pop("password_hash")
         if len(password_hash) < 4:
             raise serializers.ValidationError("Password has not been hashed")
-        user = User.objects.create(**validated_data)
+        # Hash before the INSERT, rather than inserting and then updating
+        user = User(**validated_data)
         user.set_password(password_hash)
-        print(user.password)
         user.save()
         return user
     
     
 class MessageSerializer(serializers.ModelSerializer):
     sender_email = serializers.SerializerMethodField(read_only=True)
-    sender =  UserSerializer(read_only=True)
-    recipient = UserSerializer(read_only=True)
+    sender = UserSerializer(source="sender_id", read_only=True)
+    recipient = UserSerializer(source="recipient_id", read_only=True)
+    # Checked against the conversation's participants when the message is created
+    recipient_id = serializers.PrimaryKeyRelatedField(queryset=User.objects.all(), write_only=True, required=False, allow_null=True)
+
     class Meta:
         model = Message
-        fields = ["message_id", "conversation", "sender_email", "sender", "recipient", "message_body", "sent_at", "read_at", "deleted_at"]
-        read_only_fields = ["sent_at", "read_at", "deleted_at"]
+        fields = ["message_id", "conversation", "sender_email", "sender", "recipient", "recipient_id", "message_body", "sent_at", "read_at", "deleted_at"]
+        read_only_fields = ["conversation", "sent_at", "read_at", "deleted_at"]
 
     def create(self, validated_data):
-        
-        sender = validated_data.get("sender")
+
+        sender = validated_data.get("sender_id")
         if not isinstance(sender, User):
             raise serializers.ValidationError("Sender must be a User object")
         return super().create(validated_data)
 
     def get_sender_email(self, obj):
         # Custom method to return the email of the sender
-        return obj.sender.email
+        return obj.sender_id.email if obj.sender_id else None
 
 
 
 class ConversationSerializer(serializers.ModelSerializer):
     participants_email = serializers.SerializerMethodField(read_only=True)
     participants = UserSerializer(many=True, read_only=True)
-    messages = MessageSerializer(many=True, read_only=True)
 
     class Meta:
         model = Conversation
-        fields = ["conversation_id","participants_email", "participants", "messages", "created_at"]
+        fields = ["conversation_id", "participants_email", "participants", "created_at"]
         read_only_fields = ["conversation_id", "created_at"]
 
     def get_participants_email(self, obj):
-        # Custom method to return the email of the participants
-        return ", ".join([user.email for user in obj.participants.all()])
\ No newline at end of file
+        # Custom method to return the email of the participants.
+        # participants.all() is served from the viewset's prefetch cache.
+        return ", ".join([user.email for user in obj.participants.all()])
+
+class ConversationSummarySerializer(ConversationSerializer):
+    # Inbox row: relies on the annotations added by ConversationViewSet.get_inbox_queryset
+    last_message = serializers.SerializerMethodField(read_only=True)
+    unread_count = serializers.IntegerField(read_only=True)
+    last_activity_at = serializers.DateTimeField(read_only=True)
+
+    class Meta(ConversationSerializer.Meta):
+        fields = ["conversation_id", "participants_email", "participants", "last_message", "unread_count", "last_activity_at", "created_at"]
+
+    def get_last_message(self, obj):
+        if obj.last_message_id is None:
+            return None
+        return {
+            "message_id": obj.last_message_id,
+            "sender_id": obj.last_message_sender_id,
+            "message_body": obj.last_message_body,
+            "sent_at": serializers.DateTimeField().to_representation(obj.last_message_sent_at),
+        }
+
+
+class LocationSerializer(TimeStampedModelSerializer):
+    latitude = serializers.DecimalField(max_digits=10, decimal_places=7, read_only=True)
+    longitude = serializers.DecimalField(max_digits=10, decimal_places=7, read_only=True)
+
+    class Meta:
+        model = Location
+        fields = ["location_id", "latitude", "longitude", "city", "state", "country"]
+
+
+class PropertySerializer(TimeStampedModelSerializer):
+    location = LocationSerializer(source="location_id", read_only=True)
+
+    class Meta:
+        model = Property
+        fields = ["property_id", "host_id", "name", "description", "price_per_night", "availability_status", "location", "created_at", "updated_at"]
+        read_only_fields = ["property_id", "created_at", "updated_at"]
+
+
+class RatedPropertySerializer(PropertySerializer):
+    # Guest rating totals joined in by PropertyViewSet.get_queryset
+    average_rating = serializers.DecimalField(max_digits=3, decimal_places=2, read_only=True)
+    review_count = serializers.IntegerField(read_only=True)
+
+    class Meta(PropertySerializer.Meta):
+        fields = PropertySerializer.Meta.fields + ["average_rating", "review_count"]
+
+
+class NearbyPropertySerializer(serializers.Serializer):
+    distance_km = serializers.FloatField()
+    property = PropertySerializer()
+
+
+class BookingSerializer(TimeStampedModelSerializer):
+    class Meta:
+        model = Booking
+        fields = ["booking_id", "property_id", "user_id", "start_date", "end_date", "total_price", "booking_status", "payment_status", "created_at", "updated_at"]
+        read_only_fields = fields
+
+
+class CouponRedeemSerializer(serializers.Serializer):
+    code = serializers.CharField(max_length=36)
+    property_id = serializers.UUIDField(required=False)
+
+
+class BookingCreateSerializer(serializers.Serializer):
+    property_id = serializers.UUIDField()
+    start_date = serializers.DateField()
+    end_date = serializers.DateField()
+    coupon_code = serializers.CharField(max_length=36, required=False, allow_blank=True)
+
+    def validate(self, attrs):
+        if attrs["end_date"] < attrs["start_date"]:
+            raise serializers.ValidationError({"end_date": "End date cannot be before start date."})
+        return attrs
+
+
+class NotificationSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Notification
+        fields = ["notification_id", "event_type", "message", "is_read", "created_at", "expiration_time"]
+        read_only_fields = fields
+
+
+class NotificationMarkReadSerializer(serializers.Serializer):
+    notification_ids = serializers.ListField(child=serializers.UUIDField(), required=False, help_text="Mark only these; all unread ones when left out.")
+
+
+class NotificationBroadcastSerializer(serializers.Serializer):
+    event_type = serializers.ChoiceField(choices=[choice for choice, _ in Notification._meta.get_field("event_type").choices], default="general_alert")
+    message = serializers.CharField()
+    role = serializers.ChoiceField(choices=[choice for choice, _ in User.ROLE_CHOICES], required=False)
+    user_ids = serializers.ListField(child=serializers.UUIDField(), required=False)
+    # Bounded so the expiry time always fits in a datetime
+    expires_in = serializers.IntegerField(min_value=1, max_value=366 * 24 * 3600, required=False, help_text="Seconds until the notifications expire, at most a year.")
@@ -0,0 +1,208 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.db import transaction
+from django.dispatch import receiver
+
+from .authentication import forget_tokens, forget_user_tokens
+from .authorization import forget_conversation, forget_participants
+from .availability import sync_booking_nights
+from .coupons import forget_coupon
+from .geo import encode_geohash
+from .metrics import messages_created
+from .models import Booking, Conversation, Coupon, Location, Message, Review, User, UserToken, soft_deleted
+from .notifications import notify
+from .ratings import reconcile_ratings, review_contribution, update_rating
+from .search import index_messages, reindex_message, unindex_messages
+from .unread import decrement_unread, discount_unread_messages, increment_unread
+from .versions import changed
+
+
+@receiver(post_save, sender=Message)
+def count_new_unread_message(sender, instance, created, **kwargs):
+    if created and instance.recipient_id_id and instance.read_at is None:
+        increment_unread(instance.recipient_id_id, instance.conversation_id)
+
+
+def unread_key(message):
+    # The counter a message adds to while it is unread, or None
+    if message is None or message.recipient_id_id is None or message.read_at is not None or message.deleted_at is not None:
+        return None
+    return (message.recipient_id_id, message.conversation_id)
+
+
+@receiver(pre_save, sender=Message)
+def remember_unread_state(sender, instance, **kwargs):
+    if instance._state.adding:
+        instance._previous_unread_key = None
+    else:
+        previous = Message.objects.with_deleted().filter(pk=instance.pk).only("recipient_id", "conversation_id", "read_at", "deleted_at").first()
+        instance._previous_unread_key = unread_key(previous)
+
+
+@receiver(post_save, sender=Message)
+def recount_changed_unread_message(sender, instance, created, **kwargs):
+    # Creation is counted by count_new_unread_message; this follows read_at,
+    # recipient and deleted_at changes saved later (QuerySet.update() callers
+    # such as mark_conversation_read adjust the counters themselves)
+    if created:
+        return
+    before, after = getattr(instance, "_previous_unread_key", None), unread_key(instance)
+    if before != after:
+        if before is not None:
+            decrement_unread(*before)
+        if after is not None:
+            increment_unread(*after)
+
+
+@receiver(post_save, sender=Message)
+def count_created_message(sender, instance, created, **kwargs):
+    if created:
+        messages_created.inc()
+
+
+@receiver(post_save, sender=Message)
+def index_message_body(sender, instance, created, update_fields=None, **kwargs):
+    # Index rows go away with the message through the CASCADE foreign key
+    if created:
+        index_messages([instance])
+    elif update_fields is None or "message_body" in update_fields:
+        reindex_message(instance)
+
+
+@receiver(post_delete, sender=Message)
+def discount_deleted_unread_message(sender, instance, **kwargs):
+    # Soft-deleted messages were already taken off the counter
+    if instance.recipient_id_id and instance.read_at is None and instance.deleted_at is None:
+        decrement_unread(instance.recipient_id_id, instance.conversation_id)
+
+
+@receiver(post_save, sender=Message)
+@receiver(post_delete, sender=Message)
+def publish_message_change(sender, instance, **kwargs):
+    changed(conversation_ids=[instance.conversation_id])
+
+
+@receiver(soft_deleted, sender=Message)
+def forget_soft_deleted_messages(sender, pks, **kwargs):
+    messages = Message.objects.with_deleted().filter(pk__in=pks)
+    discount_unread_messages(messages)
+    unindex_messages(pks)
+    changed(conversation_ids=set(messages.values_list("conversation_id", flat=True)))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+@receiver(soft_deleted, sender=User)
+def publish_user_change(sender, **kwargs):
+    # Profiles are embedded in conversation and message output
+    changed(names=["users"])
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_user_token_cache(sender, instance, **kwargs):
+    # Cached token answers hold a copy of the user, role included
+    forget_user_tokens([instance.pk])
+
+
+@receiver(soft_deleted, sender=User)
+def forget_soft_deleted_user_tokens(sender, pks, **kwargs):
+    forget_user_tokens(pks)
+
+
+@receiver(post_save, sender=UserToken)
+@receiver(post_delete, sender=UserToken)
+def forget_token_cache(sender, instance, **kwargs):
+    # Also drops a cached "invalid" answer when the token is created
+    forget_tokens([instance.token])
+
+
+@receiver(soft_deleted, sender=UserToken)
+def forget_soft_deleted_tokens(sender, pks, **kwargs):
+    forget_tokens(UserToken.objects.with_deleted().filter(pk__in=pks).values_list("token", flat=True))
+
+
+@receiver(post_save, sender=Conversation)
+def publish_conversation_change(sender, instance, **kwargs):
+    changed(conversation_ids=[instance.pk])
+
+
+@receiver(pre_delete, sender=Conversation)
+def publish_conversation_removal(sender, instance, **kwargs):
+    # Participants are gone by the time the change is published
+    user_ids = list(instance.participants.values_list("pk", flat=True))
+    changed(conversation_ids=[instance.pk], user_ids=user_ids)
+    # Again on commit, in case a request cached the rows in between
+    forget_conversation(instance.pk, user_ids)
+    transaction.on_commit(lambda: forget_conversation(instance.pk, user_ids))
+
+
+@receiver(m2m_changed, sender=Conversation.participants.through)
+def invalidate_participant_cache(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == "pre_clear":
+        # clear() does not report which rows it removes, so read them first
+        related = instance.conversations if reverse else instance.participants
+        pk_set = set(related.values_list("pk", flat=True))
+    elif action not in ("post_add", "post_remove"):
+        return
+
+    if reverse:
+        forget_participants((conversation_id, instance.pk) for conversation_id in pk_set)
+        changed(conversation_ids=pk_set, user_ids=[instance.pk])
+    else:
+        forget_participants((instance.pk, user_id) for user_id in pk_set)
+        changed(conversation_ids=[instance.pk], user_ids=pk_set)
+
+
+@receiver(post_save, sender=Booking)
+def hold_booked_nights(sender, instance, **kwargs):
+    sync_booking_nights(instance)
+
+
+@receiver(pre_save, sender=Booking)
+def remember_booking_status(sender, instance, **kwargs):
+    if instance._state.adding:
+        instance._previous_booking_status = None
+    else:
+        instance._previous_booking_status = Booking.objects.with_deleted().filter(pk=instance.pk).values_list("booking_status", flat=True).first()
+
+
+@receiver(post_save, sender=Booking)
+def notify_booking_confirmed(sender, instance, **kwargs):
+    # Only on the change to confirmed, not on every later save of a confirmed booking
+    if instance.booking_status == "confirmed" and getattr(instance, "_previous_booking_status", None) != "confirmed":
+        notify("booking_confirmation", f"Your booking from {instance.start_date} to {instance.end_date} is confirmed.", [instance.user_id_id])
+
+
+@receiver(post_save, sender=Coupon)
+@receiver(post_delete, sender=Coupon)
+def forget_cached_coupon(sender, instance, **kwargs):
+    forget_coupon(instance.code)
+
+
+@receiver(pre_save, sender=Location)
+def set_location_geohash(sender, instance, **kwargs):
+    if instance.latitude is not None and instance.longitude is not None:
+        instance.geohash = encode_geohash(instance.latitude, instance.longitude)
+
+
+@receiver(pre_save, sender=Review)
+def remember_review_rating(sender, instance, **kwargs):
+    previous = None
+    if not instance._state.adding:
+        previous = Review.objects.with_deleted().filter(pk=instance.pk).only("property_id", "reviewed_by", "rating", "deleted_at").first()
+    instance._rating_before_save = review_contribution(previous)
+
+
+@receiver(post_save, sender=Review)
+def update_property_rating(sender, instance, **kwargs):
+    update_rating(getattr(instance, "_rating_before_save", None), review_contribution(instance))
+
+
+@receiver(post_delete, sender=Review)
+def remove_deleted_review_rating(sender, instance, **kwargs):
+    update_rating(review_contribution(instance), None)
+
+
+@receiver(soft_deleted, sender=Review)
+def reconcile_soft_deleted_reviews(sender, pks, **kwargs):
+    reconcile_ratings(set(Review.objects.with_deleted().filter(pk__in=pks).values_list("property_id", flat=True)))
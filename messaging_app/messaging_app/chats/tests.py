@@ -1,3 +1,1492 @@
-from django.test import TestCase
+import base64
+import contextlib
+import csv
+import io
+import json
+import logging
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from datetime import date, timedelta
+from decimal import Decimal
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, connections
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import exceptions, viewsets
+from rest_framework.test import APIClient, APITestCase, APITransactionTestCase
+
+from .authentication import credential_cache, get_token_user, revoke_tokens, token_cache
+from .authorization import local_cache
+from .availability import nights_between
+from .benchmark import DEFAULT_BUDGETS
+from .cache import TTLCache
+from .coupons import coupon_cache, redeem_coupon
+from .db.pool import ConnectionPool, PoolExhausted
+from .geo import encode_geohash
+from .metrics import _shards, booking_retries, flush, messages_created, snapshot
+from .notifications import audience, fan_out, shutdown_executor, submit_fan_out
+from .pagination import encode_cursor
+from .profiling import Profile, ProfilingMiddleware, _memory_lock
+from .models import (
+    User,
+    ArchivedMessage,
+    Message,
+    Conversation,
+    SearchToken,
+    UnreadCounter,
+    Booking,
+    Coupon,
+    CouponUsage,
+    Location,
+    Notification,
+    Payment,
+    PaymentMethod,
+    Property,
+    PropertyNight,
+    PropertyRating,
+    Review,
+    UserToken,
+)
+from .replicas import pin_cache, pool
+from .routing import websocket_application
+from .versions import VersionedResponseMixin, get_cache as response_cache
+
+
+logger = logging.getLogger(__name__)
+
+
+def create_user(email, role="guest"):
+    return User.objects.create(email=email, first_name="Test", last_name=role.title(), role=role, phone_number="0700000000")
+
+
+class MessagePaginationTests(APITestCase):
+    def setUp(self):
+        self.admin = create_user("admin@example.com", role="admin")
+        self.guest = create_user("guest@example.com")
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.set([self.admin, self.guest])
+        self.messages = [Message.objects.create(conversation=self.conversation, sender_id=self.guest, recipient_id=self.admin, message_body=f"message {i}") for i in range(7)]
+        self.url = reverse("conversation-message-list", kwargs={"conversation_pk": self.conversation.conversation_id})
+        self.client.force_authenticate(user=self.admin)
+
+    def expected_order(self):
+        return [str(m.message_id) for m in sorted(self.messages, key=lambda m: (m.sent_at, m.message_id.hex), reverse=True)]
+
+    def test_latest_page_first(self):
+        response = self.client.get(self.url, {"page_size": 3})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([m["message_id"] for m in response.data["results"]], self.expected_order()[:3])
+        self.assertIsNotNone(response.data["next"])
+        self.assertIsNone(response.data["previous"])
+
+    def test_walk_backwards_and_forwards(self):
+        seen = []
+        url, params = self.url, {"page_size": 3}
+        while url:
+            response = self.client.get(url, params)
+            seen.extend(m["message_id"] for m in response.data["results"])
+            last = response
+            url, params = response.data["next"], None
+        self.assertEqual(seen, self.expected_order())
+
+        response = self.client.get(last.data["previous"])
+        self.assertEqual([m["message_id"] for m in response.data["results"]], self.expected_order()[3:6])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(self.url, {"before": "not-a-cursor"})
+        self.assertEqual(response.status_code, 404)
+
+    def test_unknown_conversation(self):
+        url = reverse("conversation-message-list", kwargs={"conversation_pk": "00000000-0000-0000-0000-000000000000"})
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class ConversationListQueryCountTests(APITestCase):
+    def setUp(self):
+        self.admin = create_user("admin@example.com", role="admin")
+        self.url = reverse("conversation-list")
+        self.client.force_authenticate(user=self.admin)
+
+    def create_conversations(self, count, messages_per_conversation):
+        # Publish the version bumps, or the second list comes from the response cache
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(count):
+                guest = create_user(f"guest{Conversation.objects.count()}@example.com")
+                conversation = Conversation.objects.create()
+                conversation.participants.set([self.admin, guest])
+                for j in range(messages_per_conversation):
+                    Message.objects.create(conversation=conversation, sender_id=guest, recipient_id=self.admin, message_body=f"message {j}")
+
+    def test_query_count_is_constant(self):
+        # conversations with their inbox annotations, then participants prefetch
+        self.create_conversations(2, 1)
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url)
+        self.assertEqual(len(response.data), 2)
+
+        self.create_conversations(5, 4)
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url)
+        self.assertEqual(len(response.data), 7)
+
+
+class ConversationInboxTests(APITestCase):
+    def setUp(self):
+        self.guest = create_user("guest@example.com")
+        self.host = create_user("host@example.com", role="host")
+        self.older = Conversation.objects.create()
+        self.older.participants.set([self.guest, self.host])
+        self.newer = Conversation.objects.create()
+        self.newer.participants.set([self.guest, self.host])
+        self.client.force_authenticate(user=self.guest)
+
+    def test_inbox_summary(self):
+        Message.objects.create(conversation=self.newer, sender_id=self.host, recipient_id=self.guest, message_body="hello")
+        Message.objects.create(conversation=self.older, sender_id=self.host, recipient_id=self.guest, message_body="first")
+        last = Message.objects.create(conversation=self.older, sender_id=self.host, recipient_id=self.guest, message_body="second")
+
+        response = self.client.get(reverse("conversation-list"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([c["conversation_id"] for c in response.data], [str(self.older.conversation_id), str(self.newer.conversation_id)])
+
+        inbox = response.data[0]
+        self.assertNotIn("messages", inbox)
+        self.assertEqual(inbox["last_message"]["message_id"], last.message_id)
+        self.assertEqual(inbox["last_message"]["message_body"], "second")
+        self.assertEqual(inbox["unread_count"], 2)
+
+    def test_conversation_without_messages(self):
+        response = self.client.get(reverse("conversation-list"))
+        self.assertIsNone(response.data[0]["last_message"])
+        self.assertEqual(response.data[0]["unread_count"], 0)
+
+
+class UnreadCounterTests(APITestCase):
+    def setUp(self):
+        self.guest = create_user("guest@example.com")
+        self.host = create_user("host@example.com", role="host")
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.set([self.guest, self.host])
+        self.messages = [Message.objects.create(conversation=self.conversation, sender_id=self.host, recipient_id=self.guest, message_body=f"message {i}") for i in range(4)]
+        self.mark_read_url = reverse("conversation-message-mark-read", kwargs={"conversation_pk": self.conversation.conversation_id})
+        self.client.force_authenticate(user=self.guest)
+
+    def unread_badges(self):
+        return self.client.get(reverse("conversation-unread")).data
+
+    def test_counter_follows_new_messages(self):
+        self.assertEqual(UnreadCounter.objects.get(user_id=self.guest, conversation=self.conversation).unread_count, 4)
+        self.assertEqual(self.unread_badges(), {"total": 4, "conversations": {str(self.conversation.conversation_id): 4}})
+
+    def test_messages_sent_through_the_api(self):
+        url = reverse("conversation-message-list", kwargs={"conversation_pk": self.conversation.conversation_id})
+        response = self.client.post(url, {"message_body": "hello host"})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["recipient"]["email"], "host@example.com")
+        self.client.force_authenticate(user=self.host)
+        self.assertEqual(self.unread_badges()["total"], 1)
+
+        outsider = create_user("outsider@example.com")
+        self.assertEqual(self.client.post(url, {"message_body": "hi", "recipient_id": str(outsider.user_id)}).status_code, 400)
+        self.assertEqual(self.client.post(url, {"message_body": "hi", "recipient_id": str(self.guest.user_id)}).status_code, 201)
+        self.client.force_authenticate(user=self.guest)
+        self.assertEqual(self.unread_badges()["total"], 5)
+
+    def test_counter_follows_saved_read_at(self):
+        message = self.messages[0]
+        message.read_at = timezone.now()
+        message.save()
+        self.assertEqual(self.unread_badges()["total"], 3)
+        message.save()
+        self.assertEqual(self.unread_badges()["total"], 3)
+        message.read_at = None
+        message.save()
+        self.assertEqual(self.unread_badges()["total"], 4)
+
+    def test_mark_read_up_to_message(self):
+        response = self.client.post(self.mark_read_url, {"message_id": str(self.messages[1].message_id)})
+        self.assertEqual(response.data, {"marked": 2, "unread_count": 2})
+        self.assertEqual(Message.objects.filter(read_at__isnull=True).count(), 2)
+
+        response = self.client.post(self.mark_read_url)
+        self.assertEqual(response.data, {"marked": 2, "unread_count": 0})
+        self.assertEqual(self.unread_badges()["total"], 0)
+
+    def test_deleting_unread_message(self):
+        self.messages[0].delete()
+        self.assertEqual(self.unread_badges()["total"], 3)
+
+
+class ConversationWebSocketTests(APITestCase):
+    def setUp(self):
+        token_cache.clear()
+        self.guest = create_user("guest@example.com")
+        self.host = create_user("host@example.com", role="host")
+        self.outsider = create_user("outsider@example.com")
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.set([self.guest, self.host])
+        for user in [self.guest, self.outsider]:
+            UserToken.objects.create(user_id=user, token=f"ws-{user.pk}", token_expire_at=timezone.now() + timedelta(hours=1))
+
+    def connect(self, user=None, query="", subprotocols=None):
+        # Through the same token authentication the ASGI application uses
+        if user is not None:
+            query = f"?token=ws-{user.pk}"
+        return WebsocketCommunicator(websocket_application(), f"/ws/conversations/{self.conversation.conversation_id}/{query}", subprotocols=subprotocols)
+
+    def post_message(self, user, body):
+        url = reverse("conversation-message-list", kwargs={"conversation_pk": self.conversation.conversation_id})
+        self.client.force_authenticate(user=user)
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(url, {"message_body": body})
+
+    async def test_new_message_is_pushed_to_participants_who_may_read_it(self):
+        communicator = self.connect(self.guest)
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+
+        # Like the REST endpoint, a guest only sees the messages they sent
+        self.assertEqual((await sync_to_async(self.post_message)(self.host, "hidden")).status_code, 201)
+        response = await sync_to_async(self.post_message)(self.guest, "hello")
+        self.assertEqual(response.status_code, 201)
+
+        pushed = await communicator.receive_json_from()
+        self.assertEqual(pushed["message_id"], response.data["message_id"])
+        self.assertEqual(pushed["message_body"], "hello")
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+
+    async def test_admin_gets_every_message(self):
+        admin = await sync_to_async(create_user)("admin@example.com", role="admin")
+        await sync_to_async(self.conversation.participants.add)(admin)
+        await sync_to_async(UserToken.objects.create)(user_id=admin, token=f"ws-{admin.pk}", token_expire_at=timezone.now() + timedelta(hours=1))
+        communicator = self.connect(admin)
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+
+        response = await sync_to_async(self.post_message)(self.host, "hello")
+        self.assertEqual((await communicator.receive_json_from())["message_id"], response.data["message_id"])
+        await communicator.disconnect()
+
+    async def test_non_participant_is_rejected(self):
+        connected, code = await self.connect(self.outsider).connect()
+        self.assertFalse(connected)
+        self.assertEqual(code, 4403)
+
+    async def test_token_as_subprotocol(self):
+        communicator = self.connect(subprotocols=["bearer", f"ws-{self.guest.pk}"])
+        connected, subprotocol = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual(subprotocol, "bearer")
+        await communicator.disconnect()
+
+    async def test_missing_or_invalid_token_is_rejected(self):
+        for query in ["", "?token=unknown"]:
+            connected, code = await self.connect(query=query).connect()
+            self.assertFalse(connected)
+            self.assertEqual(code, 4403)
+
+
+class MessageBulkCreateTests(APITestCase):
+    def setUp(self):
+        self.guest = create_user("guest@example.com")
+        self.host = create_user("host@example.com", role="host")
+        self.outsider = create_user("outsider@example.com")
+        self.first = Conversation.objects.create()
+        self.first.participants.set([self.guest, self.host])
+        self.second = Conversation.objects.create()
+        self.second.participants.set([self.guest, self.outsider])
+        self.url = reverse("message-bulk-create")
+        self.client.force_authenticate(user=self.guest)
+
+    def test_json_import_reports_item_errors(self):
+        items = [
+            {"conversation": str(self.first.conversation_id), "recipient": str(self.host.user_id), "message_body": "one", "sent_at": "2024-12-20T10:00:00Z"},
+            {"conversation": str(self.second.conversation_id), "recipient": str(self.outsider.user_id), "message_body": "two"},
+            {"conversation": str(self.first.conversation_id), "recipient": str(self.outsider.user_id), "message_body": "not a participant"},
+            {"conversation": "nope", "message_body": ""},
+            {"conversation": str(self.first.conversation_id), "message_body": "out of range", "sent_at": "2024-13-45T00:00:00"},
+        ]
+        response = self.client.post(f"{self.url}?batch_size=1", items, format="json")
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["created"], 2)
+        self.assertEqual([e["index"] for e in response.data["errors"]], [2, 3, 4])
+        self.assertEqual(set(response.data["errors"][1]["errors"]), {"conversation", "message_body"})
+        self.assertEqual(set(response.data["errors"][2]["errors"]), {"sent_at"})
+        self.assertEqual(Message.objects.get(message_body="one").sent_at.year, 2024)
+        self.assertEqual(UnreadCounter.objects.get(user_id=self.host, conversation=self.first).unread_count, 1)
+
+    def test_ndjson_import(self):
+        lines = "\n".join(f'{{"conversation": "{self.first.conversation_id}", "message_body": "line {i}"}}' for i in range(3))
+        response = self.client.post(self.url, lines, content_type="application/x-ndjson")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Message.objects.filter(conversation=self.first, sender_id=self.guest).count(), 3)
+
+    def test_only_admins_may_set_sender(self):
+        items = [{"conversation": str(self.first.conversation_id), "sender": str(self.host.user_id), "message_body": "spoofed"}]
+        response = self.client.post(self.url, items, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("sender", response.data["errors"][0]["errors"])
+
+
+class ConversationExportTests(APITestCase):
+    def setUp(self):
+        self.guest = create_user("guest@example.com")
+        self.host = create_user("host@example.com", role="host")
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.set([self.guest, self.host])
+        for i in range(5):
+            Message.objects.create(conversation=self.conversation, sender_id=self.guest, recipient_id=self.host, message_body=f'line {i}, quoted "{i}"')
+        Message.objects.create(conversation=self.conversation, sender_id=self.host, recipient_id=self.guest, message_body="from the host")
+        self.url = reverse("conversation-export", kwargs={"pk": self.conversation.conversation_id})
+        self.client.force_authenticate(user=self.guest)
+
+    def read(self, response):
+        self.assertEqual(response.status_code, 200)
+        return b"".join(response.streaming_content).decode()
+
+    @override_settings(MESSAGES_EXPORT_CHUNK_SIZE=2)
+    def test_ndjson_export_in_chunks(self):
+        lines = self.read(self.client.get(self.url)).splitlines()
+        self.assertEqual([json.loads(line)["message_body"] for line in lines], [f'line {i}, quoted "{i}"' for i in range(5)])
+        self.assertEqual(json.loads(lines[0])["sender_email"], "guest@example.com")
+
+    def test_matches_the_message_endpoint(self):
+        # Not the other participant's messages, which the nested endpoint hides too
+        exported = [json.loads(line)["message_id"] for line in self.read(self.client.get(self.url)).splitlines()]
+        listed = self.client.get(reverse("conversation-message-list", kwargs={"conversation_pk": self.conversation.conversation_id})).data["results"]
+        self.assertEqual(sorted(exported), sorted(m["message_id"] for m in listed))
+        self.assertEqual(len(exported), 5)
+
+    def test_csv_export(self):
+        rows = list(csv.reader(io.StringIO(self.read(self.client.get(self.url, {"file_format": "csv"})))))
+        self.assertEqual(rows[0][:3], ["message_id", "sender_id", "sender_email"])
+        self.assertEqual([row[4] for row in rows[1:]], [f'line {i}, quoted "{i}"' for i in range(5)])
+
+    def test_unknown_format(self):
+        self.assertEqual(self.client.get(self.url, {"file_format": "xml"}).status_code, 400)
+
+
+class AuthorizationCacheTests(APITestCase):
+    def setUp(self):
+        local_cache.clear()
+        self.guest = create_user("guest@example.com")
+        self.host = create_user("host@example.com", role="host")
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.set([self.guest, self.host])
+        self.url = reverse("conversation-message-list", kwargs={"conversation_pk": self.conversation.conversation_id})
+        self.client.force_authenticate(user=self.guest)
+
+    def test_membership_is_cached(self):
+        # Membership, the hot page, then the archive as the hot page comes up short
+        with self.assertNumQueries(3):
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+        # The unchanged page is served from the response cache
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+        # Without it the membership answer still comes from the cache, only the page queries are left
+        response_cache().clear()
+        with self.assertNumQueries(2):
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+
+    def test_removing_participant_invalidates(self):
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.conversation.participants.remove(self.guest)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        self.guest.conversations.add(self.conversation)
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.conversation.participants.clear()
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_deleting_conversation_invalidates(self):
+        admin = create_user("admin@example.com", role="admin")
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.client.force_authenticate(user=admin)
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.conversation.delete()
+        for user in [self.guest, admin]:
+            self.client.force_authenticate(user=user)
+            self.assertEqual(self.client.post(self.url, {"message_body": "hi"}).status_code, 404)
+
+    def test_outsider_cannot_post(self):
+        self.client.force_authenticate(user=create_user("outsider@example.com"))
+        self.assertEqual(self.client.post(self.url, {"message_body": "hi"}).status_code, 404)
+        self.assertFalse(Message.objects.exists())
+
+    def test_ttl_cache_expiry_and_eviction(self):
+        now = [0]
+        cache = TTLCache(maxsize=2, ttl=10, timer=lambda: now[0])
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        now[0] = 11
+        self.assertIsNone(cache.get("a"))
+
+
+class ConditionalResponseTests(APITestCase):
+    def setUp(self):
+        local_cache.clear()
+        response_cache().clear()
+        self.guest = create_user("guest@example.com")
+        self.host = create_user("host@example.com", role="host")
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.set([self.guest, self.host])
+        self.messages_url = reverse("conversation-message-list", kwargs={"conversation_pk": self.conversation.conversation_id})
+        self.detail_url = reverse("conversation-detail", kwargs={"pk": self.conversation.conversation_id})
+        self.client.force_authenticate(user=self.guest)
+
+    def test_not_modified(self):
+        first = self.client.get(self.messages_url)
+        self.assertEqual(first.status_code, 200)
+        self.assertTrue(first["ETag"].startswith('W/"'))
+        self.assertIn("Authorization", first["Vary"])
+        # Only the cached membership check and version lookups remain
+        with self.assertNumQueries(0):
+            response = self.client.get(self.messages_url, HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], first["ETag"])
+
+    def test_write_changes_etag(self):
+        first = self.client.get(self.messages_url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.post(self.messages_url, {"message_body": "hi"}).status_code, 201)
+        response = self.client.get(self.messages_url, HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], first["ETag"])
+        self.assertEqual([m["message_body"] for m in response.data["results"]], ["hi"])
+
+    def test_etag_is_per_user(self):
+        first = self.client.get(self.detail_url)
+        self.client.force_authenticate(user=self.host)
+        response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(response.status_code, 200)
+        self.client.force_authenticate(user=create_user("outsider@example.com"))
+        self.assertEqual(self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=first["ETag"]).status_code, 404)
+
+    def test_inbox_follows_unread_counts(self):
+        list_url = reverse("conversation-list")
+        with self.captureOnCommitCallbacks(execute=True):
+            Message.objects.create(conversation=self.conversation, sender_id=self.host, recipient_id=self.guest, message_body="hello")
+        first = self.client.get(list_url)
+        self.assertEqual(first.data[0]["unread_count"], 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("conversation-message-mark-read", kwargs={"conversation_pk": self.conversation.conversation_id}))
+        response = self.client.get(list_url, HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data[0]["unread_count"], 0)
+
+    def test_views_must_name_their_versions(self):
+        class UnnamedView(VersionedResponseMixin, viewsets.GenericViewSet):
+            pass
+
+        with self.assertRaises(TypeError):
+            UnnamedView()
+
+
+class MessageSearchTests(APITestCase):
+    def setUp(self):
+        self.guest = create_user("guest@example.com")
+        self.host = create_user("host@example.com", role="host")
+        self.mine = Conversation.objects.create()
+        self.mine.participants.set([self.guest, self.host])
+        self.other = Conversation.objects.create()
+        self.other.participants.set([self.host])
+        self.url = reverse("message-search")
+        self.client.force_authenticate(user=self.guest)
+
+    def send(self, conversation, body, days_ago=0, sender=None):
+        return Message.objects.create(conversation=conversation, sender_id=sender or self.guest, message_body=body, sent_at=timezone.now() - timedelta(days=days_ago))
+
+    def search(self, q):
+        return [m["message_body"] for m in self.client.get(self.url, {"q": q}).data["results"]]
+
+    def test_search_is_scoped_and_ranked(self):
+        self.send(self.mine, "Check-in is at noon", days_ago=40)
+        self.send(self.mine, "Check-in check-in CHECK-IN at noon", days_ago=40)
+        self.send(self.mine, "Late check-in is fine", days_ago=1)
+        self.send(self.other, "check-in somewhere else", sender=self.host)
+
+        self.assertEqual(self.search("check-in"), ["Late check-in is fine", "Check-in check-in CHECK-IN at noon", "Check-in is at noon"])
+        self.assertEqual(self.search("noon check"), ["Check-in check-in CHECK-IN at noon", "Check-in is at noon"])
+        self.assertEqual(self.search("missing"), [])
+
+    def test_other_senders_messages_are_hidden(self):
+        self.send(self.mine, "secret host words", sender=self.host)
+        self.assertEqual(self.search("secret"), [])
+        self.client.force_authenticate(user=self.host)
+        self.assertEqual(self.search("secret"), ["secret host words"])
+
+    def test_index_follows_edits_and_deletes(self):
+        message = self.send(self.mine, "old words")
+        message.message_body = "new words"
+        message.save()
+        self.assertEqual(self.search("old"), [])
+        self.assertEqual(self.search("new"), ["new words"])
+
+        message.delete()
+        self.assertEqual(self.search("words"), [])
+        self.assertFalse(SearchToken.objects.exists())
+
+    def test_rebuild_command(self):
+        self.send(self.mine, "rebuilt message")
+        SearchToken.objects.all().delete()
+        call_command("rebuild_search_index", batch_size=1, stdout=io.StringIO())
+        self.assertEqual(self.search("rebuilt"), ["rebuilt message"])
+
+
+def create_property(host, city="Nairobi", price="100.00", country="Kenya", latitude="-1.2921", longitude="36.8219", name="Flat"):
+    location = Location.objects.create(latitude=Decimal(latitude), longitude=Decimal(longitude), city=city, country=country)
+    return Property.objects.create(host_id=host, location_id=location, price_per_night=Decimal(price), name=name)
+
+
+class PropertyAvailabilityTests(APITestCase):
+    def setUp(self):
+        self.host = create_user("host@example.com", role="host")
+        self.guest = create_user("guest@example.com")
+        self.cheap = create_property(self.host, price="50.00", name="cheap")
+        self.booked = create_property(self.host, price="80.00", name="booked")
+        self.pricey = create_property(self.host, price="300.00", name="pricey")
+        self.elsewhere = create_property(self.host, city="Mombasa", name="elsewhere")
+        self.booking = Booking.objects.create(property_id=self.booked, user_id=self.guest, start_date=date(2025, 3, 10), end_date=date(2025, 3, 12), total_price=Decimal("160.00"))
+        self.url = reverse("property-availability")
+        self.client.force_authenticate(user=self.guest)
+
+    def search(self, check_in, check_out, **params):
+        response = self.client.get(self.url, {"city": "Nairobi", "check_in": check_in, "check_out": check_out, **params})
+        self.assertEqual(response.status_code, 200)
+        return [p["name"] for p in response.data["results"]]
+
+    def test_overlapping_booking_excludes_property(self):
+        self.assertEqual(PropertyNight.objects.filter(booking_id=self.booking).count(), 2)
+        self.assertEqual(self.search("2025-03-11", "2025-03-15"), ["cheap", "pricey"])
+        # check-out day is free again
+        self.assertEqual(self.search("2025-03-12", "2025-03-15"), ["cheap", "booked", "pricey"])
+        self.assertEqual(self.search("2025-03-01", "2025-03-05", max_price="100"), ["cheap", "booked"])
+
+    def test_cancel_and_move_booking(self):
+        self.booking.start_date, self.booking.end_date = date(2025, 4, 1), date(2025, 4, 3)
+        self.booking.save()
+        self.assertEqual(self.search("2025-03-11", "2025-03-15"), ["cheap", "booked", "pricey"])
+        self.assertEqual(self.search("2025-04-02", "2025-04-05"), ["cheap", "pricey"])
+
+        self.booking.booking_status = "cancelled"
+        self.booking.save()
+        self.assertFalse(PropertyNight.objects.exists())
+
+    def test_cursor_pagination(self):
+        first = self.client.get(self.url, {"city": "Nairobi", "check_in": "2025-05-01", "check_out": "2025-05-02", "limit": 2}).data
+        self.assertEqual([p["name"] for p in first["results"]], ["cheap", "booked"])
+        second = self.client.get(first["next"]).data
+        self.assertEqual([p["name"] for p in second["results"]], ["pricey"])
+        self.assertIsNone(second["next"])
+
+    def test_invalid_range(self):
+        response = self.client.get(self.url, {"city": "Nairobi", "check_in": "2025-03-05", "check_out": "2025-03-01"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_non_finite_prices(self):
+        params = {"city": "Nairobi", "check_in": "2025-05-01", "check_out": "2025-05-02"}
+        for value in ("NaN", "Infinity", "sNaN"):
+            self.assertEqual(self.client.get(self.url, {**params, "max_price": value}).status_code, 400)
+            cursor = encode_cursor(value, self.cheap.property_id.hex)
+            self.assertEqual(self.client.get(self.url, {**params, "cursor": cursor}).status_code, 404)
+
+
+class PropertyNearbyTests(APITestCase):
+    def setUp(self):
+        self.host = create_user("host@example.com", role="host")
+        # Nairobi CBD, Westlands (~4 km), Karen (~13 km), Mombasa (~440 km)
+        create_property(self.host, name="cbd", latitude="-1.2864", longitude="36.8172")
+        create_property(self.host, name="westlands", latitude="-1.2676", longitude="36.8108")
+        create_property(self.host, name="karen", latitude="-1.3197", longitude="36.7076")
+        create_property(self.host, city="Mombasa", name="mombasa", latitude="-4.0435", longitude="39.6682")
+        self.url = reverse("property-nearby")
+        self.client.force_authenticate(user=self.host)
+
+    def nearby(self, **params):
+        response = self.client.get(self.url, {"latitude": "-1.2864", "longitude": "36.8172", **params})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_geohash_is_set(self):
+        self.assertEqual(Location.objects.get(city="Mombasa").geohash[:5], encode_geohash(-4.0435, 39.6682)[:5])
+        self.assertEqual(encode_geohash(57.64911, 10.40744, 11), "u4pruydqqvj")
+
+    def test_radius_and_order(self):
+        results = self.nearby(radius_km=5)["results"]
+        self.assertEqual([r["property"]["name"] for r in results], ["cbd", "westlands"])
+        self.assertAlmostEqual(results[1]["distance_km"], 2.2, delta=0.3)
+        self.assertEqual([r["property"]["name"] for r in self.nearby(radius_km=20)["results"]], ["cbd", "westlands", "karen"])
+
+    def test_cursor_pagination(self):
+        first = self.nearby(radius_km=20, limit=2)
+        second = self.client.get(first["next"]).data
+        self.assertEqual([r["property"]["name"] for r in second["results"]], ["karen"])
+        self.assertIsNone(second["next"])
+
+    def test_cursor_walks_ties_one_page_at_a_time(self):
+        # Same spot as cbd, so only the property id orders the three
+        create_property(self.host, name="cbd-2", latitude="-1.2864", longitude="36.8172")
+        create_property(self.host, name="cbd-3", latitude="-1.2864", longitude="36.8172")
+        names, page = [], self.nearby(radius_km=20, limit=1)
+        while True:
+            self.assertEqual(len(page["results"]), 1)
+            names.append(page["results"][0]["property"]["name"])
+            if page["next"] is None:
+                break
+            page = self.client.get(page["next"]).data
+        self.assertEqual(sorted(names[:3]), ["cbd", "cbd-2", "cbd-3"])
+        self.assertEqual(names[3:], ["westlands", "karen"])
+
+    def test_across_the_antimeridian(self):
+        # Either side of 180° in Fiji, about 4 km and 7 km from the search point
+        create_property(self.host, city="Taveuni", country="Fiji", name="west", latitude="-16.8000", longitude="179.9500")
+        create_property(self.host, city="Taveuni", country="Fiji", name="east", latitude="-16.8000", longitude="-179.9500")
+        results = self.nearby(latitude="-16.8000", longitude="179.9900", radius_km=10)["results"]
+        self.assertEqual([r["property"]["name"] for r in results], ["west", "east"])
+
+
+class BookingCreateTests(APITestCase):
+    def setUp(self):
+        self.host = create_user("host@example.com", role="host")
+        self.guest = create_user("guest@example.com")
+        self.property = create_property(self.host, price="100.00")
+        self.url = reverse("booking-list")
+        self.client.force_authenticate(user=self.guest)
+
+    def book(self, start, end, **extra):
+        return self.client.post(self.url, {"property_id": str(self.property.property_id), "start_date": start, "end_date": end, **extra})
+
+    def test_price_and_conflict(self):
+        response = self.book("2025-06-01", "2025-06-04")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["total_price"], "300.00")
+
+        self.assertEqual(self.book("2025-06-03", "2025-06-05").status_code, 409)
+        self.assertEqual(self.book("2025-06-04", "2025-06-05").status_code, 201)
+        self.assertEqual(Booking.objects.count(), 2)
+
+    def test_received_then_confirmed_notifications(self):
+        def event_types(callbacks):
+            return [callback.args[0] for callback in callbacks]
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.book("2025-06-01", "2025-06-04")
+        self.assertEqual(event_types(callbacks), ["booking_received"])
+
+        booking = Booking.objects.get(pk=response.data["booking_id"])
+        with self.captureOnCommitCallbacks() as callbacks:
+            booking.payment_status = "paid"
+            booking.save()
+        self.assertEqual(event_types(callbacks), [])
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            booking.booking_status = "confirmed"
+            booking.save()
+            booking.save()
+        self.assertEqual(event_types(callbacks), ["booking_confirmation"])
+
+    def test_coupon_discount(self):
+        now = timezone.now()
+        Coupon.objects.create(code="TENOFF", discount_type="percentage", discount_amount=Decimal("10"), max_no_uses=5, valid_from=now - timedelta(days=1), valid_to=now + timedelta(days=1))
+        response = self.book("2025-06-01", "2025-06-03", coupon_code="TENOFF")
+        self.assertEqual(response.data["total_price"], "180.00")
+        self.assertEqual(CouponUsage.objects.count(), 1)
+
+        response = self.book("2025-07-01", "2025-07-03", coupon_code="TENOFF")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("coupon_code", response.data)
+
+
+class BookingStressTests(TransactionTestCase):
+    """
+    Hundreds of concurrent booking requests race for overlapping stays on one property.
+    """
+
+    threads = 20
+    requests_per_thread = 15
+    # Far below what SQLite manages here, so only a serious regression trips it
+    min_requests_per_second = 10
+
+    @override_settings(BOOKING_RETRIES=30)
+    def test_no_overlapping_bookings_under_concurrency(self):
+        host = create_user("host@example.com", role="host")
+        guests = [create_user(f"guest{i}@example.com") for i in range(self.threads)]
+        prop = create_property(host)
+        first_night = date(2025, 8, 1)
+        statuses = Counter()
+        lock = threading.Lock()
+        retries_before = snapshot().get((booking_retries.name, ()), 0)
+
+        def worker(guest, seed):
+            rng = random.Random(seed)
+            client = APIClient()
+            client.force_authenticate(user=guest)
+            try:
+                for _ in range(self.requests_per_thread):
+                    start = first_night + timedelta(days=rng.randrange(60))
+                    data = {"property_id": str(prop.property_id), "start_date": start, "end_date": start + timedelta(days=rng.randint(1, 4))}
+                    status_code = client.post(reverse("booking-list"), data).status_code
+                    with lock:
+                        statuses[status_code] += 1
+            finally:
+                connection.close()
+
+        # The booking notifications race for the same locks; they are not under test
+        notification_logger = logging.getLogger("chats.notifications")
+        notification_logger.disabled = True
+        try:
+            workers = [threading.Thread(target=worker, args=(guest, i)) for i, guest in enumerate(guests)]
+            started = time.perf_counter()
+            for thread in workers:
+                thread.start()
+            for thread in workers:
+                thread.join()
+            elapsed = time.perf_counter() - started
+        finally:
+            shutdown_executor()
+            notification_logger.disabled = False
+
+        # SQLite reports lock contention as errors instead of waiting, so
+        # many requests only get through on a retry; none may give up.
+        self.assertEqual(sum(statuses.values()), self.threads * self.requests_per_thread)
+        self.assertEqual(set(statuses) - {201, 409}, set(), statuses)
+        self.assertGreater(statuses[201], 0)
+        retries = snapshot().get((booking_retries.name, ()), 0) - retries_before
+        self.assertGreater(retries, 0)
+
+        total = sum(statuses.values())
+        logger.info("%d booking requests over %d threads in %.2fs: %.1f requests/s, %d retries, %s", total, self.threads, elapsed, total / elapsed, retries, dict(statuses))
+        self.assertGreater(total / elapsed, self.min_requests_per_second)
+
+        taken = []
+        for booking in Booking.objects.filter(property_id=prop).exclude(booking_status="cancelled"):
+            taken.extend(nights_between(booking.start_date, booking.end_date))
+        self.assertEqual(len(taken), len(set(taken)), "two bookings share a night")
+        self.assertEqual(len(taken), PropertyNight.objects.filter(property_id=prop).count())
+        self.assertEqual(Booking.objects.filter(property_id=prop).count(), statuses[201])
+
+
+class CouponRedemptionTests(APITestCase):
+    def setUp(self):
+        coupon_cache.clear()
+        self.host = create_user("host@example.com", role="host")
+        self.guests = [create_user(f"guest{i}@example.com") for i in range(3)]
+        self.property = create_property(self.host)
+        self.url = reverse("coupon-redeem")
+        now = timezone.now()
+        self.coupon = Coupon.objects.create(
+            code="FLASH", discount_type="fixed_amount", discount_amount=Decimal("25"), max_no_uses=2, valid_from=now - timedelta(days=1), valid_to=now + timedelta(days=1)
+        )
+
+    def redeem(self, guest, code="FLASH", **extra):
+        self.client.force_authenticate(user=guest)
+        return self.client.post(self.url, {"code": code, **extra})
+
+    def test_uses_are_limited(self):
+        self.assertEqual(self.redeem(self.guests[0]).status_code, 201)
+        self.assertEqual(self.redeem(self.guests[0]).data["coupon_code"], ["Coupon has already been used."])
+        self.assertEqual(self.redeem(self.guests[1]).status_code, 201)
+        self.assertEqual(self.redeem(self.guests[2]).data["coupon_code"], ["Coupon has been used up."])
+
+        self.coupon.refresh_from_db()
+        self.assertEqual(self.coupon.uses_count, 2)
+        self.assertEqual(CouponUsage.objects.count(), 2)
+
+    def test_scope_and_validity(self):
+        other = create_property(self.host, name="Other")
+        Coupon.objects.filter(pk=self.coupon.pk).update(property_id=self.property)
+        coupon_cache.clear()
+        self.assertEqual(self.redeem(self.guests[0], property_id=str(other.property_id)).status_code, 400)
+        self.assertEqual(self.redeem(self.guests[0], property_id=str(self.property.property_id)).status_code, 201)
+
+        self.coupon.valid_to = timezone.now() - timedelta(minutes=1)
+        self.coupon.save()
+        self.assertEqual(self.redeem(self.guests[1], property_id=str(self.property.property_id)).data["coupon_code"], ["Coupon is not valid at this time."])
+        self.assertEqual(self.redeem(self.guests[1], code="NOPE").data["coupon_code"], ["Coupon does not exist."])
+
+    def test_codes_are_cached(self):
+        self.redeem(self.guests[0])
+        # Only the conditional UPDATE and the usage INSERT (plus savepoints) hit the database
+        with self.assertNumQueries(6):
+            self.redeem(self.guests[1])
+        # The first refusal remembers the code is used up, later ones skip the database
+        self.assertEqual(self.redeem(self.guests[2]).status_code, 400)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.redeem(self.guests[2]).data["coupon_code"], ["Coupon has been used up."])
+
+
+class CouponStressTests(TransactionTestCase):
+    """
+    A flash sale: many threads redeem one code with fewer uses than takers.
+    """
+
+    threads = 8
+    max_no_uses = 5
+
+    def test_no_oversell_under_concurrency(self):
+        coupon_cache.clear()
+        guests = [create_user(f"guest{i}@example.com") for i in range(self.threads)]
+        now = timezone.now()
+        coupon = Coupon.objects.create(
+            code="FLASH", discount_type="percentage", discount_amount=Decimal("50"), max_no_uses=self.max_no_uses, valid_from=now - timedelta(days=1), valid_to=now + timedelta(days=1)
+        )
+        outcomes = Counter()
+        lock = threading.Lock()
+
+        def worker(guest):
+            try:
+                try:
+                    redeem_coupon("FLASH", guest)
+                    outcome = "redeemed"
+                except exceptions.ValidationError:
+                    outcome = "refused"
+                except OperationalError:
+                    outcome = "gave_up"
+                with lock:
+                    outcomes[outcome] += 1
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=worker, args=(guest,)) for guest in guests]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+
+        coupon.refresh_from_db()
+        self.assertEqual(sum(outcomes.values()), self.threads)
+        self.assertLessEqual(outcomes["redeemed"], self.max_no_uses)
+        self.assertEqual(coupon.uses_count, outcomes["redeemed"])
+        self.assertEqual(CouponUsage.objects.filter(coupon_id=coupon).count(), outcomes["redeemed"])
+
+
+class PropertyRatingTests(APITestCase):
+    def setUp(self):
+        self.host = create_user("host@example.com", role="host")
+        self.guest = create_user("guest@example.com")
+        self.good = create_property(self.host, name="good")
+        self.poor = create_property(self.host, name="poor")
+        self.unrated = create_property(self.host, name="unrated")
+        self.client.force_authenticate(user=self.guest)
+
+    def review(self, prop, rating, reviewed_by="guest"):
+        return Review.objects.create(property_id=prop, user_id=self.guest, rating=rating, reviewed_by=reviewed_by)
+
+    def totals(self, prop, reviewed_by="guest"):
+        return PropertyRating.objects.get(property_id=prop, reviewed_by=reviewed_by)
+
+    def test_totals_follow_reviews(self):
+        first = self.review(self.good, 5)
+        self.review(self.good, 4)
+        self.review(self.good, 1, reviewed_by="host")
+        totals = self.totals(self.good)
+        self.assertEqual((totals.review_count, totals.rating_sum, totals.stars_4, totals.stars_5), (2, 9, 1, 1))
+        self.assertEqual(totals.average_rating, Decimal("4.50"))
+        self.assertEqual(self.totals(self.good, "host").review_count, 1)
+
+        first.rating = 3
+        first.save()
+        totals = self.totals(self.good)
+        self.assertEqual((totals.rating_sum, totals.stars_3, totals.stars_5, totals.average_rating), (7, 1, 0, Decimal("3.50")))
+
+        first.deleted_at = timezone.now()
+        first.save()
+        self.assertEqual(self.totals(self.good).average_rating, Decimal("4.00"))
+
+        Review.objects.get(rating=4).delete()
+        self.assertEqual(self.totals(self.good).review_count, 0)
+
+    def test_listing_sorted_by_rating(self):
+        self.review(self.good, 5)
+        self.review(self.poor, 2)
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse("property-list"), {"ordering": "rating"})
+        self.assertEqual([p["name"] for p in response.data["results"]], ["good", "poor", "unrated"])
+        self.assertEqual(response.data["results"][0]["average_rating"], "5.00")
+
+    def test_reconcile_command(self):
+        self.review(self.good, 5)
+        self.review(self.good, 3)
+        PropertyRating.objects.update(review_count=99, rating_sum=0)
+        call_command("reconcile_property_ratings", batch_size=1, stdout=io.StringIO())
+        totals = self.totals(self.good)
+        self.assertEqual((totals.review_count, totals.rating_sum, totals.average_rating), (2, 8, Decimal("4.00")))
+
+
+class NotificationTests(APITestCase):
+    def setUp(self):
+        self.admin = create_user("admin@example.com", role="admin")
+        self.guests = [create_user(f"guest{i}@example.com") for i in range(5)]
+        self.url = reverse("notification-list")
+
+    def test_fan_out_in_chunks(self):
+        # One SELECT and one INSERT (inside a savepoint) per chunk of two, then the empty SELECT
+        with self.assertNumQueries(3 * 4 + 1):
+            written = fan_out("general_alert", "Maintenance tonight", audience(role="guest"), expires_in=3600, chunk_size=2)
+        self.assertEqual(written, 5)
+        self.assertEqual(Notification.objects.filter(user_id__role="guest", expiration_time__isnull=False).count(), 5)
+        self.assertFalse(Notification.objects.filter(user_id=self.admin).exists())
+
+    def test_unread_listing_and_mark_read(self):
+        guest = self.guests[0]
+        fan_out("payment_update", "Paid", [guest.user_id])
+        fan_out("general_alert", "Hello", [guest.user_id])
+        Notification.objects.create(user_id=guest, event_type="general_alert", message="Old", expiration_time=timezone.now() - timedelta(minutes=1))
+        self.client.force_authenticate(user=guest)
+
+        self.assertEqual(len(self.client.get(self.url, {"is_read": "false"}).data["results"]), 2)
+        self.assertEqual(self.client.post(reverse("notification-mark-read")).data["marked"], 2)
+        self.assertEqual(len(self.client.get(self.url, {"is_read": "false"}).data["results"]), 0)
+        self.assertEqual(len(self.client.get(self.url).data["results"]), 2)
+
+    def test_mark_read_validates_ids(self):
+        url = reverse("notification-mark-read")
+        self.client.force_authenticate(user=self.guests[0])
+        self.assertEqual(self.client.post(url, {"notification_ids": ["not-a-uuid"]}, format="json").status_code, 400)
+        self.assertEqual(self.client.post(url, {"notification_ids": 5}, format="json").status_code, 400)
+        fan_out("general_alert", "Hello", [self.guests[0].user_id])
+        notification = Notification.objects.get(user_id=self.guests[0])
+        self.assertEqual(self.client.post(url, {"notification_ids": [str(notification.pk)]}, format="json").data["marked"], 1)
+
+    def test_broadcast_is_admin_only(self):
+        url = reverse("notification-broadcast")
+        self.client.force_authenticate(user=self.guests[0])
+        self.assertEqual(self.client.post(url, {"message": "Hi"}).status_code, 403)
+        self.client.force_authenticate(user=self.admin)
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertEqual(self.client.post(url, {"message": "Hi", "role": "guest"}).status_code, 202)
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(self.client.post(url, {"message": "Hi", "expires_in": 10**12}).status_code, 400)
+
+    def test_sweeper(self):
+        past = timezone.now() - timedelta(minutes=1)
+        for guest in self.guests:
+            Notification.objects.create(user_id=guest, event_type="general_alert", message="Expired", expiration_time=past)
+        fan_out("general_alert", "Current", [self.guests[0].user_id], expires_in=3600)
+
+        call_command("sweep_notifications", archive=True, batch_size=2, stdout=io.StringIO())
+        self.assertEqual(Notification.objects.with_deleted().filter(deleted_at__isnull=False).count(), 5)
+        call_command("sweep_notifications", batch_size=2, stdout=io.StringIO())
+        self.assertEqual(list(Notification.objects.with_deleted().values_list("message", flat=True)), ["Current"])
+
+
+class NotificationWorkerTests(TransactionTestCase):
+    @override_settings(NOTIFICATION_FANOUT_CHUNK_SIZE=3)
+    def test_worker_pool_writes_committed_audience(self):
+        # One fan-out at a time: in-memory SQLite fails concurrent writers instead of waiting
+        guests = [create_user(f"guest{i}@example.com") for i in range(7)]
+        self.assertEqual(submit_fan_out("general_alert", "Alert", audience(role="guest")).result(timeout=10), 7)
+        self.assertEqual(Notification.objects.filter(user_id__in=guests).count(), 7)
+
+
+class SoftDeleteTests(APITestCase):
+    def setUp(self):
+        self.host = create_user("host@example.com", role="host")
+        self.guest = create_user("guest@example.com")
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.set([self.host, self.guest])
+        self.messages = [Message.objects.create(conversation=self.conversation, sender_id=self.guest, recipient_id=self.host, message_body=f"hello {i}") for i in range(3)]
+
+    def test_deleted_message_is_hidden_and_uncounted(self):
+        url = reverse("conversation-message-detail", kwargs={"conversation_pk": self.conversation.conversation_id, "pk": self.messages[0].message_id})
+        self.client.force_authenticate(user=self.guest)
+        self.assertEqual(self.client.delete(url).status_code, 204)
+
+        self.assertEqual(Message.objects.count(), 2)
+        self.assertIsNotNone(Message.objects.with_deleted().get(pk=self.messages[0].pk).deleted_at)
+        self.assertEqual(UnreadCounter.objects.get(user_id=self.host).unread_count, 2)
+        self.assertFalse(SearchToken.objects.filter(message=self.messages[0]).exists())
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_bulk_soft_delete_keeps_ratings(self):
+        prop = create_property(self.host)
+        reviews = [Review.objects.create(property_id=prop, user_id=self.guest, rating=rating) for rating in (5, 3, 1)]
+        self.assertEqual(Review.objects.filter(pk__in=[reviews[1].pk, reviews[2].pk]).soft_delete(), 2)
+        self.assertEqual(Review.objects.filter(property_id=prop).soft_delete(), 1)
+        self.assertFalse(PropertyRating.objects.filter(property_id=prop).exists())
+        self.assertEqual(Review.objects.with_deleted().count(), 3)
+
+    def test_purge_only_old_tombstones(self):
+        Message.objects.filter(pk=self.messages[0].pk).soft_delete(now=timezone.now() - timedelta(days=40))
+        self.messages[1].soft_delete()
+
+        call_command("purge_soft_deleted", days=30, batch_size=1, stdout=io.StringIO())
+        self.assertEqual(set(Message.objects.with_deleted().values_list("pk", flat=True)), {self.messages[1].pk, self.messages[2].pk})
+        # The unread counter was already adjusted when the message was soft-deleted
+        self.assertEqual(UnreadCounter.objects.get(user_id=self.host).unread_count, 1)
+
+    def test_purge_keeps_parents_with_live_dependents(self):
+        old = timezone.now() - timedelta(days=40)
+        prop = create_property(self.host)
+        booking = Booking.objects.create(property_id=prop, user_id=self.guest, start_date=date(2025, 6, 1), end_date=date(2025, 6, 3), total_price=Decimal("200.00"))
+        User.objects.filter(pk=self.guest.pk).soft_delete(now=old)
+
+        # Not purged by default, and kept when named while its booking is live
+        call_command("purge_soft_deleted", stdout=io.StringIO())
+        call_command("purge_soft_deleted", models=["User"], stdout=io.StringIO())
+        self.assertTrue(User.objects.with_deleted().filter(pk=self.guest.pk).exists())
+        self.assertTrue(Booking.objects.filter(pk=booking.pk).exists())
+        self.assertEqual(Message.objects.filter(sender_id=self.guest).count(), 3)
+
+        # A deleted booking still holding a live payment keeps the user too
+        payment = Payment.objects.create(booking_id=booking, amount=Decimal("200.00"), pay_method_id=PaymentMethod.objects.create(name="card"), transaction_id="t-1")
+        Booking.objects.filter(pk=booking.pk).soft_delete(now=old)
+        call_command("purge_soft_deleted", models=["User"], stdout=io.StringIO())
+        self.assertTrue(Payment.objects.filter(pk=payment.pk).exists())
+
+        payment.soft_delete()
+        call_command("purge_soft_deleted", models=["User"], stdout=io.StringIO())
+        self.assertFalse(User.objects.with_deleted().filter(pk=self.guest.pk).exists())
+
+    def test_deleted_users_email_stays_taken(self):
+        self.guest.soft_delete()
+        self.client.force_authenticate(user=self.host)
+        data = {"role": "guest", "first_name": "New", "last_name": "User", "email": "guest@example.com", "password_hash": "an0ther-pass", "phone_number": "0700000000"}
+        response = self.client.post(reverse("user-list"), data)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("email", response.data)
+
+
+class MessageArchiveTests(APITestCase):
+    def setUp(self):
+        self.admin = create_user("admin@example.com", role="admin")
+        self.guest = create_user("guest@example.com")
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.set([self.admin, self.guest])
+        now = timezone.now()
+        # Six messages a year old, four from today
+        self.messages = [
+            Message.objects.create(
+                conversation=self.conversation, sender_id=self.guest, recipient_id=self.admin, message_body=f"message {i}", sent_at=now - timedelta(days=400 - i if i < 6 else 0, minutes=10 - i)
+            )
+            for i in range(10)
+        ]
+        self.url = reverse("conversation-message-list", kwargs={"conversation_pk": self.conversation.conversation_id})
+        self.client.force_authenticate(user=self.admin)
+
+    def expected_order(self):
+        return [str(m.message_id) for m in sorted(self.messages, key=lambda m: (m.sent_at, m.message_id), reverse=True)]
+
+    def test_archives_in_resumable_batches(self):
+        call_command("archive_messages", batch_size=4, max_batches=1, stdout=io.StringIO())
+        self.assertEqual((Message.objects.count(), ArchivedMessage.objects.count()), (6, 4))
+        call_command("archive_messages", batch_size=4, stdout=io.StringIO())
+        self.assertEqual((Message.objects.count(), ArchivedMessage.objects.count()), (4, 6))
+        self.assertEqual(UnreadCounter.objects.get(user_id=self.admin).unread_count, 4)
+
+    def test_pagination_falls_back_to_archive(self):
+        call_command("archive_messages", stdout=io.StringIO())
+        seen = []
+        url, params = self.url, {"page_size": 3}
+        while url:
+            response = self.client.get(url, params)
+            seen.extend(m["message_id"] for m in response.data["results"])
+            last = response
+            url, params = response.data["next"], None
+        self.assertEqual(seen, self.expected_order())
+
+        # Walking forward from the archive crosses back into the hot table
+        response = self.client.get(last.data["previous"])
+        self.assertEqual([m["message_id"] for m in response.data["results"]], self.expected_order()[6:9])
+        response = self.client.get(response.data["previous"])
+        self.assertEqual([m["message_id"] for m in response.data["results"]], self.expected_order()[3:6])
+
+    def test_latest_page_skips_archive(self):
+        call_command("archive_messages", stdout=io.StringIO())
+        # The conversation check, then the hot page; the archive is not queried
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url, {"page_size": 3})
+        self.assertEqual(len(response.data["results"]), 3)
+
+    def test_export_includes_archive(self):
+        call_command("archive_messages", stdout=io.StringIO())
+        response = self.client.get(reverse("conversation-export", kwargs={"pk": self.conversation.conversation_id}), {"file_format": "ndjson"})
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row["message_id"] for row in rows], list(reversed(self.expected_order())))
+
+
+@override_settings(DATABASE_REPLICAS=["replica"])
+class ReplicaRoutingTests(APITransactionTestCase):
+    """
+    A second connection to the test database stands in for the replica, and
+    a SQLite file in a missing directory for one that is down.
+    """
+
+    def setUp(self):
+        pool.health.clear()
+        pin_cache.clear()
+        connections.settings["replica"] = {**connections["default"].settings_dict}
+        connections.settings["broken"] = {**connections["default"].settings_dict, "ENGINE": "django.db.backends.sqlite3", "NAME": "/nonexistent/replica.sqlite3"}
+        self.user = create_user("guest@example.com")
+        # Not behind the response cache, whose misses always read the primary
+        self.url = reverse("user-list")
+        self.client.force_authenticate(user=self.user)
+
+    def tearDown(self):
+        for alias in ("replica", "broken"):
+            connections[alias].close()
+            del connections[alias]
+            del connections.settings[alias]
+
+    def get_queries(self, url=None):
+        with CaptureQueriesContext(connections["default"]) as primary, CaptureQueriesContext(connections["replica"]) as replica:
+            self.assertEqual(self.client.get(url or self.url).status_code, 200)
+        return len(primary), len(replica)
+
+    def test_reads_go_to_replica(self):
+        primary, replica = self.get_queries()
+        self.assertEqual(primary, 0)
+        self.assertGreater(replica, 0)
+
+    def test_read_your_writes(self):
+        self.assertEqual(self.client.post(reverse("conversation-list"), {}).status_code, 201)
+        primary, replica = self.get_queries()
+        self.assertGreater(primary, 0)
+        self.assertEqual(replica, 0)
+        self.assertEqual(len(self.client.get(reverse("conversation-list")).data), 1)
+
+        pin_cache.clear()
+        self.assertEqual(self.get_queries()[0], 0)
+
+    def test_any_write_pins(self):
+        # An action outside the replica-routed viewsets
+        self.assertEqual(self.client.post(reverse("notification-mark-read")).status_code, 200)
+        self.assertEqual(self.get_queries()[1], 0)
+
+        pin_cache.clear()
+        self.client.get(reverse("notification-list"))
+        self.assertEqual(self.get_queries()[0], 0)
+
+    def test_response_cache_miss_reads_primary(self):
+        # Past the replica health check
+        self.get_queries()
+        response_cache().clear()
+        primary, replica = self.get_queries(reverse("conversation-list"))
+        self.assertGreater(primary, 0)
+        self.assertEqual(replica, 0)
+
+    @override_settings(DATABASE_REPLICAS=["broken", "replica"])
+    def test_unhealthy_replica_is_skipped(self):
+        for _ in range(3):
+            self.assertEqual(self.get_queries()[0], 0)
+        self.assertFalse(pool.health.get("broken"))
+
+    @override_settings(DATABASE_REPLICAS=["broken"])
+    def test_falls_back_to_primary(self):
+        primary, replica = self.get_queries()
+        self.assertGreater(primary, 0)
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 0
+        self.opened = []
+
+    def connect(self):
+        connection = sqlite3.connect(":memory:", check_same_thread=False)
+        self.opened.append(connection)
+        return connection
+
+    def make_pool(self, **options):
+        return ConnectionPool(self.connect, ping=lambda connection: connection.execute("SELECT 1"), timer=lambda: self.now, **options)
+
+    def test_reuses_released_connections(self):
+        pool = self.make_pool(size=2)
+        first = pool.acquire()
+        pool.release(first)
+        self.assertIs(pool.acquire(), first)
+        self.assertEqual(len(self.opened), 1)
+
+    def test_limits_connections_per_worker(self):
+        pool = self.make_pool(max_connections=2, timeout=0.01)
+        held = [pool.acquire(), pool.acquire()]
+        with self.assertRaises(PoolExhausted):
+            pool.acquire()
+        pool.release(held.pop())
+        self.assertIsNotNone(pool.acquire())
+
+    def test_keeps_at_most_size_idle(self):
+        pool = self.make_pool(size=1)
+        first, second = pool.acquire(), pool.acquire()
+        pool.release(first)
+        pool.release(second)
+        self.assertEqual(list(pool.idle), [first])
+        with self.assertRaises(sqlite3.ProgrammingError):
+            second.execute("SELECT 1")
+
+    def test_replaces_dead_and_old_connections(self):
+        pool = self.make_pool(recycle=60)
+        dead = pool.acquire()
+        pool.release(dead)
+        dead.close()
+        fresh = pool.acquire()
+        self.assertIsNot(fresh, dead)
+
+        pool.release(fresh)
+        self.now = 61
+        self.assertIsNot(pool.acquire(), fresh)
+        self.assertEqual(len(self.opened), 3)
+
+
+class BenchmarkCommandTests(APITestCase):
+    def run_benchmark(self):
+        # Latency on a shared test machine is noise; only the other budgets apply here
+        with tempfile.NamedTemporaryFile("w", suffix=".json") as budgets:
+            json.dump({name: {"p95_ms": None} for name in DEFAULT_BUDGETS}, budgets)
+            budgets.flush()
+            stdout = io.StringIO()
+            call_command("benchmark_api", users=5, conversations=3, participants=3, messages=4, iterations=3, warmup=1, budgets=budgets.name, stdout=stdout)
+        return json.loads(stdout.getvalue())
+
+    def test_reports_every_endpoint_and_rolls_back(self):
+        report = self.run_benchmark()
+        self.assertEqual(report["dataset"], {"users": 5, "conversations": 3, "participants": 3, "messages": 12})
+        self.assertEqual(set(report["endpoints"]), {"users-list", "users-detail", "conversations-list", "conversations-detail", "messages-list"})
+        for result in report["endpoints"].values():
+            self.assertEqual(result["status"], [200])
+            self.assertLessEqual(result["p50_ms"], result["p95_ms"])
+            self.assertGreater(result["bytes"], 0)
+        self.assertEqual(report["failures"], [])
+        self.assertFalse(User.objects.exists())
+
+    def test_fails_over_budget(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".json") as budgets, tempfile.NamedTemporaryFile(suffix=".json") as output:
+            json.dump({"conversations-list": {"queries": 1, "p95_ms": None}}, budgets)
+            budgets.flush()
+            with self.assertRaisesMessage(CommandError, "conversations-list: queries 2 > 1"):
+                call_command("benchmark_api", users=3, conversations=1, messages=1, iterations=1, budgets=budgets.name, output=output.name, stdout=io.StringIO())
+            with open(output.name) as fh:
+                report = json.load(fh)
+        self.assertEqual(report["budgets"]["conversations-list"], {"queries": 1, "p95_ms": None})
+
+
+class ProfilingMiddlewareTests(APITestCase):
+    def setUp(self):
+        self.guest = create_user("guest@example.com")
+        self.url = reverse("user-detail", kwargs={"pk": self.guest.user_id})
+        self.client.force_authenticate(user=self.guest)
+
+    def test_removed_when_not_configured(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            ProfilingMiddleware(lambda request: None)
+        self.assertNotIn("Server-Timing", self.client.get(self.url))
+
+    @override_settings(PROFILE_REQUESTS=True)
+    def test_server_timing(self):
+        timing = self.client.get(self.url)["Server-Timing"]
+        self.assertRegex(timing, r'db;dur=[0-9.]+;desc="1 queries, 0 duplicate"')
+        self.assertRegex(timing, r"serialize;dur=[0-9.]+")
+        self.assertIn("mem;", timing)
+
+    @override_settings(PROFILE_HEADER="X-Profile")
+    def test_header_opt_in(self):
+        self.client.force_authenticate(user=self.guest, token="guest-token")
+        self.assertNotIn("Server-Timing", self.client.get(self.url))
+        self.assertIn("Server-Timing", self.client.get(self.url, HTTP_X_PROFILE="1"))
+
+    @override_settings(PROFILE_HEADER="X-Profile")
+    def test_header_ignored_for_other_clients(self):
+        # A guest logged in with a password, not a bearer token
+        self.assertNotIn("Server-Timing", self.client.get(self.url, HTTP_X_PROFILE="1"))
+        self.client.force_authenticate(user=create_user("admin@example.com", role="admin"))
+        self.assertIn("Server-Timing", self.client.get(self.url, HTTP_X_PROFILE="1"))
+        with override_settings(DEBUG=True):
+            self.client.force_authenticate(user=None)
+            self.assertIn("Server-Timing", self.client.get(reverse("property-list"), HTTP_X_PROFILE="1"))
+
+    @override_settings(PROFILE_REQUESTS=True)
+    def test_memory_traced_by_one_request_at_a_time(self):
+        with _memory_lock:
+            timing = self.client.get(self.url)["Server-Timing"]
+        self.assertNotIn("mem;", timing)
+        self.assertIn("mem;", self.client.get(self.url)["Server-Timing"])
+        self.assertFalse(tracemalloc.is_tracing())
+
+    @override_settings(PROFILE_SAMPLE_RATE=1.0)
+    def test_sampled_requests_are_logged_not_exposed(self):
+        with self.assertLogs("chats.profiling", "INFO") as logs:
+            response = self.client.get(self.url)
+        self.assertNotIn("Server-Timing", response)
+        record = json.loads(logs.records[0].getMessage().split(" ", 1)[1])
+        self.assertEqual((record["path"], record["status"], record["queries"]), (self.url, 200, 1))
+
+    def test_duplicate_queries(self):
+        profile = Profile()
+        for params in [(1,), (1,), (2,)]:
+            profile(lambda *args: None, "SELECT %s", params, False, {})
+        self.assertEqual(profile.duplicates(), {"SELECT %s": 2})
+        self.assertEqual(profile.similar(), {"SELECT %s": 3})
+
+
+@override_settings(METRICS_TOKEN="secret")
+class MetricsTests(APITestCase):
+    def setUp(self):
+        self.guest = create_user("guest@example.com")
+        self.host = create_user("host@example.com", role="host")
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.set([self.guest, self.host])
+        self.client.force_authenticate(user=self.guest)
+
+    def sample(self, series):
+        text = self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer secret").content.decode()
+        for line in text.splitlines():
+            if line.startswith(series + " "):
+                return float(line.rsplit(" ", 1)[1])
+        return 0
+
+    def test_counts_requests_per_route(self):
+        series = 'chats_http_requests_total{route="user-detail",method="GET",status="200"}'
+        before = self.sample(series)
+        self.client.get(reverse("user-detail", kwargs={"pk": self.guest.user_id}))
+        self.client.get(reverse("user-detail", kwargs={"pk": self.guest.user_id}))
+        self.assertEqual(self.sample(series), before + 2)
+        count = self.sample('chats_http_request_duration_seconds_count{route="user-detail",method="GET"}')
+        self.assertEqual(self.sample('chats_http_request_duration_seconds_bucket{route="user-detail",method="GET",le="+Inf"}'), count)
+        self.assertGreater(self.sample('chats_db_query_duration_seconds_count{alias="default"}'), 0)
+
+    def test_counts_messages_and_cache_hits(self):
+        url = reverse("conversation-message-list", kwargs={"conversation_pk": self.conversation.conversation_id})
+        created = self.sample("chats_messages_created_total")
+        hits = self.sample('chats_cache_requests_total{cache="authorization",result="hit"}')
+        self.client.post(url, {"message_body": "hi"})
+        self.client.post(url, {"message_body": "again"})
+        self.assertEqual(self.sample("chats_messages_created_total"), created + 2)
+        self.assertGreater(self.sample('chats_cache_requests_total{cache="authorization",result="hit"}'), hits)
+
+    def test_adds_up_other_workers(self):
+        series = 'chats_http_requests_total{route="user-list",method="GET",status="200"}'
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            before = self.sample(series)
+            with open(f"{directory}/other-worker.json", "w") as fh:
+                json.dump([["chats_http_requests_total", ["user-list", "GET", "200"], 5]], fh)
+            flush()
+            self.assertEqual(self.sample(series), before + 5)
+
+    def test_token(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 401)
+        self.assertEqual(self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer secret").status_code, 200)
+
+    @override_settings(METRICS_TOKEN=None)
+    def test_closed_without_token_unless_debug(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 403)
+        with override_settings(DEBUG=True):
+            self.assertEqual(self.client.get("/metrics").status_code, 200)
+
+    def test_exited_threads_are_folded_in(self):
+        before = snapshot().get((messages_created.name, ()), 0)
+        threads = [threading.Thread(target=messages_created.inc) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+            thread.join()
+        self.assertEqual(snapshot()[(messages_created.name, ())], before + 5)
+        self.assertFalse(any(thread_ref() in threads for thread_ref, _ in _shards))
+
+
+@override_settings(PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher", "django.contrib.auth.hashers.UnsaltedMD5PasswordHasher"])
+class PasswordAuthenticationTests(APITestCase):
+    def setUp(self):
+        credential_cache.clear()
+        self.guest = create_user("guest@example.com")
+        self.guest.set_password("s3cret-pass")
+        self.guest.save()
+        self.url = reverse("user-detail", kwargs={"pk": self.guest.user_id})
+
+    def basic(self, password, email="guest@example.com"):
+        return "Basic " + base64.b64encode(f"{email}:{password}".encode()).decode()
+
+    def test_create_hashes_without_printing(self):
+        self.client.force_authenticate(user=create_user("admin@example.com", role="admin"))
+        data = {"role": "guest", "first_name": "New", "last_name": "User", "email": "new@example.com", "password_hash": "an0ther-pass", "phone_number": "0700000000"}
+        with contextlib.redirect_stdout(io.StringIO()) as stdout:
+            self.assertEqual(self.client.post(reverse("user-list"), data).status_code, 201)
+        self.assertEqual(stdout.getvalue(), "")
+        self.assertTrue(User.objects.get(email="new@example.com").check_password("an0ther-pass"))
+
+    def test_repeat_logins_are_cached_until_the_password_changes(self):
+        self.assertEqual(self.client.get(self.url, HTTP_AUTHORIZATION=self.basic("s3cret-pass")).status_code, 200)
+        hits = credential_cache.hits
+        self.assertEqual(self.client.get(self.url, HTTP_AUTHORIZATION=self.basic("s3cret-pass")).status_code, 200)
+        self.assertEqual(credential_cache.hits, hits + 1)
+
+        self.guest.set_password("new-pass")
+        self.guest.save()
+        self.assertEqual(self.client.get(self.url, HTTP_AUTHORIZATION=self.basic("s3cret-pass")).status_code, 401)
+        self.assertEqual(self.client.get(self.url, HTTP_AUTHORIZATION=self.basic("new-pass")).status_code, 200)
+
+    def test_failures_are_not_cached(self):
+        self.assertEqual(self.client.get(self.url, HTTP_AUTHORIZATION=self.basic("wrong")).status_code, 401)
+        self.assertEqual(self.client.get(self.url, HTTP_AUTHORIZATION=self.basic("s3cret-pass", "nobody@example.com")).status_code, 401)
+        self.assertEqual(len(credential_cache), 0)
+
+    def test_outdated_hash_is_upgraded_on_login(self):
+        User.objects.filter(pk=self.guest.pk).update(password=make_password("s3cret-pass", hasher="unsalted_md5"))
+        self.assertEqual(self.client.get(self.url, HTTP_AUTHORIZATION=self.basic("s3cret-pass")).status_code, 200)
+        self.guest.refresh_from_db()
+        self.assertTrue(self.guest.password.startswith("md5$"))
+
+
+class TokenAuthenticationTests(APITestCase):
+    def setUp(self):
+        token_cache.clear()
+        self.guest = create_user("guest@example.com")
+        self.expires = timezone.now() + timedelta(hours=1)
+        self.token = UserToken.objects.create(user_id=self.guest, token="valid-token", token_expire_at=self.expires)
+        self.url = reverse("user-detail", kwargs={"pk": self.guest.user_id})
+
+    def get(self, token):
+        return self.client.get(self.url, HTTP_AUTHORIZATION=f"Bearer {token}")
+
+    def test_valid_token_is_cached(self):
+        self.assertEqual(self.get("valid-token").status_code, 200)
+        # Only the user-detail query is left
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get("valid-token").status_code, 200)
+
+    def test_invalid_token_is_cached_until_created(self):
+        self.assertEqual(self.get("new-token").status_code, 401)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get("new-token").status_code, 401)
+        UserToken.objects.create(user_id=self.guest, token="new-token", token_expire_at=self.expires)
+        self.assertEqual(self.get("new-token").status_code, 200)
+
+    def test_revocation_invalidates(self):
+        self.assertEqual(self.get("valid-token").status_code, 200)
+        self.assertEqual(revoke_tokens(UserToken.objects.filter(user_id=self.guest)), 1)
+        self.assertEqual(self.get("valid-token").status_code, 401)
+
+        UserToken.objects.create(user_id=self.guest, token="other-token", token_expire_at=self.expires)
+        self.assertEqual(self.get("other-token").status_code, 200)
+        UserToken.objects.filter(token="other-token").soft_delete()
+        self.assertEqual(self.get("other-token").status_code, 401)
+
+    def test_cache_never_outlives_expiry_or_user(self):
+        self.assertIsNotNone(get_token_user("valid-token"))
+        self.assertIsNone(get_token_user("valid-token", now=self.expires + timedelta(seconds=1)))
+        self.assertEqual(get_token_user("valid-token").role, "guest")
+        self.guest.role = "host"
+        self.guest.save()
+        self.assertEqual(get_token_user("valid-token").role, "host")
+        self.guest.soft_delete()
+        self.assertIsNone(get_token_user("valid-token"))
+
+    def test_purge_expired_tokens(self):
+        UserToken.objects.create(user_id=self.guest, token="old-token", token_expire_at=timezone.now() - timedelta(days=1))
+        call_command("purge_expired_tokens", batch_size=1, stdout=io.StringIO())
+        self.assertEqual(list(UserToken.objects.with_deleted().values_list("token", flat=True)), ["valid-token"])
@@ -0,0 +1,73 @@
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import Message, UnreadCounter
+from .versions import changed
+
+
+def increment_unread(user_id, conversation_id, amount=1):
+    """
+    Atomically add ``amount`` to a user's unread counter for a conversation,
+    creating the counter row the first time it is needed.
+    """
+    counters = UnreadCounter.objects.filter(user_id=user_id, conversation_id=conversation_id)
+    with transaction.atomic():
+        if not counters.update(unread_count=F("unread_count") + amount):
+            _, created = UnreadCounter.objects.get_or_create(user_id_id=user_id, conversation_id=conversation_id, defaults={"unread_count": amount})
+            if not created:
+                counters.update(unread_count=F("unread_count") + amount)
+
+
+def bulk_increment_unread(amounts):
+    """
+    Apply many increments at once; ``amounts`` maps ``(user_id, conversation_id)`` to a count.
+    Missing counter rows are created in a single INSERT first.
+    """
+    with transaction.atomic():
+        UnreadCounter.objects.bulk_create([UnreadCounter(user_id_id=user_id, conversation_id=conversation_id) for user_id, conversation_id in amounts], ignore_conflicts=True)
+        for (user_id, conversation_id), amount in amounts.items():
+            UnreadCounter.objects.filter(user_id=user_id, conversation_id=conversation_id).update(unread_count=F("unread_count") + amount)
+
+
+def decrement_unread(user_id, conversation_id, amount=1):
+    """
+    Atomically subtract ``amount`` from a user's unread counter, never going below zero.
+    """
+    UnreadCounter.objects.filter(user_id=user_id, conversation_id=conversation_id).update(unread_count=Greatest(F("unread_count") - amount, 0))
+
+
+def discount_unread_messages(messages):
+    """
+    Take the unread messages among ``messages`` off their recipients' counters,
+    one UPDATE per (recipient, conversation).
+    """
+    unread = messages.filter(recipient_id__isnull=False, read_at__isnull=True).order_by().values("recipient_id", "conversation_id").annotate(count=Count("pk"))
+    for row in unread:
+        decrement_unread(row["recipient_id"], row["conversation_id"], row["count"])
+
+
+def get_unread_count(user, conversation_id):
+    counter = UnreadCounter.objects.filter(user_id=user, conversation_id=conversation_id).values_list("unread_count", flat=True).first()
+    return counter or 0
+
+
+def mark_conversation_read(user, conversation_id, up_to=None):
+    """
+    Set read_at on every unread message ``user`` received in the conversation,
+    up to and including the message ``up_to`` when given, and return how many
+    messages were marked.
+    """
+    unread = Message.objects.filter(conversation_id=conversation_id, recipient_id=user, read_at__isnull=True)
+    if up_to is not None:
+        unread = unread.filter(Q(sent_at__lt=up_to.sent_at) | Q(sent_at=up_to.sent_at, message_id__lte=up_to.message_id))
+
+    with transaction.atomic():
+        # Only rows this UPDATE flips are subtracted, so concurrent readers
+        # and new incoming messages never push the counter out of step.
+        marked = unread.update(read_at=timezone.now())
+        if marked:
+            decrement_unread(user.pk, conversation_id, marked)
+            changed(conversation_ids=[conversation_id])
+    return marked
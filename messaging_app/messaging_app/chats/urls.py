@@ -1,16 +1,36 @@
 from django.urls import path, include
 from rest_framework_nested import routers
-from chats.views import UserViewSet, MessageViewSet, ConversationViewSet
+from chats.views import (
+    UserViewSet,
+    MessageViewSet,
+    ConversationViewSet,
+    PropertyViewSet,
+    BookingViewSet,
+    CouponRedeemView,
+    MessageBulkCreateView,
+    MessageSearchView,
+    NotificationViewSet,
+    PropertyAvailabilityView,
+    PropertyNearbyView,
+)
 
 router = routers.DefaultRouter()
 router.register(r"users", UserViewSet, basename="user")
 # router.register(r"messages", MessageViewSet, basename="message")
 router.register(r"conversations", ConversationViewSet, basename="conversation")
+router.register(r"properties", PropertyViewSet, basename="property")
+router.register(r"bookings", BookingViewSet, basename="booking")
+router.register(r"notifications", NotificationViewSet, basename="notification")
 
 conversations_router = routers.NestedDefaultRouter(router, r"conversations", lookup="conversation")
 conversations_router.register(r"messages", MessageViewSet, basename="conversation-message")
 
 urlpatterns = [
+    path("messages/bulk/", MessageBulkCreateView.as_view(), name="message-bulk-create"),
+    path("messages/search/", MessageSearchView.as_view(), name="message-search"),
+    path("properties/available/", PropertyAvailabilityView.as_view(), name="property-availability"),
+    path("properties/nearby/", PropertyNearbyView.as_view(), name="property-nearby"),
+    path("coupons/redeem/", CouponRedeemView.as_view(), name="coupon-redeem"),
     path("", include(router.urls)),
     path("", include(conversations_router.urls)),
 ]
@@ -0,0 +1,150 @@
+"""
+Per-resource versions behind ETags and the serialized-response cache.
+
+A version is an opaque token kept in the RESPONSE_CACHE cache and replaced
+with a fresh random one whenever the resource changes, so a token is never
+reused even if the cache evicts it. The resources are:
+
+- ``conversation:<id>``: a conversation, its participants and its messages
+- ``inbox:<user_id>``: a user's conversation list, including unread counts
+- ``conversations``: every conversation, as listed for admins
+- ``users``: user profiles, which are embedded in both
+
+Changes are collected per thread and only published once the surrounding
+transaction commits, so a reader can never cache data older than the
+version it was stored under. RESPONSE_CACHE must be shared between worker
+processes (e.g. Redis) for one worker's writes to reach the others.
+"""
+
+import abc
+import hashlib
+import threading
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.cache import patch_vary_headers
+from rest_framework import response, status
+
+from .authorization import get_role
+from .metrics import cache_requests
+from .replicas import read_from_primary
+from .models import Conversation
+
+_pending = threading.local()
+
+
+def get_cache():
+    return caches[getattr(settings, "RESPONSE_CACHE", "default")]
+
+
+def version_key(name):
+    return f"chats:version:{name}"
+
+
+def get_versions(names):
+    cache = get_cache()
+    keys = [version_key(name) for name in names]
+    found = cache.get_many(keys)
+    versions = []
+    for key in keys:
+        if key not in found:
+            # Keeps a token another process added first; never None, even if evicted meanwhile
+            found[key] = cache.get_or_set(key, uuid.uuid4().hex, None)
+        versions.append(found[key])
+    return versions
+
+
+def bump_versions(names):
+    if names:
+        get_cache().set_many({version_key(name): uuid.uuid4().hex for name in set(names)}, None)
+
+
+def conversation_version_names(conversation_ids, user_ids=()):
+    participants = Conversation.participants.through.objects.filter(conversation_id__in=conversation_ids).values_list("user_id", flat=True)
+    inboxes = {*participants, *user_ids} if conversation_ids else set(user_ids)
+    return ["conversations", *(f"conversation:{conversation_id}" for conversation_id in conversation_ids), *(f"inbox:{user_id}" for user_id in inboxes)]
+
+
+def publish_changes():
+    changes = getattr(_pending, "changes", None)
+    _pending.changes = None
+    if changes is None:
+        return
+    conversation_ids, user_ids, names = changes
+    bump_versions([*conversation_version_names(conversation_ids, user_ids), *names])
+
+
+def changed(conversation_ids=(), user_ids=(), names=()):
+    """
+    Record that conversations (with their participants' inboxes), extra users'
+    inboxes or other named resources changed, to be published on commit.
+
+    Changes left behind by a rolled-back transaction go out with the next
+    commit on this thread; a spare version bump only costs a cache miss.
+    """
+    if getattr(_pending, "changes", None) is None:
+        _pending.changes = (set(), set(), set())
+    pending_conversations, pending_users, pending_names = _pending.changes
+    pending_conversations.update(conversation_ids)
+    pending_users.update(user_ids)
+    pending_names.update(names)
+    transaction.on_commit(publish_changes)
+
+
+class VersionedResponseMixin(abc.ABC):
+    """
+    ETag / If-None-Match support and a cache of serialized output for list
+    and retrieve. Views name the versions their output depends on in
+    ``get_version_names()``; a 304 or a cache hit then costs only the
+    version lookups and whatever access check that method makes.
+    """
+
+    @abc.abstractmethod
+    def get_version_names(self):
+        """
+        The names (as passed to ``changed()``) of the versions this view's
+        output depends on.
+        """
+
+    def get_cache_scope(self):
+        """
+        Who may share a cached response: by default only the requesting user.
+        """
+        return f"{get_role(self.request.user)}:{self.request.user.pk}"
+
+    def list(self, request, *args, **kwargs):
+        return self.versioned_response(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.versioned_response(request, super().retrieve, *args, **kwargs)
+
+    def versioned_response(self, request, view, *args, **kwargs):
+        versions = get_versions([*self.get_version_names(), "users"])
+        digest = hashlib.sha1("|".join([*versions, self.get_cache_scope(), request.build_absolute_uri()]).encode()).hexdigest()
+        # Weak: the same data may be rendered by different renderers
+        etag = f'W/"{digest}"'
+
+        if etag in [tag.strip() for tag in request.headers.get("If-None-Match", "").split(",")]:
+            result = response.Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            cache = get_cache()
+            cache_key = f"chats:response:{digest}"
+            data = cache.get(cache_key)
+            cache_requests.inc("response", "hit" if data is not None else "miss")
+            if data is not None:
+                result = response.Response(data)
+            else:
+                # A lagging replica could be missing the write that made these
+                # versions, and its answer would then be cached under them
+                with read_from_primary():
+                    result = view(request, *args, **kwargs)
+                if result.status_code != status.HTTP_200_OK:
+                    return result
+                cache.set(cache_key, result.data, getattr(settings, "RESPONSE_CACHE_TTL", 300))
+
+        result["ETag"] = etag
+        result["Cache-Control"] = "private, no-cache"
+        patch_vary_headers(result, ["Authorization", "Cookie"])
+        return result
@@ -1,10 +1,52 @@
-from rest_framework import viewsets, permissions, exceptions, status, response
+import math
+import uuid
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import F, FilteredRelation, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.http import StreamingHttpResponse
+from django.utils.dateparse import parse_date
+from rest_framework import viewsets, mixins, permissions, exceptions, response, status, views
+from rest_framework.decorators import action
+from rest_framework.parsers import JSONParser
+from rest_framework.utils.urls import replace_query_param
 from rest_framework.permissions import IsAuthenticated
 from django_filters.rest_framework import DjangoFilterBackend
-from .models import User, Message, Conversation
-from .serializers import UserSerializer, MessageSerializer, ConversationSerializer
+from .authorization import can_access_conversation, get_role, is_participant, visible_messages
+from .availability import after_cursor, available_properties
+from .bookings import create_booking
+from .coupons import redeem_coupon
+from .export import iter_messages, stream_csv, stream_ndjson
+from .geo import properties_near
+from .ingest import ingest_messages
+from .notifications import audience, live_notifications, notify
+from .models import User, ArchivedMessage, Message, Conversation, UnreadCounter, Booking, Property
+from .pagination import MessageCursorPagination, NotificationPagination, PropertyPagination, decode_cursor, encode_cursor
+from .parsers import NDJSONParser
+from .realtime import broadcast_message
+from .replicas import ReplicaReadMixin
+from .search import search_messages
+from .serializers import (
+    UserSerializer,
+    MessageSerializer,
+    ConversationSerializer,
+    ConversationSummarySerializer,
+    NearbyPropertySerializer,
+    PropertySerializer,
+    RatedPropertySerializer,
+    BookingSerializer,
+    BookingCreateSerializer,
+    CouponRedeemSerializer,
+    NotificationSerializer,
+    NotificationBroadcastSerializer,
+    NotificationMarkReadSerializer,
+)
+from .unread import get_unread_count, mark_conversation_read
+from .versions import VersionedResponseMixin
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     """
     A viewSet for performing CRUD operations on the User model.
     """
@@ -18,6 +60,9 @@ class UserViewSet(viewsets.ModelViewSet):
         """
         serializer.save()
 
+    def perform_destroy(self, instance):
+        instance.soft_delete()
+
     def get_queryset(self):
         """
         Custom querySet based on the requesting user's role.
@@ -26,9 +71,9 @@ class UserViewSet(viewsets.ModelViewSet):
 
         if not user.is_authenticated:
             return User.objects.none()
-        
+
         # Get role with a default fallback
-        role = getattr(user, "role", "admin")
+        role = get_role(user, default="admin")
 
         if role == "admin":
             return User.objects.all()
@@ -36,45 +81,54 @@ class UserViewSet(viewsets.ModelViewSet):
             return User.objects.filter(role="guest")
         else:
             return User.objects.filter(user_id=user.user_id)
-        
 
-class MessageViewSet(viewsets.ModelViewSet):
+
+class MessageViewSet(ReplicaReadMixin, VersionedResponseMixin, viewsets.ModelViewSet):
     """
     A viewSet for performing CRUD operations on the Message model.
     """
     serializer_class = MessageSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = MessageCursorPagination
 
     def get_queryset(self):
+        return self.scope_messages(Message.objects)
+
+    def get_archive_queryset(self):
         """
-        Custom queryset based on the requesting user's role and the conversation ID.
+        The same messages from the archive, where the paginator looks once it pages past the hot table.
         """
-        user = self.request.user
+        return self.scope_messages(ArchivedMessage.objects)
 
-        if not user.is_authenticated:
-            return Message.objects.none()
+    def get_version_names(self):
+        return [f"conversation:{self.get_conversation_id()}"]
 
-        # Get the conversation ID from the URL
-        conversation_id = self.kwargs.get("conversation_pk")
-        if not conversation_id:
-            return response.Response("Conversation ID is required.", status=status.HTTP_400_BAD_REQUEST)
+    def scope_messages(self, manager):
+        """
+        The messages of the conversation in the URL the requesting user may read.
+        """
+        if not self.request.user.is_authenticated:
+            return manager.none()
+        return visible_messages(manager.select_related("sender_id", "recipient_id"), self.request.user, self.get_conversation_id())
 
-        # Ensure the conversation exists
-        try:
-            conversation = Conversation.objects.get(id=conversation_id)
-        except Conversation.DoesNotExist:
-            return response.Response({"error": "Conversation does not exist."}, status=status.HTTP_404_NOT_FOUND)
+    def get_conversation_id(self):
+        """
+        Return the conversation ID from the URL once the requesting user is
+        allowed into it, raising 404 otherwise.
 
-        # Get role with a default fallback
-        role = getattr(user, "role", "guest")
+        The check goes through the cached authorization layer, so neither
+        reads nor writes load the Conversation row itself.
+        """
+        # Get the conversation ID from the URL
+        try:
+            conversation_id = uuid.UUID(str(self.kwargs.get("conversation_pk")))
+        except ValueError:
+            raise exceptions.NotFound("Conversation does not exist.")
 
-        # Filter messages based on role and conversation
-        if role == "admin":
-            return Message.objects.filter(conversation_id=conversation_id)
-        elif role == "host":
-            return Message.objects.filter(conversation_id=conversation_id, sender_id=user.user_id)
-        else:
-            return Message.objects.filter(conversation_id=conversation_id, sender_id=user.user_id)
+        # Ensure the conversation exists and the user takes part in it
+        if not can_access_conversation(self.request.user, conversation_id):
+            raise exceptions.NotFound("Conversation does not exist.")
+        return conversation_id
 
     def perform_create(self, serializer):
         """
@@ -82,21 +136,333 @@ class MessageViewSet(viewsets.ModelViewSet):
         """
         user = self.request.user
 
-        # Get the conversation ID from the URL
-        conversation_id = self.kwargs.get("conversation_pk")
-        if not conversation_id:
-            raise exceptions.PermissionDenied("Conversation ID is required.")
+        conversation_id = self.get_conversation_id()
+
+        # Set the sender and conversation for the message
+        serializer.save(sender_id=user, conversation_id=conversation_id, recipient_id=self.get_recipient(conversation_id, serializer.validated_data.get("recipient_id")))
+
+        # Push the new message to participants connected over WebSocket
+        broadcast_message(conversation_id, user.pk, serializer.data)
+
+    def get_recipient(self, conversation_id, recipient):
+        """
+        The recipient given, which must be another participant, or else the
+        other participant of a one-to-one conversation; None in a group.
+        """
+        user = self.request.user
+        if recipient is not None:
+            if recipient.pk == user.pk or not is_participant(recipient, conversation_id):
+                raise exceptions.ValidationError({"recipient_id": ["Recipient must be another participant of the conversation."]})
+            return recipient
+
+        others = list(User.objects.filter(conversations=conversation_id).exclude(pk=user.pk)[:2])
+        return others[0] if len(others) == 1 else None
+
+    def perform_destroy(self, instance):
+        """
+        Messages are soft-deleted; purge_soft_deleted removes them for good later.
+        """
+        instance.soft_delete()
+
+    @action(detail=False, methods=["post"], url_path="mark-read")
+    def mark_read(self, request, conversation_pk=None):
+        """
+        Mark the requesting user's messages in the conversation as read, up to
+        and including ``message_id`` when given, otherwise all of them.
+        """
+        conversation_id = self.get_conversation_id()
+
+        up_to = None
+        message_id = request.data.get("message_id")
+        if message_id:
+            try:
+                up_to = Message.objects.get(message_id=message_id, conversation_id=conversation_id)
+            except (Message.DoesNotExist, ValidationError):
+                raise exceptions.NotFound("Message does not exist.")
+
+        marked = mark_conversation_read(request.user, conversation_id, up_to=up_to)
+        return response.Response({"marked": marked, "unread_count": get_unread_count(request.user, conversation_id)})
+
+
+class MessageBulkCreateView(views.APIView):
+    """
+    Import a batch of messages for one or more conversations.
+
+    Accepts a JSON array or an NDJSON body. Valid items are inserted in
+    batches inside a single transaction; invalid items are reported by index.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    parser_classes = [JSONParser, NDJSONParser]
+
+    def post(self, request):
+        items = request.data
+        if not isinstance(items, list):
+            raise exceptions.ValidationError("Expected a list of messages.")
 
-        # Ensure the conversation exists
+        max_items = getattr(settings, "MESSAGES_BULK_MAX_ITEMS", 50000)
+        if len(items) > max_items:
+            raise exceptions.ValidationError(f"At most {max_items} messages can be imported per request.")
+
+        batch_size = getattr(settings, "MESSAGES_BULK_BATCH_SIZE", 1000)
         try:
-            conversation = Conversation.objects.get(id=conversation_id)
-        except Conversation.DoesNotExist:
-            return response.Response({"error": "Conversation does not exist."}, status=status.HTTP_404_NOT_FOUND)
+            requested = int(request.query_params.get("batch_size", batch_size))
+        except ValueError:
+            raise exceptions.ValidationError("batch_size must be an integer.")
+        if requested > 0:
+            batch_size = min(requested, batch_size)
 
-        # Set the sender and conversation for the message
-        serializer.save(sender=user, conversation=conversation)
+        # Only admins may import messages on behalf of other senders
+        allow_sender = get_role(request.user) == "admin"
+        created, errors = ingest_messages(items, request.user, allow_sender=allow_sender, batch_size=batch_size)
+
+        status_code = status.HTTP_201_CREATED if created or not errors else status.HTTP_400_BAD_REQUEST
+        return response.Response({"created": created, "errors": errors}, status=status_code)
+
+
+class MessageSearchView(views.APIView):
+    """
+    Full-text search over messages in the conversations the requesting user takes part in.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        query = request.query_params.get("q", "").strip()
+        if not query:
+            raise exceptions.ValidationError("The q parameter is required.")
+
+        try:
+            limit = min(max(int(request.query_params.get("limit", 20)), 1), 100)
+        except ValueError:
+            raise exceptions.ValidationError("limit must be an integer.")
+
+        messages = search_messages(request.user, query, limit=limit)
+        return response.Response({"results": MessageSerializer(messages, many=True).data})
+
+
+class PropertyAvailabilityView(views.APIView):
+    """
+    Properties in a city that are free for a whole stay, cheapest first.
 
-class ConversationViewSet(viewsets.ModelViewSet):
+    Query parameters: ``city``, ``check_in`` and ``check_out`` (required),
+    ``country``, ``max_price``, ``limit`` and the ``cursor`` returned as ``next``.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        params = request.query_params
+        city = params.get("city")
+        check_in = parse_date(params.get("check_in", ""))
+        check_out = parse_date(params.get("check_out", ""))
+        if not city or check_in is None or check_out is None:
+            raise exceptions.ValidationError("city, check_in and check_out (YYYY-MM-DD) are required.")
+        if check_out <= check_in:
+            raise exceptions.ValidationError("check_out must be after check_in.")
+        if (check_out - check_in).days > getattr(settings, "AVAILABILITY_MAX_NIGHTS", 90):
+            raise exceptions.ValidationError("Stay is too long.")
+
+        try:
+            max_price = Decimal(params["max_price"]) if params.get("max_price") else None
+            limit = min(max(int(params.get("limit", 20)), 1), 100)
+            # Decimal() also accepts NaN and Infinity, which the price filter cannot compare
+            if max_price is not None and not max_price.is_finite():
+                raise ValueError
+        except (InvalidOperation, ValueError):
+            raise exceptions.ValidationError("max_price must be a number and limit an integer.")
+
+        queryset = available_properties(city, check_in, check_out, country=params.get("country"), max_price=max_price)
+        if params.get("cursor"):
+            try:
+                price, property_id = decode_cursor(params["cursor"], 2)
+                price = Decimal(price)
+                if not price.is_finite():
+                    raise ValueError
+                queryset = after_cursor(queryset, price, uuid.UUID(property_id))
+            except (InvalidOperation, ValueError):
+                raise exceptions.NotFound("Invalid cursor")
+
+        properties = list(queryset[: limit + 1])
+        next_link = None
+        if len(properties) > limit:
+            properties = properties[:limit]
+            last = properties[-1]
+            next_link = replace_query_param(request.build_absolute_uri(), "cursor", encode_cursor(last.price_per_night, last.property_id.hex))
+
+        return response.Response({"next": next_link, "results": PropertySerializer(properties, many=True).data})
+
+
+class PropertyNearbyView(views.APIView):
+    """
+    Properties within ``radius_km`` of ``latitude``/``longitude``, nearest first.
+
+    Also takes ``limit`` and the ``cursor`` returned as ``next``.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        params = request.query_params
+        try:
+            latitude = float(params["latitude"])
+            longitude = float(params["longitude"])
+            radius_km = float(params.get("radius_km", 10))
+            limit = min(max(int(params.get("limit", 20)), 1), 100)
+        except (KeyError, ValueError):
+            raise exceptions.ValidationError("latitude and longitude are required; radius_km and limit must be numbers.")
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+            raise exceptions.ValidationError("latitude or longitude is out of range.")
+        if not 0 < radius_km <= getattr(settings, "GEO_MAX_RADIUS_KM", 200):
+            raise exceptions.ValidationError("radius_km is out of range.")
+
+        after = None
+        if params.get("cursor"):
+            try:
+                distance, property_id = decode_cursor(params["cursor"], 2)
+                distance = float(distance)
+                if not math.isfinite(distance):
+                    raise ValueError
+                after = (distance, uuid.UUID(property_id))
+            except ValueError:
+                raise exceptions.NotFound("Invalid cursor")
+
+        nearby = list(properties_near(latitude, longitude, radius_km, after=after)[: limit + 1])
+        page = nearby[:limit]
+        next_link = None
+        if len(nearby) > limit:
+            last = page[-1]
+            next_link = replace_query_param(request.build_absolute_uri(), "cursor", encode_cursor(repr(last.distance_km), last.property_id.hex))
+
+        results = NearbyPropertySerializer([{"distance_km": prop.distance_km, "property": prop} for prop in page], many=True).data
+        return response.Response({"next": next_link, "results": results})
+
+
+class PropertyViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    A viewSet for browsing properties with their guest rating.
+
+    ``?ordering=rating`` sorts best rated first straight from the maintained
+    PropertyRating totals; no reviews are aggregated per request.
+    """
+    serializer_class = RatedPropertySerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = PropertyPagination
+
+    def get_queryset(self):
+        queryset = (
+            Property.objects.select_related("location_id")
+            .annotate(guest_rating=FilteredRelation("ratings", condition=Q(ratings__reviewed_by="guest")))
+            .annotate(average_rating=F("guest_rating__average_rating"), review_count=Coalesce(F("guest_rating__review_count"), 0))
+        )
+
+        if self.request.query_params.get("ordering") == "rating":
+            return queryset.order_by(F("average_rating").desc(nulls_last=True), "-review_count", "property_id")
+        return queryset.order_by("-created_at", "property_id")
+
+
+class BookingViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    """
+    A viewSet for listing bookings and creating new ones without double-booking.
+    """
+    serializer_class = BookingSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        """
+        Custom queryset based on the requesting user's role.
+        """
+        user = self.request.user
+
+        if not user.is_authenticated:
+            return Booking.objects.none()
+
+        role = get_role(user)
+
+        if role == "admin":
+            return Booking.objects.all()
+        elif role == "host":
+            return Booking.objects.filter(Q(property_id__host_id=user.user_id) | Q(user_id=user.user_id))
+        else:
+            return Booking.objects.filter(user_id=user.user_id)
+
+    def create(self, request):
+        serializer = BookingCreateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        booking = create_booking(request.user, data["property_id"], data["start_date"], data["end_date"], coupon_code=data.get("coupon_code"))
+        # The confirmation goes out when the booking is confirmed, from signals.notify_booking_confirmed
+        notify("booking_received", f"We received your booking from {booking.start_date} to {booking.end_date}.", [request.user.user_id])
+        return response.Response(BookingSerializer(booking).data, status=status.HTTP_201_CREATED)
+
+
+EXPORT_FORMATS = {
+    "ndjson": ("application/x-ndjson", stream_ndjson),
+    "csv": ("text/csv", stream_csv),
+}
+
+
+class CouponRedeemView(views.APIView):
+    """
+    Use up one redemption of a coupon for the current user, optionally on a property.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        serializer = CouponRedeemSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        prop = None
+        if serializer.validated_data.get("property_id"):
+            prop = Property.objects.filter(property_id=serializer.validated_data["property_id"]).first()
+            if prop is None:
+                raise exceptions.ValidationError({"property_id": ["Property does not exist."]})
+
+        coupon = redeem_coupon(serializer.validated_data["code"], request.user, prop=prop)
+        return response.Response(
+            {"code": coupon.code, "discount_type": coupon.discount_type, "discount_amount": str(coupon.discount_amount), "valid_to": coupon.valid_to},
+            status=status.HTTP_201_CREATED,
+        )
+
+
+class NotificationViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
+    """
+    The current user's live notifications, newest first; ``?is_read=false`` lists only unread ones.
+    """
+    serializer_class = NotificationSerializer
+    pagination_class = NotificationPagination
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        queryset = live_notifications(self.request.user)
+        is_read = self.request.query_params.get("is_read")
+        if is_read is not None:
+            queryset = queryset.filter(is_read=is_read.lower() in ("1", "true", "yes"))
+        return queryset
+
+    @action(detail=False, methods=["post"], url_path="mark-read")
+    def mark_read(self, request):
+        serializer = NotificationMarkReadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data.get("notification_ids")
+        unread = live_notifications(request.user).filter(is_read=False)
+        if ids:
+            unread = unread.filter(notification_id__in=ids)
+        return response.Response({"marked": unread.update(is_read=True)})
+
+    @action(detail=False, methods=["post"])
+    def broadcast(self, request):
+        """
+        Admins only: send a notification to a role, a list of users, or everyone.
+        """
+        if get_role(request.user) != "admin":
+            raise exceptions.PermissionDenied("Only admins can broadcast notifications.")
+        serializer = NotificationBroadcastSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        recipients = audience(user_ids=data.get("user_ids"), role=data.get("role"))
+        notify(data["event_type"], data["message"], recipients, expires_in=data.get("expires_in"))
+        return response.Response({"queued": True}, status=status.HTTP_202_ACCEPTED)
+
+
+class ConversationViewSet(ReplicaReadMixin, VersionedResponseMixin, viewsets.ModelViewSet):
     """
     A viewSet for performing CRUD operations on the Conversation model.
     """
@@ -115,18 +481,101 @@ class ConversationViewSet(viewsets.ModelViewSet):
             return Conversation.objects.none()
 
         # Get role with a default fallback
-        role = getattr(user, "role", "guest")
+        role = get_role(user)
+
+        # Participants are loaded in one extra query for the whole page.
+        # Messages are never embedded: they are paged through the nested
+        # messages endpoint instead.
+        queryset = Conversation.objects.prefetch_related("participants")
 
         # Filter conversations based on role
         if role == "admin":
-            queryset = Conversation.objects.prefetch_related("participants").all()
+            queryset = queryset.all()
         elif role == "host":
-            queryset = Conversation.objects.prefetch_related("participants").filter(participants=user.id)
+            queryset = queryset.filter(participants=user.user_id)
         else:
-            queryset = Conversation.objects.prefetch_related("participants").filter(participants=user.id)
-        
+            queryset = queryset.filter(participants=user.user_id)
+
+        if self.action == "list":
+            queryset = self.get_inbox_queryset(queryset, user)
+
         return queryset
 
+    def get_version_names(self):
+        user = self.request.user
+        if self.action == "list":
+            names = [f"inbox:{user.pk}"]
+            if get_role(user) == "admin":
+                names.append("conversations")
+            return names
+
+        # Check access up front so a 304 or cached body is never served to an outsider
+        try:
+            conversation_id = uuid.UUID(str(self.kwargs.get(self.lookup_url_kwarg or self.lookup_field)))
+        except ValueError:
+            raise exceptions.NotFound("Conversation does not exist.")
+        if not can_access_conversation(user, conversation_id):
+            raise exceptions.NotFound("Conversation does not exist.")
+        return [f"conversation:{conversation_id}"]
+
+    def get_cache_scope(self):
+        # A conversation reads the same for everyone of a role allowed into it
+        if self.action == "retrieve":
+            return get_role(self.request.user)
+        return super().get_cache_scope()
+
+    def get_inbox_queryset(self, queryset, user):
+        """
+        Annotate the last message, unread count and last activity of each
+        conversation and sort by most recent activity.
+        """
+        latest = Message.objects.filter(conversation=OuterRef("pk")).order_by("-sent_at", "-message_id")
+        unread = UnreadCounter.objects.filter(conversation=OuterRef("pk"), user_id=user.user_id).values("unread_count")
+
+        return queryset.annotate(
+            last_message_id=Subquery(latest.values("message_id")[:1]),
+            last_message_sender_id=Subquery(latest.values("sender_id")[:1]),
+            last_message_body=Subquery(latest.values("message_body")[:1]),
+            last_message_sent_at=Subquery(latest.values("sent_at")[:1]),
+            last_activity_at=Coalesce(Subquery(latest.values("sent_at")[:1]), F("created_at")),
+            unread_count=Coalesce(Subquery(unread[:1]), 0),
+        ).order_by("-last_activity_at", "-conversation_id")
+
+    @action(detail=True, methods=["get"])
+    def export(self, request, pk=None):
+        """
+        Stream the message history of the conversation as NDJSON (default)
+        or CSV, selected with ``?file_format=``; the same messages the nested
+        message endpoint shows the requesting user.
+        """
+        conversation = self.get_object()
+
+        file_format = request.query_params.get("file_format", "ndjson")
+        if file_format not in EXPORT_FORMATS:
+            raise exceptions.ValidationError(f"file_format must be one of: {', '.join(EXPORT_FORMATS)}.")
+        content_type, stream = EXPORT_FORMATS[file_format]
+
+        # Archived messages first, as they are the older ones
+        querysets = [visible_messages(model.objects, request.user, conversation.conversation_id) for model in (ArchivedMessage, Message)]
+        rows = iter_messages(querysets, chunk_size=getattr(settings, "MESSAGES_EXPORT_CHUNK_SIZE", 2000))
+        export = StreamingHttpResponse(stream(rows), content_type=content_type)
+        export["Content-Disposition"] = f'attachment; filename="conversation-{conversation.conversation_id}.{file_format}"'
+        return export
+
+    @action(detail=False, methods=["get"])
+    def unread(self, request):
+        """
+        Unread badge counts for the requesting user, read from the maintained counters.
+        """
+        counters = UnreadCounter.objects.filter(user_id=request.user.user_id, unread_count__gt=0).values_list("conversation_id", "unread_count")
+        conversations = {str(conversation_id): count for conversation_id, count in counters}
+        return response.Response({"total": sum(conversations.values()), "conversations": conversations})
+
+    def get_serializer_class(self):
+        if self.action == "list":
+            return ConversationSummarySerializer
+        return super().get_serializer_class()
+
     def perform_create(self, serializer):
         """
         Custom logic for creating a new conversation.
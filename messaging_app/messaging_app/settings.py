@@ -14,6 +14,8 @@ from pathlib import Path
 import environ
 import os
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 
 BASE_DIR = Path(__file__).resolve().parent
@@ -43,6 +45,8 @@ ALLOWED_HOSTS = []
 # Application definition
 
 INSTALLED_APPS = [
+    # daphne must come first so runserver serves the ASGI application
+    "daphne",
     "django.contrib.admin",
     "django.contrib.auth",
     "django.contrib.contenttypes",
@@ -58,11 +62,16 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Removes itself unless one of the PROFILE_* settings below enables it
+    "chats.profiling.ProfilingMiddleware",
+    "chats.metrics.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    # Inside the session middleware, so saving a session does not count as a write
+    "chats.replicas.ReplicaPinMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -87,6 +96,18 @@ TEMPLATES = [
 
 WSGI_APPLICATION = "wsgi.application"
 
+ASGI_APPLICATION = "asgi.application"
+
+# Channel layer used to fan new messages out to WebSocket subscribers.
+# The in-memory layer only reaches sockets in the same process; set REDIS_URL
+# to share it between workers.
+REDIS_URL = env("REDIS_URL", default=None)
+
+if REDIS_URL:
+    CHANNEL_LAYERS = {"default": {"BACKEND": "channels_redis.core.RedisChannelLayer", "CONFIG": {"hosts": [REDIS_URL]}}}
+else:
+    CHANNEL_LAYERS = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+
 
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
@@ -99,22 +120,176 @@ DATABASES = {
         "PASSWORD": env("DB_PASSWORD"),
         "HOST": env("DB_HOST"),
         "PORT": env("DB_PORT"),
+        # Keep a connection open this many seconds between requests instead of
+        # reconnecting each time (0 closes it after every request), pinging a
+        # reused one first so a dropped connection is replaced, not reported.
+        "CONN_MAX_AGE": env.int("DB_CONN_MAX_AGE", default=60),
+        "CONN_HEALTH_CHECKS": env.bool("DB_CONN_HEALTH_CHECKS", default=True),
+        "OPTIONS": {"connect_timeout": env.int("DB_CONNECT_TIMEOUT", default=5)},
     }
 }
 
+# DB_POOL=true switches to chats.db.mysql, which shares a pool of open
+# connections between all threads of a worker process, so ASGI workers
+# (where Django advises against CONN_MAX_AGE) reuse connections too.
+# Each worker keeps up to DB_POOL_SIZE idle connections and holds at most
+# DB_POOL_MAX_CONNECTIONS at once; size max_connections on the server for
+# workers x DB_POOL_MAX_CONNECTIONS.
+if env.bool("DB_POOL", default=False):
+    DATABASES["default"].update(
+        {
+            "ENGINE": "chats.db.mysql",
+            "CONN_MAX_AGE": 0,
+            "POOL": {
+                "SIZE": env.int("DB_POOL_SIZE", default=5),
+                "MAX_CONNECTIONS": env.int("DB_POOL_MAX_CONNECTIONS", default=10),
+                "TIMEOUT": env.int("DB_POOL_TIMEOUT", default=10),
+                "RECYCLE": env.int("DB_POOL_RECYCLE", default=3600),
+            },
+        }
+    )
+
+# Read replicas: DB_REPLICA_HOSTS=host1,host2 adds replica_1, replica_2, ...
+# with the primary's credentials. Safe requests on viewsets using
+# chats.replicas.ReplicaReadMixin read from them round-robin.
+DATABASE_REPLICAS = []
+for _index, _host in enumerate(env.list("DB_REPLICA_HOSTS", default=[]), start=1):
+    DATABASES[f"replica_{_index}"] = {**DATABASES["default"], "HOST": _host, "TEST": {"MIRROR": "default"}}
+    DATABASE_REPLICAS.append(f"replica_{_index}")
+
+DATABASE_ROUTERS = ["chats.replicas.ReplicaRouter"]
+
+# Seconds between health checks of each replica, per process
+REPLICA_HEALTH_CHECK_INTERVAL = env.int("REPLICA_HEALTH_CHECK_INTERVAL", default=5)
+# Seconds a user reads from the primary after any request that wrote; set REPLICA_PIN_CACHE
+# to a CACHES alias to share pins between workers.
+REPLICA_PIN_SECONDS = env.int("REPLICA_PIN_SECONDS", default=5)
+REPLICA_PIN_CACHE = env("REPLICA_PIN_CACHE", default=None)
+
 
 # DRF configuration
 REST_FRAMEWORK = {
-    # "DEFAULT_AUTHENTICATION_CLASSES": [
-    #     "rest_framework.authentication.BasicAuthentication",
-    #     "rest_framework.authentication.SessionAuthentication",  # For browser-based authentication
-    #     "rest_framework.authentication.TokenAuthentication",  # For token-based authentication
-    # ],
+    "DEFAULT_AUTHENTICATION_CLASSES": [
+        "chats.authentication.UserTokenAuthentication",  # Bearer tokens from UserToken
+        "chats.authentication.CachedBasicAuthentication",  # Email and password of a chats user
+        "rest_framework.authentication.SessionAuthentication",  # For browser-based authentication
+    ],
     "DEFAULT_PERMISSION_CLASSES": [
         "rest_framework.permissions.IsAuthenticated",  # Default permission for authenticated users
     ],
 }
 
+# Participant membership cache used by chats.authorization. Set
+# AUTHORIZATION_CACHE to a CACHES alias to share answers between workers.
+AUTHORIZATION_CACHE = env("AUTHORIZATION_CACHE", default=None)
+AUTHORIZATION_CACHE_TTL = env.int("AUTHORIZATION_CACHE_TTL", default=30)
+AUTHORIZATION_CACHE_SIZE = env.int("AUTHORIZATION_CACHE_SIZE", default=10000)
+
+# Keyset pagination for /api/conversations/{pk}/messages/
+MESSAGES_PAGE_SIZE = env.int("MESSAGES_PAGE_SIZE", default=50)
+MESSAGES_MAX_PAGE_SIZE = env.int("MESSAGES_MAX_PAGE_SIZE", default=200)
+
+# Bulk import at /api/messages/bulk/
+MESSAGES_BULK_BATCH_SIZE = env.int("MESSAGES_BULK_BATCH_SIZE", default=1000)
+MESSAGES_BULK_MAX_ITEMS = env.int("MESSAGES_BULK_MAX_ITEMS", default=50000)
+
+# Message search: newest index matches considered per query, and the age in
+# days at which a match's score halves
+SEARCH_CANDIDATES = env.int("SEARCH_CANDIDATES", default=500)
+SEARCH_HALF_LIFE_DAYS = env.int("SEARCH_HALF_LIFE_DAYS", default=30)
+
+# Longest stay accepted by /api/properties/available/
+AVAILABILITY_MAX_NIGHTS = env.int("AVAILABILITY_MAX_NIGHTS", default=90)
+
+# Largest radius accepted by /api/properties/nearby/
+GEO_MAX_RADIUS_KM = env.int("GEO_MAX_RADIUS_KM", default=200)
+
+# Rows fetched per query when streaming /api/conversations/{pk}/export/
+MESSAGES_EXPORT_CHUNK_SIZE = env.int("MESSAGES_EXPORT_CHUNK_SIZE", default=2000)
+
+# Messages older than this move to the MessageArchive table (manage.py archive_messages)
+MESSAGES_ARCHIVE_AFTER_DAYS = env.int("MESSAGES_ARCHIVE_AFTER_DAYS", default=180)
+
+# Retries of a booking that lost a lock timeout or deadlock before answering 503
+BOOKING_RETRIES = env.int("BOOKING_RETRIES", default=3)
+
+# Per-process cache of coupons by code. Edits made through another process
+# show up here within COUPON_CACHE_TTL seconds; a used-up code is refused
+# without a query for COUPON_EXHAUSTED_TTL seconds.
+COUPON_CACHE_SIZE = env.int("COUPON_CACHE_SIZE", default=10000)
+COUPON_CACHE_TTL = env.int("COUPON_CACHE_TTL", default=60)
+COUPON_EXHAUSTED_TTL = env.int("COUPON_EXHAUSTED_TTL", default=5)
+
+# Notification fan-out: background writer threads per process and users per INSERT
+NOTIFICATION_FANOUT_WORKERS = env.int("NOTIFICATION_FANOUT_WORKERS", default=4)
+NOTIFICATION_FANOUT_CHUNK_SIZE = env.int("NOTIFICATION_FANOUT_CHUNK_SIZE", default=1000)
+
+# Process-local unless CACHE_URL points at a shared cache, e.g. redis://redis:6379/1
+CACHES = {"default": env.cache("CACHE_URL", default="locmemcache://")}
+
+# ETags and cached conversation/message output (chats.versions). The alias
+# must be shared between workers, or their versions drift apart.
+RESPONSE_CACHE = env("RESPONSE_CACHE", default="default")
+RESPONSE_CACHE_TTL = env.int("RESPONSE_CACHE_TTL", default=300)
+
+# Request profiling (chats.profiling). PROFILE_REQUESTS adds a Server-Timing
+# header to every response; PROFILE_HEADER (e.g. X-Profile) names a request
+# header that does so for one request (under DEBUG, or for admins and bearer
+# token clients); PROFILE_SAMPLE_RATE logs that fraction of requests to the
+# chats.profiling logger. All off by default.
+PROFILE_REQUESTS = env.bool("PROFILE_REQUESTS", default=False)
+PROFILE_HEADER = env("PROFILE_HEADER", default=None)
+PROFILE_SAMPLE_RATE = env.float("PROFILE_SAMPLE_RATE", default=0.0)
+PROFILE_MEMORY = env.bool("PROFILE_MEMORY", default=True)
+
+# Prometheus metrics at /metrics (chats.metrics). With several workers, point
+# METRICS_DIR at a directory they all share and that is emptied on start;
+# other workers' counts are at most METRICS_FLUSH_INTERVAL seconds old.
+# METRICS_TOKEN must be sent as a bearer token by the scraper; without one
+# the endpoint answers only under DEBUG.
+METRICS_ENABLED = env.bool("METRICS_ENABLED", default=True)
+METRICS_DIR = env("METRICS_DIR", default=None)
+METRICS_FLUSH_INTERVAL = env.float("METRICS_FLUSH_INTERVAL", default=5)
+METRICS_TOKEN = env("METRICS_TOKEN", default=None)
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {"console": {"class": "logging.StreamHandler"}},
+    "loggers": {"chats.profiling": {"handlers": ["console"], "level": "INFO"}},
+}
+
+# Preferred password hasher: pbkdf2, argon2 (needs argon2-cffi) or bcrypt
+# (needs bcrypt); both are in requirements.txt. Hashes made by the others
+# still verify and are rehashed with the preferred one at the user's next
+# successful login.
+PASSWORD_HASHER = env("PASSWORD_HASHER", default="pbkdf2")
+_PASSWORD_HASHERS = {
+    "argon2": "django.contrib.auth.hashers.Argon2PasswordHasher",
+    "bcrypt": "django.contrib.auth.hashers.BCryptSHA256PasswordHasher",
+    "pbkdf2": "django.contrib.auth.hashers.PBKDF2PasswordHasher",
+}
+if PASSWORD_HASHER not in _PASSWORD_HASHERS:
+    raise ImproperlyConfigured(f"PASSWORD_HASHER must be one of {', '.join(sorted(_PASSWORD_HASHERS))}, not {PASSWORD_HASHER!r}.")
+PASSWORD_HASHERS = [
+    _PASSWORD_HASHERS[PASSWORD_HASHER],
+    *(hasher for name, hasher in _PASSWORD_HASHERS.items() if name != PASSWORD_HASHER),
+    "django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher",
+    "django.contrib.auth.hashers.ScryptPasswordHasher",
+]
+
+# Seconds a verified email/password pair is accepted again without rehashing
+# (chats.authentication), per process
+CREDENTIAL_CACHE_TTL = env.int("CREDENTIAL_CACHE_TTL", default=60)
+CREDENTIAL_CACHE_SIZE = env.int("CREDENTIAL_CACHE_SIZE", default=10000)
+
+# Bearer token answers cached per process (chats.authentication). A valid
+# token is cached for at most TOKEN_CACHE_TTL seconds and never past its
+# expiry, so a revocation made by another process applies within that time.
+TOKEN_CACHE_TTL = env.int("TOKEN_CACHE_TTL", default=60)
+TOKEN_NEGATIVE_CACHE_TTL = env.int("TOKEN_NEGATIVE_CACHE_TTL", default=30)
+TOKEN_CACHE_SIZE = env.int("TOKEN_CACHE_SIZE", default=10000)
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 